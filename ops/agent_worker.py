@@ -1,43 +1,134 @@
-﻿import os, time, json, uuid, logging, threading
+﻿import os, re, sys, time, json, uuid, fcntl, random, asyncio, itertools, logging
 from logging.handlers import RotatingFileHandler
+from collections import Counter, deque
 from datetime import datetime, timezone
-import requests
+from email.utils import parsedate_to_datetime
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sentinel_engine.job_lanes import Lanes, parse_lanes, share
+from sentinel_engine.job_telemetry import Telemetry, parse_ts, serve_prometheus
+from sentinel_engine.secops import scan_job
 
 # -------- config --------
 BASE_URL = os.getenv("SENTINEL_BASE_URL", "http://127.0.0.1:8001")
-API_KEY  = os.getenv("SENTINEL_API_KEY")
-if not API_KEY:
-    env_path = os.path.join(os.path.dirname(__file__), "..", ".env")
-    with open(env_path, "r", encoding="utf-8") as f:
-        for line in f:
-            if line.startswith("SENTINEL_API_KEY="):
-                API_KEY = line.split("=",1)[1].strip()
-                break
+API_KEY  = os.getenv("SENTINEL_API_KEY")  # else read from ../.env by main(), see load_api_key()
 TENANT  = os.getenv("SENTINEL_TENANT", "default")
 NAME    = os.getenv("SENTINEL_AGENT_NAME", "dev-agent-1")
 VERSION = os.getenv("SENTINEL_AGENT_VERSION", "0.1.0")
-HEADERS = {"X-API-Key": API_KEY, "Content-Type": "application/json"}
+CLAIM_BATCH = max(int(os.getenv("SENTINEL_CLAIM_BATCH", "8")), 1)
+# long-poll seconds per claim, capped at the server's MAX_CLAIM_WAIT (routes/jobs.py cuts longer waits)
+MAX_CLAIM_WAIT = 60
+CLAIM_WAIT  = min(max(int(os.getenv("SENTINEL_CLAIM_WAIT", "30")), 0), MAX_CLAIM_WAIT)
+# jobs run concurrently on one event loop; claims only ask for as many jobs as there are free slots.
+# The slot count adapts (AIMD) between MIN_CONCURRENCY and CONCURRENCY to what the server sustains.
+CONCURRENCY = max(int(os.getenv("SENTINEL_WORKER_CONCURRENCY", "8")), 1)
+MIN_CONCURRENCY = min(max(int(os.getenv("SENTINEL_MIN_CONCURRENCY", "1")), 1), CONCURRENCY)
+AIMD_DECREASE = min(max(float(os.getenv("SENTINEL_AIMD_DECREASE", "0.5")), 0.1), 0.9)
+# control-plane latency above this multiple of its observed floor counts as overload
+AIMD_LATENCY_FACTOR = max(float(os.getenv("SENTINEL_AIMD_LATENCY_FACTOR", "3")), 1.5)
+# per-kind caps within CONCURRENCY, as "http:16,echo:4"; kinds not listed are only bound by CONCURRENCY
+KIND_LIMITS = os.getenv("SENTINEL_KIND_CONCURRENCY", "")
+# claimed-ahead jobs per process, trimmed so buffered work starts within half a lease (server's job lease)
+PREFETCH = max(int(os.getenv("SENTINEL_PREFETCH", str(CONCURRENCY))), 0)
+LEASE_SECONDS = float(os.getenv("SENTINEL_JOB_LEASE_SECONDS", "300"))
+# completions go out as one complete:batch per ACK_BATCH results or ACK_INTERVAL_MS, whichever is first
+ACK_BATCH = max(int(os.getenv("SENTINEL_ACK_BATCH", "32")), 1)
+ACK_INTERVAL_MS = max(float(os.getenv("SENTINEL_ACK_INTERVAL_MS", "20")), 0)
+# completions are journaled here (fsync per flush) before they are sent, and replayed after outages
+SPOOL_DIR = os.getenv("SENTINEL_SPOOL_DIR", os.path.join(os.path.dirname(__file__), "spool"))
+REPLAY_BATCH = max(int(os.getenv("SENTINEL_REPLAY_BATCH", "500")), 1)
+REPLAY_MAX_BACKOFF = 30
+# latency histograms (job_telemetry), served on a local Prometheus endpoint and sent with heartbeats
+METRICS_HOST = os.getenv("SENTINEL_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("SENTINEL_METRICS_PORT", "9108"))  # 0 = no endpoint
+# "http": one request per register/heartbeat/claim/complete; "ws": all of them as frames on one
+# WebSocket to /v0/agents/ws (needs the websockets package), with assignments pushed by the server
+TRANSPORT = os.getenv("SENTINEL_TRANSPORT", "http").lower()
+# keep-alive pools: control plane (claim/heartbeat/complete) and job traffic (handle_http) are separate,
+# so a burst of slow job requests can never starve heartbeats of a connection
+API_POOL  = max(int(os.getenv("SENTINEL_API_POOL", str(CONCURRENCY + 2))), 2)
+JOB_POOL  = max(int(os.getenv("SENTINEL_JOB_POOL", "64")), 1)
+KEEPALIVE = float(os.getenv("SENTINEL_HTTP_KEEPALIVE", "30"))
+# control-plane retries: exponential backoff with full jitter, base SENTINEL_HTTP_BACKOFF seconds
+RETRIES = max(int(os.getenv("SENTINEL_HTTP_RETRIES", "3")), 0)
+BACKOFF = float(os.getenv("SENTINEL_HTTP_BACKOFF", "0.2"))
+RETRY_STATUS = {429, 502, 503, 504}
+MAX_RETRY_AFTER = 300
+# execution lanes per kind (see sentinel_engine/job_lanes.py): "kind:inline|thread|process,..."
+JOB_LANES = os.getenv("SENTINEL_JOB_LANES", "")
+PROCESS_WORKERS = int(os.getenv("SENTINEL_PROCESS_WORKERS", "0")) or None  # None = cpu count
+SHM_THRESHOLD = int(os.getenv("SENTINEL_SHM_THRESHOLD", str(1 << 20)))
 
 # -------- logging --------
+# Nothing at import time touches .env or the log file: process-lane children
+# (spawned, see job_lanes) import this module again. setup_logging() and
+# load_api_key() run for the real worker only.
 LOG_DIR = os.path.join(os.path.dirname(__file__), "logs")
-os.makedirs(LOG_DIR, exist_ok=True)
 logger = logging.getLogger("worker")
-logger.setLevel(logging.INFO)
-fh = RotatingFileHandler(os.path.join(LOG_DIR, "agent_worker.log"), maxBytes=2_000_000, backupCount=5)
-fh.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
-logger.addHandler(fh)
+
+def setup_logging():
+    os.makedirs(LOG_DIR, exist_ok=True)
+    logger.setLevel(logging.INFO)
+    fh = RotatingFileHandler(os.path.join(LOG_DIR, "agent_worker.log"), maxBytes=2_000_000, backupCount=5)
+    fh.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logger.addHandler(fh)
+
+def load_api_key():
+    if API_KEY:
+        return API_KEY
+    env_path = os.path.join(os.path.dirname(__file__), "..", ".env")
+    with open(env_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("SENTINEL_API_KEY="):
+                return line.split("=",1)[1].strip()
+    return None
 
 def now_utc():
     return datetime.now(timezone.utc).isoformat()
 
+def parse_kind_limits(spec):
+    # "http:16,echo:4" -> {"http": 16, "echo": 4}
+    out = {}
+    for part in spec.split(","):
+        if ":" not in part:
+            continue
+        kind, n = (x.strip() for x in part.split(":", 1))
+        try:
+            out[kind] = max(int(n), 1)
+        except ValueError:
+            logger.warning(f"ignoring bad SENTINEL_KIND_CONCURRENCY entry {part!r}")
+    return out
+
+# Two pooled keep-alive clients per process, see API_POOL / JOB_POOL; set up in main().
+api: httpx.AsyncClient | None = None
+jobs_http: httpx.AsyncClient | None = None
+channel = None  # Channel, with SENTINEL_TRANSPORT=ws
+
+def make_client(size, retries=0, **kw):
+    # transport retries only cover failed connects, so they are safe for any method.
+    # The limits belong on the transport: a client given one ignores its own.
+    limits = httpx.Limits(max_connections=size, max_keepalive_connections=size, keepalive_expiry=KEEPALIVE)
+    return httpx.AsyncClient(
+        transport=httpx.AsyncHTTPTransport(retries=retries, limits=limits),
+        timeout=httpx.Timeout(30, pool=None),  # wait for a pooled connection rather than fail
+        **kw,
+    )
+
 # -------- job handlers --------
-def handle_echo(job):
+# Coroutine handlers run on the loop, plain functions in a thread and
+# @cpu_bound ones (module-level, importable by the pool's children) in the
+# process pool, unless SENTINEL_JOB_LANES says otherwise. Shared (job_lanes.share)
+# with any other handler set in this process, e.g. EnhancedJobHandlers.
+lanes = share(Lanes(parse_lanes(JOB_LANES), process_workers=PROCESS_WORKERS, shm_threshold=SHM_THRESHOLD))
+
+async def handle_echo(job):
     payload = json.loads(job.get("payload_json") or "{}")
     msg = payload.get("msg", "")
     logger.info(f"[echo] {msg}")
     return {"ok": True, "echo": msg, "handled_at": now_utc()}
 
-def handle_http(job):
+async def handle_http(job):
     payload = json.loads(job.get("payload_json") or "{}")
     method  = str(payload.get("method", "GET")).upper()
     url     = payload.get("url")
@@ -46,81 +137,751 @@ def handle_http(job):
     if not url:
         return {"ok": False, "error": "missing url"}
 
-    r = requests.request(method, url, headers=headers, json=data, timeout=30)
+    r = await jobs_http.request(method, url, headers=headers, json=data, timeout=30)
     body_sample = r.text[:1000] if isinstance(r.text, str) else None
     return {"ok": True, "status_code": r.status_code, "body_sample": body_sample, "handled_at": now_utc()}
 HANDLERS = {
     "echo": handle_echo,
     "http": handle_http,
+    "safety_scan": scan_job,
 }
 
+def process_kinds():
+    return sorted(k for k, h in HANDLERS.items() if lanes.lane_for(k, h) == "process")
+
+# -------- adaptive concurrency --------
+class Aimd:
+    """
+    Slot count under additive-increase / multiplicative-decrease.
+
+    While the control plane answers quickly, every job that finishes with
+    all slots busy adds 1/limit slots (about one slot per round of jobs).
+    A 429, a 5xx, a dropped connection or control-plane latency past
+    AIMD_LATENCY_FACTOR x its floor multiplies the limit by AIMD_DECREASE,
+    at most once per cooldown so one burst of errors counts once. Retry-After
+    also pauses every non-urgent control-plane call until it has passed. A
+    fleet of workers doing this converges on the server's capacity.
+    """
+
+    def __init__(self, lo, hi):
+        self.lo, self.hi = lo, hi
+        self.limit = float(max(lo, hi // 2))
+        self.floor = None  # lowest recent control-plane latency
+        self.latency = None  # EWMA
+        self.last_cut = 0.0
+        self.not_before = 0.0
+        self.on_change = None
+
+    def slots(self):
+        return int(self.limit)
+
+    def _set(self, limit):
+        before = self.slots()
+        self.limit = min(max(limit, self.lo), self.hi)
+        if self.slots() != before:
+            logger.info(f"concurrency {before} -> {self.slots()}")
+            if self.on_change:
+                self.on_change()
+
+    def congested(self):
+        return self.latency is not None and self.latency > AIMD_LATENCY_FACTOR * self.floor
+
+    def sample(self, seconds):
+        # the floor creeps up slowly so a permanently slower server becomes the new normal
+        self.floor = seconds if self.floor is None else min(seconds, self.floor + (seconds - self.floor) * 0.01)
+        self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+        if self.congested():
+            self.cut()
+
+    def grow(self):
+        if not self.congested() and time.monotonic() >= self.not_before:
+            self._set(self.limit + 1 / self.limit)
+
+    def cut(self, retry_after=None):
+        now = time.monotonic()
+        if retry_after:
+            self.not_before = max(self.not_before, now + min(retry_after, MAX_RETRY_AFTER))
+        # one cut per cooldown (about one control-plane round trip, at least 1s)
+        if now - self.last_cut >= max(1.0, 2 * (self.latency or 0)):
+            self.last_cut = now
+            self._set(self.limit * AIMD_DECREASE)
+
+    async def pause(self):
+        wait = self.not_before - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+aimd = Aimd(MIN_CONCURRENCY, CONCURRENCY)
+
+def retry_after(r):
+    value = r.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
 # -------- api helpers (v0) --------
-def post(path, body):
+async def call(method, path, body=None, timeout=30, urgent=False):
+    # Retries dropped connections, 429s and gateway errors. Every control-plane
+    # call is safe to repeat: complete and heartbeat are idempotent, and jobs
+    # from a claim whose response was lost are requeued when their lease lapses.
+    # Outcomes feed the AIMD controller; urgent calls (heartbeats, which keep
+    # leases alive) skip the Retry-After pause.
     url = f"{BASE_URL}/v0{path}"
-    r = requests.post(url, headers=HEADERS, data=json.dumps(body), timeout=30)
+    content = json.dumps(body) if body is not None else None
+    for attempt in range(RETRIES + 1):
+        if not urgent:
+            await aimd.pause()
+        try:
+            started = time.monotonic()
+            r = await api.request(method, url, content=content, timeout=timeout)
+            if r.status_code == 429 or r.status_code >= 500:
+                aimd.cut(retry_after(r))
+            elif method == "POST":
+                aimd.sample(time.monotonic() - started)  # GET claims long-poll on purpose
+            if r.status_code not in RETRY_STATUS or attempt == RETRIES:
+                break
+        except httpx.TransportError:
+            aimd.cut()
+            if attempt == RETRIES:
+                raise
+        await asyncio.sleep(random.uniform(0, BACKOFF * (2 ** attempt)))
     if r.status_code >= 400:
-        raise RuntimeError(f"POST {url} -> {r.status_code} {r.text}")
+        raise RuntimeError(f"{method} {url} -> {r.status_code} {r.text}")
     return r.json() if r.text else {}
 
-def get(path):
-    url = f"{BASE_URL}/v0{path}"
-    r = requests.get(url, headers=HEADERS, timeout=30)
-    if r.status_code >= 400:
-        raise RuntimeError(f"GET {url} -> {r.status_code} {r.text}")
-    return r.json() if r.text else {}
+async def post(path, body):
+    return await call("POST", path, body)
 
-# -------- heartbeat thread --------
-def heartbeat_loop(agent_id, interval):
+async def get(path, timeout=30):
+    return await call("GET", path, timeout=timeout)
+
+# -------- telemetry --------
+# claim, queue-wait, handler and completion latency histograms; see job_telemetry
+telemetry = Telemetry()
+
+# -------- heartbeat task --------
+async def heartbeat_loop(agent_id, interval):
     interval = max(int(interval or 30), 10)
     while True:
         try:
-            post("/agents/heartbeat", {"agent_id": str(agent_id)})
+            if channel is not None:
+                await channel.request("heartbeat", urgent=True, telemetry=telemetry.snapshot())
+            else:
+                await call("POST", "/agents/heartbeat", {"agent_id": str(agent_id), "telemetry": telemetry.snapshot()},
+                           urgent=True)
         except Exception as e:
             logger.warning(f"heartbeat failed: {e}")
-        time.sleep(interval)
+        await asyncio.sleep(interval)
 
-def main():
-    reg = post("/agents/register", {"name": NAME, "tenant": TENANT, "version": VERSION})
-    agent_id = reg.get("agent_id") or reg.get("id") or str(uuid.uuid4())
-    hb_int   = reg.get("heartbeat_interval", 30)
-    logger.info(f"registered agent_id={agent_id} heartbeat_interval={hb_int}")
+# -------- websocket channel --------
+class Channel:
+    """
+    SENTINEL_TRANSPORT=ws: register, heartbeat, claim and complete as JSON
+    frames on one connection to /v0/agents/ws, authenticated once. A claim
+    adds credit on the server, which pushes "assign" frames as jobs become
+    claimable, and "cancel" frames for jobs this agent no longer holds. A
+    dropped connection is redialled by the next request, the registration
+    resumed and the outstanding credit asked for again (the server requeues
+    what it had assigned on the old connection); completes that fail
+    meanwhile go to the spool, as they do over HTTP.
+    """
 
-    t = threading.Thread(target=heartbeat_loop, args=(agent_id, hb_int), daemon=True)
-    t.start()
+    def __init__(self, url, headers):
+        self.url = url
+        self.headers = headers
+        self.agent_id = None
+        self.on_cancel = lambda ids: None
+        self.credit = 0  # asked for and not yet handed to the claim loop
+        self.queued = 0  # jobs in `assigned`, already delivered against that credit
+        self.assigned = asyncio.Queue()
+        self._ws = None
+        self._refs = itertools.count(1)
+        self._waiting = {}
+        self._dial = asyncio.Lock()
 
-    backoff = 1
-    while True:
+    async def _connect(self):
+        async with self._dial:
+            if self._ws is not None:
+                return
+            try:
+                import websockets
+            except ImportError:
+                raise RuntimeError("SENTINEL_TRANSPORT=ws needs the websockets package: pip install websockets")
+            ws = await websockets.connect(self.url, extra_headers=self.headers, max_size=None,
+                                          ping_interval=KEEPALIVE)
+            self._ws = ws
+            asyncio.create_task(self._read(ws))
+            if self.agent_id is not None:
+                await self.request("register", urgent=True, agent_id=self.agent_id)
+                # credit lives with the server-side session, which ended with the old connection
+                owed = self.credit - self.queued
+                if owed > 0:
+                    await self.request("claim", urgent=True, max=owed)
+
+    async def _read(self, ws):
+        try:
+            async for raw in ws:
+                msg = json.loads(raw)
+                if msg.get("op") == "assign":
+                    self.assigned.put_nowait(msg["jobs"])
+                    self.queued += len(msg["jobs"])
+                elif msg.get("op") == "cancel":
+                    self.on_cancel(msg["ids"])
+                fut = self._waiting.pop(msg.get("ref"), None)
+                if fut is not None and not fut.done():
+                    fut.set_result(msg)
+        except Exception as e:
+            logger.warning(f"agent channel lost: {e}")
+        finally:
+            if self._ws is ws:
+                self._ws = None
+            for fut in self._waiting.values():
+                if not fut.done():
+                    fut.set_exception(ConnectionError("agent channel closed"))
+            self._waiting.clear()
+
+    async def request(self, op, urgent=False, timeout=30, **fields):
+        # the frame counterpart of call(): same AIMD feedback, no HTTP retries
+        # (a failed complete is spooled, a failed claim or heartbeat retried by its loop)
+        if not urgent:
+            await aimd.pause()
+        ref = next(self._refs)
+        started = time.monotonic()
+        try:
+            if self._ws is None:
+                await self._connect()
+            fut = asyncio.get_running_loop().create_future()
+            self._waiting[ref] = fut
+            await self._ws.send(json.dumps({"op": op, "ref": ref, **fields}))
+            reply = await asyncio.wait_for(fut, timeout)
+        except Exception:
+            aimd.cut()
+            raise
+        finally:
+            self._waiting.pop(ref, None)
+        if reply.get("op") == "error":
+            raise RuntimeError(f"{op} over {self.url} -> {reply.get('status')} {reply.get('detail')}")
+        if op != "claim":
+            aimd.sample(time.monotonic() - started)
+        return reply
+
+    async def claim(self, most, wait):
+        # top the server-side credit up to `most`, then wait up to `wait` seconds for an assignment
+        if self._ws is None:
+            await self._connect()  # asks for the outstanding credit itself
+        want = most - self.credit
+        if want > 0:
+            self.credit += want
+            try:
+                await self.request("claim", max=want)
+            except Exception:
+                self.credit = max(self.credit - want, 0)
+                raise
         try:
-            job = get(f"/jobs/claim?agent_id={agent_id}")
-            if not job or not job.get("id"):
-                time.sleep(min(backoff, 10))
-                backoff = min(backoff * 2, 10)
+            if wait and self.assigned.empty():
+                jobs = await asyncio.wait_for(self.assigned.get(), wait)
+            else:
+                jobs = self.assigned.get_nowait()  # wait=0: no long-poll, only what has arrived
+        except (asyncio.QueueEmpty, asyncio.TimeoutError):
+            return []
+        while not self.assigned.empty():
+            jobs += self.assigned.get_nowait()
+        self.queued = max(self.queued - len(jobs), 0)
+        self.credit = max(self.credit - len(jobs), 0)
+        return jobs
+
+    async def close(self):
+        if self._ws is not None:
+            await self._ws.close()
+
+# -------- prefetch buffer --------
+class Prefetch:
+    """
+    Jobs claimed ahead of the slots that will run them. Claims top it up to
+    aimd.slots() running + limit() buffered, so a slot that frees up starts
+    its next job at once instead of waiting for a claim round trip.
+    """
+
+    def __init__(self, aimd, depth, lease_seconds, kind_limits):
+        self.aimd = aimd
+        self.depth = depth
+        self.lease = lease_seconds
+        self.kind_limits = kind_limits
+        self.jobs = deque()
+        self.running = 0
+        self.by_kind = Counter()
+        self.active = {}  # str(job id) -> task running it
+        self.avg = None  # EWMA of job seconds
+        self._cond = asyncio.Condition()
+        self.aimd.on_change = self.poke
+
+    @property
+    def concurrency(self):
+        return self.aimd.slots()
+
+    def poke(self):
+        # slot count changed: re-check waiting claimers and runners
+        asyncio.get_running_loop().create_task(self._notify())
+
+    async def _notify(self):
+        async with self._cond:
+            self._cond.notify_all()
+
+    def limit(self):
+        # buffered jobs must start well inside their lease, even if heartbeats stall
+        if not self.avg:
+            return self.depth
+        return max(1, min(self.depth, int(self.lease / 2 / self.avg * self.concurrency)))
+
+    def room(self):
+        return self.concurrency + self.limit() - self.running - len(self.jobs)
+
+    def _next(self):
+        # first buffered job whose kind is under its cap; capped kinds don't block the rest
+        for i, job in enumerate(self.jobs):
+            cap = self.kind_limits.get(job.get("kind"))
+            if cap is None or self.by_kind[job.get("kind")] < cap:
+                return i
+        return None
+
+    async def wait_room(self, batch):
+        # top up in batches (fewer claims per job) unless the buffer has run dry
+        want = max(1, min(batch, self.limit() // 2))
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.room() >= want or (not self.jobs and self.room() > 0))
+            return self.room()
+
+    async def put(self, jobs):
+        async with self._cond:
+            self.jobs.extend(jobs)
+            self._cond.notify_all()
+
+    async def take(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.running < self.concurrency and self._next() is not None)
+            i = self._next()
+            job = self.jobs[i]
+            del self.jobs[i]
+            self.running += 1
+            self.by_kind[job.get("kind")] += 1
+            return job
+
+    async def done(self, job, seconds):
+        async with self._cond:
+            if self.running >= self.concurrency:
+                self.aimd.grow()  # only a saturated worker has evidence it could do more
+            self.running -= 1
+            self.by_kind[job.get("kind")] -= 1
+            self.avg = seconds if self.avg is None else 0.8 * self.avg + 0.2 * seconds
+            self._cond.notify_all()
+
+    def revoke(self, ids):
+        # the server took these jobs back: drop buffered ones, cancel running ones
+        ids = {str(i) for i in ids}
+        kept = [j for j in self.jobs if str(j["id"]) not in ids]
+        if len(kept) != len(self.jobs):
+            self.jobs = deque(kept)
+            self.poke()
+        for jid in ids & self.active.keys():
+            self.active[jid].cancel()
+        logger.info(f"server revoked {len(ids)} job(s): {sorted(ids)}")
+
+    async def drained(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self.jobs and self.running == 0)
+
+# -------- completion spool --------
+class Spool:
+    """
+    Append-only NDJSON journal of completions. A result line is written and
+    fsynced (once per flush, not per result) before the result is sent, and
+    an {"acked": [...]} line follows once the server has it. Whatever is not
+    acked when the worker restarts is replayed. The file is truncated each
+    time everything in it is acked, so it only grows during an outage.
+
+    The journal is held under an exclusive flock. A second worker started
+    with the same NAME journals to "<name>.<pid>.ndjson" instead, and a
+    worker that gets a journal's lock adopts the unacked results of
+    "<name>.<pid>.ndjson" files whose owner has exited.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        root, ext = os.path.splitext(path)
+        self._f = self._lock_file(path)
+        self._per_pid = self._f is None
+        if self._per_pid:
+            # another live worker runs under this NAME: keep our results apart
+            path = f"{root}.{os.getpid()}{ext}"
+            self._f = self._lock_file(path)
+            if self._f is None:
+                raise RuntimeError(f"spool {path} is locked by another process")
+        self.path = path
+        self.outstanding = set()
+        self._lock = asyncio.Lock()
+        self._f.seek(0)
+        for _, rec in self._records(self._f):
+            if "acked" in rec:
+                self.outstanding.difference_update(rec["acked"])
+            else:
+                self.outstanding.add(rec["id"])
+        self._adopt(root, ext)
+
+    @staticmethod
+    def _lock_file(path):
+        """`path` opened for append and exclusively flocked, or None if another process holds it."""
+        f = open(path, "a+b")
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return None
+        return f
+
+    def _adopt(self, root, ext):
+        """Take over the unacked results of same-NAME journals no live worker holds."""
+        folder, base = os.path.split(root)
+        suffixed = re.compile(re.escape(base) + r"\.\d+" + re.escape(ext))
+        paths = [root + ext] + [os.path.join(folder, n) for n in sorted(os.listdir(folder)) if suffixed.fullmatch(n)]
+        for other in paths:
+            if other == self.path:
                 continue
+            f = self._lock_file(other)
+            if f is None:
+                continue  # its owner is still running
+            try:
+                f.seek(0)
+                lines, pending = {}, set()
+                for line, rec in self._records(f):
+                    if "acked" in rec:
+                        pending.difference_update(rec["acked"])
+                    else:
+                        pending.add(rec["id"])
+                        lines.setdefault(rec["id"], line)
+                fresh = [lines[i] for i in lines if i in pending and i not in self.outstanding]
+                if fresh:
+                    self._append(b"".join(line.rstrip(b"\n") + b"\n" for line in fresh), True)
+                    self.outstanding.update(i for i in lines if i in pending)
+                    logger.info(f"adopted {len(fresh)} unacked completion(s) from {other}")
+                # emptied under the lock, so a worker that opened it meanwhile finds nothing to replay
+                f.truncate(0)
+                if other != root + ext:
+                    os.unlink(other)
+            finally:
+                f.close()
 
-            backoff = 1
-            jid  = job["id"]
-            kind = job.get("kind", "echo")
-            handler = HANDLERS.get(kind)
-            logger.info(f"claimed job id={jid} kind={kind}")
-
-            if not handler:
-                out = {"ok": False, "error": f"no handler for kind {kind}"}
-                post(f"/jobs/{jid}/complete", {"status": "failed", "output_json": json.dumps(out)})
+    @staticmethod
+    def _records(f):
+        for line in f:
+            try:
+                yield line, json.loads(line)
+            except ValueError:
+                continue  # torn last line from a crash mid-write
+
+    def _append(self, data, sync):
+        self._f.write(data)
+        self._f.flush()
+        if sync:
+            os.fsync(self._f.fileno())
+
+    async def write(self, results):
+        data = b"".join(json.dumps(r).encode("utf-8") + b"\n" for r in results)
+        async with self._lock:
+            await asyncio.to_thread(self._append, data, True)
+            self.outstanding.update(r["id"] for r in results)
+
+    async def ack(self, ids):
+        async with self._lock:
+            self.outstanding.difference_update(ids)
+            if not self.outstanding:
+                self._f.truncate(0)
+                return
+            # no fsync: a lost ack marker only means a harmless duplicate complete on replay
+            await asyncio.to_thread(self._append, json.dumps({"acked": list(ids)}).encode("utf-8") + b"\n", False)
+
+    def unacked(self, batch):
+        """Outstanding results in chunks of `batch`, streamed from the file."""
+        seen, chunk = set(), []
+        with open(self.path, "rb") as f:
+            for _, rec in self._records(f):
+                rid = rec.get("id")
+                if "acked" in rec or rid not in self.outstanding or rid in seen:
+                    continue
+                seen.add(rid)
+                chunk.append(rec)
+                if len(chunk) >= batch:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+
+    def close(self):
+        if self._per_pid and not self.outstanding:
+            os.unlink(self.path)  # drained: nothing left for a later worker to adopt
+        self._f.close()
+
+# -------- batched acknowledgements --------
+class Acks:
+    """
+    Outbound completions, spooled and then sent as one complete:batch every
+    ACK_INTERVAL_MS or ACK_BATCH results. While the server is unreachable
+    they are only spooled; replay() drains the spool in REPLAY_BATCH chunks
+    once it answers again (and at startup, for a previous run's leftovers).
+    """
+
+    def __init__(self, batch, interval, spool):
+        self.batch = batch
+        self.interval = interval
+        self.spool = spool
+        self.pending = []
+        self.finished = {}  # job id -> (kind, monotonic time its handler returned)
+        self.offline = bool(spool.outstanding)
+        self._wake = asyncio.Event()
+        self._full = asyncio.Event()
+        self._replay = asyncio.Event()
+        if self.offline:
+            self._replay.set()
+
+    def add(self, result, kind=""):
+        self.finished[result["id"]] = (kind, time.monotonic())
+        self.pending.append(result)
+        self._wake.set()
+        if len(self.pending) >= self.batch:
+            self._full.set()
+
+    async def run(self):
+        while True:
+            await self._wake.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        self._wake.clear()
+        self._full.clear()
+        while self.pending:
+            results, self.pending = self.pending[:self.batch], self.pending[self.batch:]
+            await self.spool.write(results)
+            if self.offline:
+                continue  # the replayer sends them
+            try:
+                await complete_jobs(results)
+            except Exception as e:
+                logger.warning(f"complete failed for {len(results)} job(s), spooled for replay: {e}")
+                self.offline = True
+                self._replay.set()
                 continue
+            await self._acked(results)
+            for r in results:
+                logger.info(f"{r['status']} job id={r['id']}")
 
+    async def _acked(self, results):
+        await self.spool.ack([r["id"] for r in results])
+        now = time.monotonic()
+        for r in results:
+            kind, at = self.finished.pop(r["id"], (None, None))
+            if at is not None:  # not for a previous run's leftovers
+                telemetry.observe("completion_latency", now - at, kind)
+
+    async def replay(self):
+        backoff = 1
+        while True:
+            await self._replay.wait()
             try:
-                result = handler(job)
-                post(f"/jobs/{jid}/complete", {"status": "completed", "output_json": json.dumps(result)})
-                logger.info(f"completed job id={jid}")
-            except Exception as ex:
-                out = {"ok": False, "error": str(ex)}
-                post(f"/jobs/{jid}/complete", {"status": "failed", "output_json": json.dumps(out)})
+                sent = 0
+                for chunk in self.spool.unacked(REPLAY_BATCH):
+                    await complete_jobs(chunk)
+                    await self._acked(chunk)
+                    sent += len(chunk)
+            except Exception as e:
+                logger.warning(f"spool replay failed, retrying in ~{backoff}s: {e}")
+                await asyncio.sleep(random.uniform(backoff / 2, backoff))
+                backoff = min(backoff * 2, REPLAY_MAX_BACKOFF)
+                continue
+            if sent:
+                logger.info(f"replayed {sent} spooled completion(s)")
+            backoff = 1
+            self.offline = False
+            self._replay.clear()
+            if self.spool.outstanding:
+                self._replay.set()  # spooled while this pass ran
+
+# -------- job execution --------
+async def run_job(job):
+    jid  = job["id"]
+    kind = job.get("kind", "echo")
+    handler = HANDLERS.get(kind)
+    logger.info(f"claimed job id={jid} kind={kind}")
+
+    if not handler:
+        out = {"ok": False, "error": f"no handler for kind {kind}"}
+        return {"id": jid, "status": "failed", "output_json": json.dumps(out)}
 
+    try:
+        result = await lanes.run(kind, handler, job)
+        return {"id": jid, "status": "completed", "output_json": json.dumps(result)}
+    except Exception as ex:
+        out = {"ok": False, "error": str(ex)}
+        return {"id": jid, "status": "failed", "output_json": json.dumps(out)}
+
+async def claim_jobs(agent_id, most):
+    if channel is not None:
+        return await channel.claim(most, CLAIM_WAIT)
+    # wait= makes the server hold the request until a job is enqueued
+    resp = await get(f"/jobs/claim?agent_id={agent_id}&max={most}&wait={CLAIM_WAIT}",
+                     timeout=CLAIM_WAIT + 30)
+    if "jobs" in resp:
+        return [j for j in resp["jobs"] if j.get("id")]
+    # server without batch claim: single job (or {}) comes back
+    return [resp] if resp.get("id") else []
+
+_batch_complete = True
+
+async def complete_jobs(results):
+    global _batch_complete
+    if channel is not None:
+        await channel.request("complete", results=results)
+        return
+    if _batch_complete:
+        try:
+            await post("/jobs/complete:batch", results)
+            return
+        except RuntimeError as e:
+            if " -> 404 " not in str(e) and " -> 405 " not in str(e):
+                raise
+            logger.info("batch complete not supported by server, falling back to per-job")
+            _batch_complete = False
+    for r in results:
+        try:
+            await post(f"/jobs/{r['id']}/complete", {"status": r["status"], "output_json": r["output_json"]})
+        except RuntimeError as e:
+            if " -> 404 " not in str(e):
+                raise
+            logger.warning(f"server no longer knows job id={r['id']}, dropping its result")
+
+async def runner(prefetch, acks):
+    # one per slot: take the next runnable buffered job, run it, queue its ack
+    while True:
+        job = await prefetch.take()
+        kind = job.get("kind", "echo")
+        started = time.monotonic()
+        task = asyncio.ensure_future(run_job(job))
+        prefetch.active[str(job["id"])] = task
+        try:
+            await asyncio.wait({task})  # a revoke cancels the task, not this runner
+            if task.cancelled():
+                logger.info(f"revoked job id={job['id']}, result dropped")
+            else:
+                acks.add(task.result(), kind)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            prefetch.active.pop(str(job["id"]), None)
+            seconds = time.monotonic() - started
+            telemetry.observe("handler_duration", seconds, kind)
+            await prefetch.done(job, seconds)
+
+async def claim_loop(agent_id, prefetch):
+    backoff = 1
+    while True:
+        room = await prefetch.wait_room(CLAIM_BATCH)
+        try:
+            started = time.monotonic()
+            jobs = await claim_jobs(agent_id, min(room, CLAIM_BATCH))
         except Exception as e:
             logger.warning(f"claim loop error: {e}")
-            time.sleep(3)
+            # overload already shrank the slots and set any Retry-After pause
+            await asyncio.sleep(random.uniform(1, 3))
+            continue
+        if not jobs:
+            # A server that honoured wait= already parked us; only servers
+            # that answered immediately need the client-side backoff.
+            if CLAIM_WAIT and time.monotonic() - started >= CLAIM_WAIT / 2:
+                backoff = 1
+                continue
+            await asyncio.sleep(min(backoff, 10))
+            backoff = min(backoff * 2, 10)
+            continue
+        backoff = 1
+        telemetry.observe("claim_latency", time.monotonic() - started)
+        for job in jobs:
+            created, claimed = parse_ts(job.get("created_at")), parse_ts(job.get("claimed_at"))
+            if created is not None and claimed is not None:
+                telemetry.observe("queue_wait", claimed - created, job.get("kind", "echo"))
+        await prefetch.put(jobs)
+
+async def main():
+    global api, jobs_http, channel
+    headers = {"X-API-Key": load_api_key(), "Content-Type": "application/json"}
+    api = make_client(API_POOL, headers=headers)
+    jobs_http = make_client(JOB_POOL, retries=RETRIES)
+    if TRANSPORT == "ws":
+        channel = Channel(re.sub(r"^http", "ws", BASE_URL) + "/v0/agents/ws", headers)
+        reg = await channel.request("register", name=NAME, tenant=TENANT, version=VERSION)
+    else:
+        reg = await post("/agents/register", {"name": NAME, "tenant": TENANT, "version": VERSION})
+    agent_id = reg.get("agent_id") or reg.get("id") or str(uuid.uuid4())
+    if channel is not None:
+        channel.agent_id = agent_id
+    hb_int   = reg.get("heartbeat_interval", 30)
+    logger.info(f"registered agent_id={agent_id} heartbeat_interval={hb_int} claim_batch={CLAIM_BATCH} "
+                f"claim_wait={CLAIM_WAIT} concurrency={MIN_CONCURRENCY}..{CONCURRENCY} kind_limits={KIND_LIMITS!r} "
+                f"api_pool={API_POOL} job_pool={JOB_POOL} prefetch={PREFETCH} ack_batch={ACK_BATCH} transport={TRANSPORT}")
+
+    heartbeat = asyncio.create_task(heartbeat_loop(agent_id, hb_int))
+    metrics = None
+    if METRICS_PORT:
+        try:
+            metrics = await serve_prometheus(telemetry, METRICS_HOST, METRICS_PORT)
+            logger.info(f"metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+        except OSError as e:
+            logger.warning(f"metrics endpoint disabled: {e}")
+    # warm the process pool if any kind runs there, by SENTINEL_JOB_LANES or @cpu_bound
+    pooled = process_kinds()
+    if pooled:
+        logger.info(f"warming {lanes.process_workers} process-lane worker(s) for {', '.join(pooled)}")
+        await lanes.warm()
+    prefetch = Prefetch(aimd, PREFETCH, LEASE_SECONDS, parse_kind_limits(KIND_LIMITS))
+    if channel is not None:
+        channel.on_cancel = prefetch.revoke
+    spool = Spool(os.path.join(SPOOL_DIR, re.sub(r"[^\w.-]", "_", NAME) + ".ndjson"))
+    acks = Acks(ACK_BATCH, ACK_INTERVAL_MS / 1000, spool)
+    runners = [asyncio.create_task(runner(prefetch, acks)) for _ in range(CONCURRENCY)]
+    flusher = asyncio.create_task(acks.run())
+    replayer = asyncio.create_task(acks.replay())
+
+    try:
+        await claim_loop(agent_id, prefetch)
+    finally:
+        # stop claiming, run what is already leased, report it, then let go
+        await prefetch.drained()
+        for t in runners + [flusher, replayer]:
+            t.cancel()
+        await acks.flush()  # whatever cannot be sent stays spooled for the next start
+        spool.close()
+        heartbeat.cancel()
+        if metrics is not None:
+            metrics.close()
+        if channel is not None:
+            await channel.close()
+        await api.aclose()
+        await jobs_http.aclose()
+        lanes.close()
 
 if __name__ == "__main__":
+    setup_logging()
     logger.info("worker starting…")
-    main()
-
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("worker stopped")
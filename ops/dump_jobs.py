@@ -2,11 +2,10 @@
 repo = r'C:\Users\mdee2\sentinel-company\sentinel-orchestrator-phase1'
 os.chdir(repo)
 if repo not in sys.path: sys.path.insert(0, repo)
-from sentinel_engine.db import SessionLocal
-from sentinel_engine.models_agent_mvp import Job
+from itertools import islice
+from sentinel_engine.queue_backend import JobQuery, get_queue
 
-def iso(dt): return dt.isoformat() if dt else None
-with SessionLocal() as db:
-    rows = db.query(Job).order_by(Job.id.desc()).limit(10).all()
-out = [{"id": r.id, "kind": r.kind, "status": r.status, "updated_at": iso(r.updated_at)} for r in rows]
-print(json.dumps(out, indent=2))
+# usage: dump_jobs.py [N]  -- newest N jobs (default: all) as NDJSON, streamed
+limit = int(sys.argv[1]) if len(sys.argv) > 1 else None
+for r in islice(get_queue().export(JobQuery()), limit):
+    print(json.dumps(r, default=str))
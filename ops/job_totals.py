@@ -2,10 +2,11 @@
 repo = r'C:\Users\mdee2\sentinel-company\sentinel-orchestrator-phase1'
 os.chdir(repo)
 if repo not in sys.path: sys.path.insert(0, repo)
-from sentinel_engine.db import SessionLocal
-from sentinel_engine.models_agent_mvp import Job
+from sentinel_engine.job_counters import read_totals
+from sentinel_engine.job_queue import ensure_job_schema
 
-statuses = ["queued","in_progress","completed","failed"]
-with SessionLocal() as db:
-    totals = {s: db.query(Job).filter(Job.status == s).count() for s in statuses}
+ensure_job_schema()  # installs job_counters on a database the API has not upgraded yet
+
+breakdown = sys.argv[1] if len(sys.argv) > 1 else None  # kind | tenant
+totals = read_totals(breakdown)
 print(json.dumps(totals, indent=2))
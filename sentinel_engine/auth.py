@@ -33,6 +33,11 @@ _rate_buckets = {}  # api_key -> (tokens, last_refill_ts)
 RATE_LIMIT_TOKENS = 60  # tokens per minute
 REFILL_SECONDS = 60
 
+def retry_after_seconds(api_key: str) -> int:
+    """Seconds until `api_key`'s bucket refills (for the 429 Retry-After header)."""
+    _, last_ts = _rate_buckets.get(api_key, (RATE_LIMIT_TOKENS, time.time()))
+    return max(1, int(REFILL_SECONDS - (time.time() - last_ts)) + 1)
+
 def _consume_token(api_key: str) -> bool:
     now = time.time()
     tokens, last_ts = _rate_buckets.get(api_key, (RATE_LIMIT_TOKENS, now))
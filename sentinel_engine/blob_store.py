@@ -0,0 +1,179 @@
+"""
+Content-addressed, compressed store for large job payloads and outputs.
+
+Bodies over settings.blob_inline_max_bytes are written once to
+ops/data/blobs/<aa>/<sha256>.<codec> and the jobs row keeps only a small JSON
+reference, {"$blob": "sha256:<hex>", "size": n}, so table pages stay dense.
+Identical bodies share one file. zstd is used when the zstandard package is
+installed, zlib otherwise; readers handle either.
+
+The reference text is informational only. The digest the server wrote is
+kept in its own column (payload_blob / output_blob) and resolve() reads that,
+never the body: a client that sends reference-shaped text must not get
+another tenant's blob back, and reject_ref() turns such bodies away.
+
+offload() writes the file before the row that references it is committed,
+outside the write transaction. sweep() deletes the blobs no row references
+any more, sparing files written or reused within a grace period so a body
+whose insert has not committed yet survives.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+from .config import settings
+from .db import ROOT
+
+try:
+    import zstandard
+except Exception:  # optional dependency
+    zstandard = None
+
+BLOB_DIR = ROOT / "ops" / "data" / "blobs"
+CHUNK_SIZE = 64 * 1024
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+class BlobRefError(ValueError):
+    pass
+
+def _path(digest: str, codec: str) -> Path:
+    return BLOB_DIR / digest[:2] / f"{digest}.{codec}"
+
+def _find(digest: str) -> Optional[Path]:
+    if not _DIGEST_RE.match(digest):
+        return None
+    for codec in ("zst", "zz"):
+        p = _path(digest, codec)
+        if p.exists():
+            return p
+    return None
+
+def put(data: bytes) -> str:
+    """Store `data` (deduplicated by content) and return its sha256 hex digest."""
+    digest = hashlib.sha256(data).hexdigest()
+    existing = _find(digest)
+    if existing:
+        try:
+            os.utime(existing)  # reused: sweep() spares it for another grace period
+            return digest
+        except FileNotFoundError:
+            pass  # swept in between, write it again
+    if zstandard is not None:
+        codec, packed = "zst", zstandard.ZstdCompressor(level=3).compress(data)
+    else:
+        codec, packed = "zz", zlib.compress(data, 6)
+    dest = _path(digest, codec)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dest.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(packed)
+        os.replace(tmp, dest)  # atomic; a concurrent writer of the same digest is harmless
+    except Exception:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return digest
+
+def iter_blob(digest: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Stream the decompressed blob without holding it all in memory."""
+    path = _find(digest)
+    if path is None:
+        raise FileNotFoundError(digest)
+    with path.open("rb") as f:
+        if path.suffix == ".zst":
+            if zstandard is None:
+                raise RuntimeError("blob is zstd-compressed but zstandard is not installed")
+            reader = zstandard.ZstdDecompressor().stream_reader(f)
+            while chunk := reader.read(chunk_size):
+                yield chunk
+            return
+        d = zlib.decompressobj()
+        while packed := f.read(chunk_size):
+            out = d.decompress(packed, chunk_size)
+            while out:
+                yield out
+                out = d.decompress(d.unconsumed_tail, chunk_size) if d.unconsumed_tail else b""
+        tail = d.flush()
+        if tail:
+            yield tail
+
+def exists(digest: str) -> bool:
+    return _find(digest) is not None
+
+def sweep(referenced: Set[str], grace_seconds: float) -> int:
+    """
+    Delete blobs whose digest is not in `referenced`, and stray temp files,
+    last written or reused more than `grace_seconds` ago. Returns how many
+    files were removed.
+    """
+    if not BLOB_DIR.exists():
+        return 0
+    cutoff = time.time() - grace_seconds
+    removed = 0
+    for path in BLOB_DIR.glob("*/*"):
+        if path.name.split(".", 1)[0] in referenced:
+            continue
+        doomed = path.with_name(f".gc-{path.name.lstrip('.')}")
+        try:
+            if path.stat().st_mtime >= cutoff:
+                continue
+            # move it aside first: a put() that touched it before the move
+            # shows in the mtime and the blob goes back, one after the move
+            # no longer finds it and writes a fresh copy
+            os.replace(path, doomed)
+            if doomed.stat().st_mtime >= cutoff:
+                os.replace(doomed, path)
+                continue
+            doomed.unlink()
+        except FileNotFoundError:
+            continue
+        removed += 1
+    return removed
+
+def looks_like_ref(text: Optional[str]) -> bool:
+    """True if `text` is a JSON object with a "$blob" key, as references are."""
+    if not text or '"$blob"' not in text or not text.lstrip().startswith("{"):
+        return False
+    try:
+        return "$blob" in json.loads(text)
+    except ValueError:
+        return False
+
+def reject_ref(text: Optional[str]) -> None:
+    """BlobRefError for client bodies that could pass for a blob reference."""
+    if looks_like_ref(text):
+        raise BlobRefError('payload_json / output_json must not be a {"$blob": ...} reference')
+
+def offload(text: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """
+    (stored text, digest) for a client body: large bodies become a blob and
+    a reference with their digest, small ones pass through with None.
+    """
+    reject_ref(text)
+    if text is None or len(text) <= settings.blob_inline_max_bytes:
+        return text, None
+    data = text.encode("utf-8")
+    if len(data) <= settings.blob_inline_max_bytes:
+        return text, None
+    digest = put(data)
+    return json.dumps({"$blob": f"sha256:{digest}", "size": len(data)}), digest
+
+def resolve(text: Optional[str], digest: Optional[str]) -> Optional[str]:
+    """Inverse of offload(): the full body when the row has a blob digest, else `text`."""
+    if not digest:
+        return text
+    return b"".join(iter_blob(digest)).decode("utf-8")
+
+def resolve_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """A job row (dict) with payload_json / output_json read back through their digest columns."""
+    for text, digest in (("payload_json", "payload_blob"), ("output_json", "output_blob")):
+        if row.get(digest):
+            row[text] = resolve(row.get(text), row[digest])
+    return row
@@ -44,6 +44,48 @@ class Settings(BaseModel):
     sentinel_api_key: str | None = os.getenv("SENTINEL_API_KEY")
     env: str = os.getenv("ENV", "dev")
     debug: bool = os.getenv("DEBUG", "0").lower() in ("1", "true", "yes", "on")
+    # job queue: every Nth claim takes the oldest job regardless of priority (0 = off)
+    queue_aging_every: int = int(os.getenv("SENTINEL_QUEUE_AGING_EVERY", "0"))
+    # job queue: weighted fair share across tenants at claim time, weights as "1:3,2:1"
+    queue_fair_share: bool = os.getenv("SENTINEL_QUEUE_FAIR_SHARE", "1").lower() in ("1", "true", "yes", "on")
+    tenant_weights: str = os.getenv("SENTINEL_TENANT_WEIGHTS", "")
+    # job queue: claim leases, extended by agent heartbeats and reaped when they lapse
+    job_lease_seconds: int = int(os.getenv("SENTINEL_JOB_LEASE_SECONDS", "300"))
+    lease_reap_interval_seconds: float = float(os.getenv("SENTINEL_LEASE_REAP_INTERVAL", "5"))
+    lease_reap_grace_seconds: float = float(os.getenv("SENTINEL_LEASE_REAP_GRACE", "60"))
+    # job retention: finished jobs older than this move to jobs_archive (0 = keep in jobs)
+    job_retention_hours: float = float(os.getenv("SENTINEL_JOB_RETENTION_HOURS", "24"))
+    archive_interval_seconds: float = float(os.getenv("SENTINEL_ARCHIVE_INTERVAL", "300"))
+    # payloads/outputs larger than this go to the blob store (ops/data/blobs)
+    blob_inline_max_bytes: int = int(os.getenv("SENTINEL_BLOB_INLINE_MAX_BYTES", "16384"))
+    # blobs no hot job references are deleted after archiving once they are this old
+    blob_gc_grace_seconds: float = float(os.getenv("SENTINEL_BLOB_GC_GRACE", "3600"))
+    # job queue backend: "sqlite" (jobs table) or "memory" (in-process heaps, see queue_backend)
+    queue_backend: str = os.getenv("SENTINEL_QUEUE_BACKEND", "sqlite")
+    sqlite_busy_timeout_ms: int = int(os.getenv("SENTINEL_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    sqlite_synchronous: str = os.getenv("SENTINEL_SQLITE_SYNCHRONOUS", "NORMAL")
+    # memory backend: JSON snapshot written periodically and on shutdown ("" = none)
+    queue_snapshot_path: str = os.getenv("SENTINEL_QUEUE_SNAPSHOT", "")
+    queue_snapshot_interval_seconds: float = float(os.getenv("SENTINEL_QUEUE_SNAPSHOT_INTERVAL", "30"))
+    # handler execution lanes (job_lanes): "kind:inline|thread|process,...", process pool size, shm cutoff
+    job_lanes: str = os.getenv("SENTINEL_JOB_LANES", "")
+    job_process_workers: int = int(os.getenv("SENTINEL_PROCESS_WORKERS", "0"))  # 0 = cpu count
+    job_shm_threshold_bytes: int = int(os.getenv("SENTINEL_SHM_THRESHOLD", str(1 << 20)))
+    # GET /v0/jobs/events: replay history for reconnects, per-subscriber buffer, SSE keepalive
+    job_events_history: int = int(os.getenv("SENTINEL_JOB_EVENTS_HISTORY", "10000"))
+    job_events_queue_size: int = int(os.getenv("SENTINEL_JOB_EVENTS_QUEUE", "1000"))
+    job_events_keepalive_seconds: float = float(os.getenv("SENTINEL_JOB_EVENTS_KEEPALIVE", "15"))
+    # agent latency histograms sent with heartbeats: agents silent this long drop out of the fleet view
+    agent_telemetry_ttl_seconds: float = float(os.getenv("SENTINEL_AGENT_TELEMETRY_TTL", "300"))
+    # /v0/agents/ws: most jobs an agent may have asked for and not yet been assigned
+    agent_ws_max_credit: int = int(os.getenv("SENTINEL_AGENT_WS_MAX_CREDIT", "1000"))
+    # enqueue: a repeated idempotency_key within this window returns the original job
+    idempotency_window_seconds: float = float(os.getenv("SENTINEL_IDEMPOTENCY_WINDOW", "86400"))
+    # periodic system tasks (orchestrator.SYSTEM_TASKS), cron or "@every <n>[smhd]"; "" disables
+    upgrader_schedule: str = os.getenv("SENTINEL_UPGRADER_SCHEDULE", "@every 24h")
+    market_scan_schedule: str = os.getenv("SENTINEL_MARKET_SCAN_SCHEDULE", "0 6 * * *")
+    # upper bound on the scheduler timer's sleep (picks up run_at rows written by other processes)
+    scheduler_max_sleep_seconds: float = float(os.getenv("SENTINEL_SCHEDULER_MAX_SLEEP", "60"))
 
 settings = Settings()
 # --------------------------------------------
@@ -8,3 +8,11 @@ SQLITE_PATH = ROOT / "ops" / "data" / "sentinel.sqlite"
 engine = create_engine(f"sqlite:///{SQLITE_PATH}", connect_args={"check_same_thread": False}, future=True)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
 Base = declarative_base()
+
+# Transactions begun through this engine open with BEGIN IMMEDIATE once the
+# SQLite queue backend has tuned the engine (sqlite_queue.tune_engine).
+_immediate_engine = engine.execution_options(sqlite_begin="IMMEDIATE")
+
+def get_engine(immediate: bool = False):
+    """The shared engine; immediate=True for write transactions (take the write lock up front)."""
+    return _immediate_engine if immediate else engine
@@ -15,12 +15,27 @@ from typing import Dict, List, Optional, Any
 import aiofiles
 import requests
 
+from .config import settings
+from .job_lanes import Lanes, parse_lanes, share, shared
+from .secops import scan_artifact
+
 logger = logging.getLogger(__name__)
 
 class EnhancedJobHandlers:
     """Enhanced job handlers for complete Phase 2 functionality"""
     
-    def __init__(self):
+    # Handlers that block (subprocess, requests) run off the event loop;
+    # SENTINEL_JOB_LANES overrides per kind. See job_lanes.
+    DEFAULT_LANES = {
+        'git_clone': 'thread',
+        'git_status': 'thread',
+        'shell_exec': 'thread',
+        'web_request': 'thread',
+        'build_project': 'thread',
+        'test_endpoint': 'thread',
+    }
+    
+    def __init__(self, lanes: Optional[Lanes] = None):
         self.handlers = {
             'echo': self.handle_echo,
             'llm_request': self.handle_llm_request,
@@ -32,8 +47,10 @@ class EnhancedJobHandlers:
             'shell_exec': self.handle_shell_exec,
             'web_request': self.handle_web_request,
             'build_project': self.handle_build_project,
-            'test_endpoint': self.handle_test_endpoint
+            'test_endpoint': self.handle_test_endpoint,
+            'safety_scan': scan_artifact,  # @cpu_bound: process lane
         }
+        self._lanes = self._with_defaults(lanes) if lanes is not None else None
         
         # Safe commands whitelist
         self.safe_commands = {
@@ -41,6 +58,23 @@ class EnhancedJobHandlers:
             'git', 'python', 'pip', 'node', 'npm', 'dotnet', 'docker'
         }
     
+    @property
+    def lanes(self) -> Lanes:
+        # one set of pools per process: the agent worker's Lanes when it runs
+        # here, else our own (registered, so later handler sets reuse it)
+        if self._lanes is None:
+            self._lanes = self._with_defaults(shared() or share(Lanes(
+                policy=parse_lanes(settings.job_lanes),
+                process_workers=settings.job_process_workers or None,
+                shm_threshold=settings.job_shm_threshold_bytes,
+            )))
+        return self._lanes
+    
+    def _with_defaults(self, lanes: Lanes) -> Lanes:
+        for kind, lane in self.DEFAULT_LANES.items():
+            lanes.policy.setdefault(kind, lane)  # an explicit policy wins
+        return lanes
+    
     async def handle_job(self, job_type: str, payload: Dict[str, Any]) -> Dict[str, Any]:
         """Route job to appropriate handler"""
         try:
@@ -52,7 +86,7 @@ class EnhancedJobHandlers:
                 }
             
             handler = self.handlers[job_type]
-            result = await handler(payload)
+            result = await self.lanes.run(job_type, handler, payload)
             
             return {
                 'success': True,
@@ -0,0 +1,36 @@
+"""
+In-process, time-ordered IDs for jobs and agents.
+
+new_id() mints UUIDv7 strings (RFC 9562): a 48-bit millisecond timestamp
+followed by a 12-bit sequence and 62 random bits. IDs minted by one process
+are strictly increasing, so inserts append at the right edge of the primary
+key index and ORDER BY id is queue order.
+"""
+import os
+import threading
+import time
+
+_lock = threading.Lock()
+_last_ms = 0
+_seq = 0
+
+def _next_ms_seq() -> tuple[int, int]:
+    global _last_ms, _seq
+    with _lock:
+        ms = time.time_ns() // 1_000_000
+        if ms > _last_ms:
+            _last_ms, _seq = ms, int.from_bytes(os.urandom(2), "big") & 0x3FF
+        else:
+            # same millisecond (or clock stepped back): keep counting on the
+            # last timestamp, borrowing the next millisecond on overflow
+            _seq += 1
+            if _seq > 0xFFF:
+                _last_ms, _seq = _last_ms + 1, 0
+        return _last_ms, _seq
+
+def new_id() -> str:
+    ms, seq = _next_ms_seq()
+    rand = int.from_bytes(os.urandom(8), "big") & 0x3FFF_FFFF_FFFF_FFFF
+    value = (ms << 80) | (0x7 << 76) | (seq << 64) | (0b10 << 62) | rand
+    h = f"{value:032x}"
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
@@ -0,0 +1,164 @@
+"""
+Job retention: keeps the hot `jobs` table close to the in-flight working set.
+
+Terminal (completed / failed) jobs older than the retention window are moved
+into `jobs_archive` in small batches, each batch one INSERT ... SELECT plus
+the DELETEs inside its own short transaction so claims are never blocked for
+long. On the ORM schema the jobs' `results` rows move with them, into
+`results_archive`. Admin reads can opt into the archive with fetch_archived()
+and recent_archived(). collect_blobs() deletes the blobs that no row in
+either table points at, i.e. bodies left behind by enqueues that lost a
+dedup race or a transaction that rolled back.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from . import blob_store
+from .config import settings
+from .db import get_engine
+from .job_counters import ensure_counters
+from .job_queue import ensure_job_schema
+
+ARCHIVE_TABLE = "jobs_archive"
+RESULTS_ARCHIVE_TABLE = "results_archive"
+TERMINAL = "('completed','failed')"
+
+_ready = False
+_result_cols: set[str] = set()  # columns of `results`, when the ORM schema has one
+
+def _finished_column(cols: set[str]) -> str:
+    # raw-SQL schema stamps completed_at; the ORM schema only bumps updated_at
+    return "completed_at" if "completed_at" in cols else "updated_at"
+
+def _cutoff(col: str, older_than: timedelta) -> str:
+    ts = datetime.now(timezone.utc) - older_than
+    if col == "completed_at":
+        return ts.isoformat()
+    return ts.replace(tzinfo=None).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+def _mirror(cx, source: str, table: str, cols: set[str], key: str):
+    # an archive table with (at least) the source's columns, unique on `key`
+    cx.exec_driver_sql(f"CREATE TABLE IF NOT EXISTS {table} AS SELECT * FROM {source} WHERE 0")
+    have = {r[1] for r in cx.exec_driver_sql(f"PRAGMA table_info({table})").fetchall()}
+    for col in sorted(cols - have):
+        cx.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {col}")
+    cx.exec_driver_sql(f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{table}_{key} ON {table}({key})")
+    for col in ("payload_blob", "output_blob"):
+        if col in cols:  # collect_blobs() reads these
+            cx.exec_driver_sql(
+                f"CREATE INDEX IF NOT EXISTS ix_{table}_{col} ON {table}({col}) WHERE {col} IS NOT NULL"
+            )
+
+def ensure_archive_schema(cx) -> set[str]:
+    """Create/extend jobs_archive (and results_archive) to mirror jobs; returns the shared columns."""
+    global _ready, _result_cols
+    cols = ensure_job_schema(cx)
+    if not cols or _ready:
+        return cols
+    _mirror(cx, "jobs", ARCHIVE_TABLE, cols, "id")
+    _result_cols = {r[1] for r in cx.exec_driver_sql("PRAGMA table_info(results)").fetchall()}
+    if _result_cols:
+        _mirror(cx, "results", RESULTS_ARCHIVE_TABLE, _result_cols, "job_id")
+    ensure_counters(cx, ARCHIVE_TABLE)  # archived jobs still count towards totals
+    fin = _finished_column(cols)
+    cx.exec_driver_sql(
+        f"CREATE INDEX IF NOT EXISTS ix_jobs_terminal_{fin} ON jobs({fin}) WHERE status IN {TERMINAL}"
+    )
+    _ready = True
+    return cols
+
+def archive_batch(older_than: timedelta, batch_size: int = 1000) -> int:
+    """Move up to `batch_size` old terminal jobs to the archive; returns how many."""
+    with get_engine(immediate=True).begin() as cx:
+        cols = ensure_archive_schema(cx)
+        if not cols:
+            return 0
+        fin = _finished_column(cols)
+        names = ", ".join(sorted(cols))
+        # the batch is picked once into a per-connection temp table; every
+        # statement below reads it by primary key instead of re-running the pick
+        cx.exec_driver_sql("CREATE TEMP TABLE IF NOT EXISTS archive_pick (id PRIMARY KEY)")
+        cx.exec_driver_sql("DELETE FROM archive_pick")
+        # parents stay hot while a child still waits on (or may read) their output
+        n = cx.exec_driver_sql(
+            f"INSERT INTO archive_pick(id) SELECT id FROM jobs WHERE status IN {TERMINAL} AND {fin} < ? "
+            "AND NOT EXISTS (SELECT 1 FROM job_deps d JOIN jobs c ON c.id = d.child_id "
+            f"WHERE d.parent_id = jobs.id AND c.status NOT IN {TERMINAL}) "
+            f"ORDER BY {fin} LIMIT ?",
+            (_cutoff(fin, older_than), batch_size)
+        ).rowcount
+        if n:
+            picked = "SELECT id FROM archive_pick"
+            cx.exec_driver_sql(
+                f"INSERT INTO {ARCHIVE_TABLE}({names}) SELECT {names} FROM jobs WHERE id IN ({picked})"
+            )
+            if _result_cols:
+                result_names = ", ".join(sorted(_result_cols))
+                cx.exec_driver_sql(
+                    f"INSERT INTO {RESULTS_ARCHIVE_TABLE}({result_names}) "
+                    f"SELECT {result_names} FROM results WHERE job_id IN ({picked})"
+                )
+                cx.exec_driver_sql(f"DELETE FROM results WHERE job_id IN ({picked})")
+            cx.exec_driver_sql(f"DELETE FROM job_deps WHERE child_id IN ({picked}) OR parent_id IN ({picked})")
+            cx.exec_driver_sql(f"DELETE FROM jobs WHERE id IN ({picked})")
+            cx.exec_driver_sql("DELETE FROM archive_pick")
+        return n
+
+def archive_finished(older_than: timedelta, batch_size: int = 1000, max_batches: int = 100) -> int:
+    """Run archive_batch until the backlog is drained or max_batches is hit."""
+    total = 0
+    for _ in range(max_batches):
+        n = archive_batch(older_than, batch_size)
+        total += n
+        if n < batch_size:
+            break
+    return total
+
+def referenced_blobs(cx) -> set[str]:
+    """Digests of the blobs any job or result, hot or archived, points at."""
+    cols = ensure_archive_schema(cx)
+    sql = []
+    for table in ("jobs", ARCHIVE_TABLE):
+        sql.append(f"SELECT payload_blob FROM {table} WHERE payload_blob IS NOT NULL")
+        if "output_blob" in cols:
+            sql.append(f"SELECT output_blob FROM {table} WHERE output_blob IS NOT NULL")
+    if "output_blob" in _result_cols:
+        for table in ("results", RESULTS_ARCHIVE_TABLE):
+            sql.append(f"SELECT output_blob FROM {table} WHERE output_blob IS NOT NULL")
+    return {r[0] for r in cx.exec_driver_sql(" UNION ".join(sql)).fetchall()}
+
+def collect_blobs(grace_seconds: Optional[float] = None) -> int:
+    """Delete unreferenced blobs (see blob_store.sweep); returns how many."""
+    with get_engine().begin() as cx:
+        if not ensure_archive_schema(cx):
+            return 0
+        referenced = referenced_blobs(cx)
+    grace = settings.blob_gc_grace_seconds if grace_seconds is None else grace_seconds
+    return blob_store.sweep(referenced, grace)
+
+def fetch_archived(job_id: Any) -> Optional[Dict[str, Any]]:
+    """An archived job with its payload and output read back from their blobs."""
+    with get_engine().begin() as cx:
+        cols = ensure_archive_schema(cx)
+        if not cols:
+            return None
+        sql = f"SELECT * FROM {ARCHIVE_TABLE} WHERE id=?"
+        if "output_json" not in cols and "output_json" in _result_cols:
+            # ORM schema: the output lives in the archived result
+            sql = (f"SELECT j.*, r.output_json, r.output_blob FROM {ARCHIVE_TABLE} j "
+                   f"LEFT JOIN {RESULTS_ARCHIVE_TABLE} r ON r.job_id = j.id WHERE j.id=?")
+        row = cx.exec_driver_sql(sql, (job_id,)).mappings().first()
+    return blob_store.resolve_row(dict(row)) if row else None
+
+def recent_archived(limit: int, before_id: Any = None) -> List[Dict[str, Any]]:
+    sql = f"SELECT * FROM {ARCHIVE_TABLE}"
+    params: tuple = ()
+    if before_id is not None:
+        sql += " WHERE id < ?"
+        params = (before_id,)
+    sql += " ORDER BY id DESC LIMIT ?"
+    with get_engine().begin() as cx:
+        if not ensure_archive_schema(cx):
+            return []
+        rows = cx.exec_driver_sql(sql, params + (limit,)).mappings().all()
+    return [dict(r) for r in rows]
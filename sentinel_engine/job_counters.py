@@ -0,0 +1,87 @@
+"""
+Incrementally maintained job counts.
+
+job_counters holds one row per (status, kind, tenant) with the number of
+jobs in that state, kept current by triggers on jobs (and jobs_archive, so
+archiving does not change the totals). Every write path - raw SQL, the ORM
+routes, the lease reaper, archiving - is covered without touching route code,
+and reading totals never scans jobs.
+"""
+from typing import Any, Dict, Optional
+
+from .db import get_engine
+
+# "claimed" is what routes/jobs.py leases with, "in_progress" the agent MVP routes
+STATUSES = ("queued", "claimed", "in_progress", "completed", "failed", "waiting", "scheduled")
+
+COUNTERS_DDL = """
+CREATE TABLE IF NOT EXISTS job_counters (
+  status TEXT NOT NULL,
+  kind TEXT NOT NULL,
+  tenant INTEGER NOT NULL,
+  n INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (status, kind, tenant)
+) WITHOUT ROWID
+"""
+
+_INC = """
+  INSERT INTO job_counters(status, kind, tenant, n) VALUES (NEW.status, NEW.kind, NEW.tenant, 1)
+  ON CONFLICT(status, kind, tenant) DO UPDATE SET n = n + 1;"""
+_DEC = """
+  UPDATE job_counters SET n = n - 1 WHERE status = OLD.status AND kind = OLD.kind AND tenant = OLD.tenant;"""
+
+def _trigger_ddl(table: str) -> tuple[str, ...]:
+    return (
+        f"CREATE TRIGGER IF NOT EXISTS trg_{table}_count_ins AFTER INSERT ON {table} BEGIN{_INC}\nEND",
+        f"CREATE TRIGGER IF NOT EXISTS trg_{table}_count_del AFTER DELETE ON {table} BEGIN{_DEC}\nEND",
+        f"CREATE TRIGGER IF NOT EXISTS trg_{table}_count_upd AFTER UPDATE OF status, kind, tenant ON {table} "
+        "WHEN OLD.status IS NOT NEW.status OR OLD.kind IS NOT NEW.kind OR OLD.tenant IS NOT NEW.tenant "
+        f"BEGIN{_DEC}{_INC}\nEND",
+    )
+
+def _exists(cx, kind: str, name: str) -> bool:
+    return cx.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type=? AND name=?", (kind, name)
+    ).first() is not None
+
+def ensure_counters(cx, table: str = "jobs"):
+    """
+    Install the counting triggers on `table`. The first time a table is
+    hooked up its existing rows are folded into job_counters in the same
+    transaction, so the counts never drift from the table.
+    """
+    cx.exec_driver_sql(COUNTERS_DDL)
+    if _exists(cx, "trigger", f"trg_{table}_count_ins"):
+        return
+    for ddl in _trigger_ddl(table):
+        cx.exec_driver_sql(ddl)
+    cx.exec_driver_sql(
+        "INSERT INTO job_counters(status, kind, tenant, n) "
+        f"SELECT status, kind, tenant, COUNT(*) FROM {table} WHERE true GROUP BY status, kind, tenant "
+        "ON CONFLICT(status, kind, tenant) DO UPDATE SET n = n + excluded.n"
+    )
+
+def read_totals(breakdown: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Status totals from job_counters as one aggregate row. With breakdown set
+    to "kind" or "tenant", also returns {key: {status: n}} under by_<breakdown>.
+    """
+    sums = ", ".join(f"COALESCE(SUM(CASE WHEN status='{s}' THEN n END), 0)" for s in STATUSES)
+    with get_engine().begin() as cx:
+        if not _exists(cx, "table", "job_counters"):
+            out: Dict[str, Any] = {s: 0 for s in STATUSES}
+            rows = []
+        else:
+            out = dict(zip(STATUSES, cx.exec_driver_sql(f"SELECT {sums} FROM job_counters").first()))
+            rows = []
+            if breakdown in ("kind", "tenant"):
+                rows = cx.exec_driver_sql(
+                    f"SELECT {breakdown}, status, SUM(n) FROM job_counters "
+                    f"GROUP BY {breakdown}, status HAVING SUM(n) > 0"
+                ).fetchall()
+    if breakdown in ("kind", "tenant"):
+        by: Dict[str, Dict[str, int]] = {}
+        for key, status, n in rows:
+            by.setdefault(str(key), {})[status] = n
+        out[f"by_{breakdown}"] = by
+    return out
@@ -0,0 +1,73 @@
+"""
+Enqueue deduplication.
+
+Two independent mechanisms, both opt-in per enqueue:
+
+- idempotency_key: unique per tenant (ux_jobs_idempotency). Re-sending the
+  same key within settings.idempotency_window_seconds returns the job the
+  first request created; after the window the old job gives the key up and
+  a new job is inserted.
+- coalesce: jobs with the same tenant + sha256(kind, payload) collapse into
+  the one that is still queued, so every submitter gets (and can watch) the
+  same job id. Once that job is claimed, the next identical submit queues a
+  fresh one.
+
+Both lookups run inside the caller's insert transaction.
+"""
+import hashlib
+from datetime import datetime, timezone
+from typing import Any, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+from .config import settings
+
+DEDUP_INDEX_DDL = (
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_jobs_idempotency ON jobs(tenant, idempotency_key) "
+    "WHERE idempotency_key IS NOT NULL",
+    "CREATE INDEX IF NOT EXISTS ix_jobs_coalesce ON jobs(tenant, dedup_hash) "
+    "WHERE dedup_hash IS NOT NULL AND status='queued'",
+)
+
+def payload_hash(kind: str, payload_json: Optional[str]) -> str:
+    h = hashlib.sha256(kind.encode("utf-8"))
+    h.update(b"\0")
+    h.update((payload_json or "{}").encode("utf-8"))
+    return h.hexdigest()
+
+def _age_seconds(created_at: Any) -> float:
+    if isinstance(created_at, str):
+        # ISO on the raw-SQL schema, "YYYY-MM-DD HH:MM:SS.ffffff" on the ORM one
+        created_at = datetime.fromisoformat(created_at)
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - created_at).total_seconds()
+
+def find_duplicate(cx, tenant: Any, idempotency_key: Optional[str],
+                   dedup_hash: Optional[str]) -> Optional[Tuple[Any, str]]:
+    """
+    (job id, status) of the job an enqueue should collapse into, or None to
+    insert. An idempotency key that has outlived the window is released here.
+    """
+    if idempotency_key:
+        row = cx.exec_driver_sql(
+            "SELECT id, status, created_at FROM jobs WHERE tenant=? AND idempotency_key=?",
+            (tenant, idempotency_key)
+        ).first()
+        if row is not None:
+            if _age_seconds(row[2]) <= settings.idempotency_window_seconds:
+                return row[0], row[1]
+            cx.exec_driver_sql("UPDATE jobs SET idempotency_key=NULL WHERE id=?", (row[0],))
+    if dedup_hash:
+        row = cx.exec_driver_sql(
+            "SELECT id, status FROM jobs WHERE tenant=? AND dedup_hash=? AND status='queued' "
+            "ORDER BY id LIMIT 1",
+            (tenant, dedup_hash)
+        ).first()
+        if row is not None:
+            return row[0], row[1]
+    return None
+
+def is_key_conflict(e: IntegrityError) -> bool:
+    # a concurrent enqueue won the race for the same idempotency key
+    return "idempotency_key" in str(e.orig)
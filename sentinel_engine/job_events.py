@@ -0,0 +1,122 @@
+"""
+In-process broadcast bus for job state changes, served as SSE by
+GET /v0/jobs/events.
+
+Queue backends publish() enqueue, claim and complete transitions (from
+whichever thread they run on). Every event gets a cursor "<epoch>-<seq>";
+the last settings.job_events_history events are kept so a client that
+reconnects with its last cursor (Last-Event-ID) is replayed what it missed.
+A cursor from before a restart (other epoch) or older than the retained
+history gets a single "reset" event instead: the client should resync from
+/v0/jobs/recent and carry on from there.
+
+Subscribers filter at publish time, so a watcher of one job costs nothing
+when other jobs change. A subscriber that falls more than
+settings.job_events_queue_size events behind is cut off with a "reset"
+that carries no cursor, rather than buffered without bound; reconnecting
+with its last cursor replays the gap from history.
+"""
+import asyncio
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .config import settings
+
+RESET = "reset"
+
+@dataclass
+class EventFilter:
+    kinds: Optional[set[str]] = None
+    tenants: Optional[set[str]] = None
+    job_ids: Optional[set[str]] = None
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        return ((self.kinds is None or event["kind"] in self.kinds)
+                and (self.tenants is None or str(event["tenant"]) in self.tenants)
+                and (self.job_ids is None or str(event["id"]) in self.job_ids))
+
+@dataclass(eq=False)
+class Subscription:
+    filter: EventFilter
+    loop: asyncio.AbstractEventLoop
+    queue: asyncio.Queue = field(default_factory=lambda: asyncio.Queue(settings.job_events_queue_size))
+    overflowed: bool = False
+
+    def _push(self, item: Tuple[Optional[str], Dict[str, Any]]):
+        # runs on the subscriber's loop
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait((None, {"type": RESET, "reason": "slow consumer"}))
+
+    async def next(self, timeout: float) -> Optional[Tuple[Optional[str], Dict[str, Any]]]:
+        """(cursor, event), or None if nothing arrived within `timeout`."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+class JobEventBus:
+    def __init__(self, history: int):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._history: deque = deque(maxlen=max(1, history))
+        self._subs: set[Subscription] = set()
+
+    def publish(self, type: str, jobs: Iterable[Dict[str, Any]]) -> None:
+        """Thread-safe. `jobs` are dicts with id, kind, tenant and status."""
+        at = time.time()
+        with self._lock:
+            for job in jobs:
+                self._seq += 1
+                cursor = f"{self.epoch}-{self._seq}"
+                event = {"type": type, "id": job["id"], "kind": job["kind"],
+                         "tenant": job.get("tenant"), "status": job["status"], "at": at}
+                self._history.append((self._seq, cursor, event))
+                for sub in self._subs:
+                    if sub.filter.matches(event) and not sub.loop.is_closed():
+                        sub.loop.call_soon_threadsafe(sub._push, (cursor, event))
+
+    def _replay(self, cursor: Optional[str], flt: EventFilter) -> List[Tuple[str, Dict[str, Any]]]:
+        if not cursor:
+            return []
+        epoch, _, seq = cursor.partition("-")
+        try:
+            seq = int(seq)
+        except ValueError:
+            seq = -1
+        oldest = self._history[0][0] if self._history else self._seq + 1
+        if epoch != self.epoch or seq < 0 or seq > self._seq or seq < oldest - 1:
+            return [(f"{self.epoch}-{self._seq}", {"type": RESET, "reason": "cursor expired"})]
+        return [(c, e) for s, c, e in self._history if s > seq and flt.matches(e)]
+
+    def subscribe(self, flt: EventFilter, cursor: Optional[str] = None) -> Tuple[Subscription, List[Tuple[str, Dict[str, Any]]]]:
+        """
+        Register a subscriber on the running loop. Returns it with the events
+        to replay first; replay and registration happen under one lock so no
+        event falls between them.
+        """
+        sub = Subscription(flt, asyncio.get_running_loop())
+        with self._lock:
+            backlog = self._replay(cursor, flt)
+            self._subs.add(sub)
+        return sub, backlog
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            self._subs.discard(sub)
+
+bus = JobEventBus(settings.job_events_history)
+
+def publish(type: str, jobs: Iterable[Dict[str, Any]]) -> None:
+    bus.publish(type, jobs)
@@ -0,0 +1,190 @@
+"""
+Job dependency graphs (fan-out / fan-in).
+
+A job enqueued with depends_on starts in status 'waiting' with
+jobs.pending_deps set to the number of unfinished parents; the edges live in
+job_deps(parent_id, child_id). When a parent completes, settle_dependents()
+decrements its children's counters through the job_deps primary key and
+flips the ones that reach zero to 'queued', so nothing ever polls for ready
+work. A failed parent fails every waiting descendant. At claim time a fan-in
+job receives its parents' outputs as parent_outputs. A node with a future
+run_at becomes 'scheduled' instead of 'queued' once it is unblocked.
+
+All functions take the caller's connection so they join its transaction.
+"""
+import json
+import time
+from typing import Any, Callable, Dict, Iterable, List, Set, Tuple
+
+from . import blob_store
+
+# Edge columns carry the type of jobs.id: with its affinity a path id
+# such as "1" still matches the INTEGER id 1 of the ORM schema.
+JOB_DEPS_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS job_deps (
+  parent_id {id_type} NOT NULL,
+  child_id {id_type} NOT NULL,
+  PRIMARY KEY (parent_id, child_id)
+) WITHOUT ROWID
+"""
+JOB_DEPS_INDEX_DDL = "CREATE INDEX IF NOT EXISTS ix_job_deps_child ON job_deps(child_id)"
+
+DEPENDENCY_FAILED = json.dumps({"ok": False, "error": "dependency_failed"})
+
+class GraphError(ValueError):
+    pass
+
+def ensure_deps_schema(cx, id_type: str) -> None:
+    """
+    Create job_deps with `id_type` ("TEXT" or "INTEGER") edge columns. A
+    table from before the columns were typed is rebuilt, casting the edges
+    it already holds.
+    """
+    info = cx.exec_driver_sql("PRAGMA table_info(job_deps)").fetchall()
+    if info and all((r[2] or "").upper() == id_type for r in info):
+        cx.exec_driver_sql(JOB_DEPS_INDEX_DDL)
+        return
+    if info:
+        cx.exec_driver_sql("ALTER TABLE job_deps RENAME TO job_deps_untyped")
+        cx.exec_driver_sql("DROP INDEX IF EXISTS ix_job_deps_child")
+    cx.exec_driver_sql(JOB_DEPS_TABLE_DDL.format(id_type=id_type))
+    cx.exec_driver_sql(JOB_DEPS_INDEX_DDL)
+    if info:
+        cx.exec_driver_sql(
+            "INSERT OR IGNORE INTO job_deps(parent_id, child_id) "
+            f"SELECT CAST(parent_id AS {id_type}), CAST(child_id AS {id_type}) FROM job_deps_untyped"
+        )
+        cx.exec_driver_sql("DROP TABLE job_deps_untyped")
+
+def topo_order(nodes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    by_key = {}
+    for n in nodes:
+        key = n["key"]
+        if key in by_key:
+            raise GraphError(f"duplicate key {key!r}")
+        by_key[key] = n
+    indeg = {k: sum(1 for d in n.get("depends_on") or [] if d in by_key) for k, n in by_key.items()}
+    children: Dict[str, List[str]] = {}
+    for k, n in by_key.items():
+        for d in n.get("depends_on") or []:
+            if d in by_key:
+                children.setdefault(d, []).append(k)
+    ready = [k for k, c in indeg.items() if c == 0]
+    order = []
+    while ready:
+        k = ready.pop(0)  # keep submission order among ready nodes
+        order.append(by_key[k])
+        for c in children.get(k, []):
+            indeg[c] -= 1
+            if indeg[c] == 0:
+                ready.append(c)
+    if len(order) != len(nodes):
+        raise GraphError("dependency cycle")
+    return order
+
+def insert_graph(cx, nodes: List[Dict[str, Any]], insert: Callable[..., Any]) -> Dict[str, Any]:
+    """
+    Insert a graph of jobs. Each node is {key, kind, payload_json, priority,
+    tenant, run_at, depends_on: [key or existing job id]}; the row itself is
+    written by insert(cx, node, status, pending_deps, output_json), which
+    returns the new job id. Returns {key: job id}. Raises GraphError for
+    cycles, unknown dependencies or recurring (cron) nodes.
+    """
+    ids: Dict[str, Any] = {}
+    for n in nodes:
+        if n.get("cron"):
+            raise GraphError(f"node {n['key']!r}: recurring jobs cannot be part of a graph")
+    for n in topo_order(nodes):
+        parents = []
+        for d in n.get("depends_on") or []:
+            parents.append(ids[d] if d in ids else d)
+        parents = list(dict.fromkeys(parents))
+        pending, failed = 0, False
+        for p in parents:
+            if p in ids.values():
+                pending += 1
+                continue
+            row = cx.exec_driver_sql("SELECT status FROM jobs WHERE id=?", (p,)).first()
+            if row is None:
+                raise GraphError(f"unknown dependency {p!r}")
+            if row[0] == "failed":
+                failed = True
+            elif row[0] != "completed":
+                pending += 1
+        run_at = n.get("run_at")
+        if failed:
+            status = "failed"
+        elif pending:
+            status = "waiting"
+        else:
+            status = "scheduled" if run_at is not None and run_at > time.time() else "queued"
+        job_id = insert(cx, n, status, pending, DEPENDENCY_FAILED if failed else None)
+        if parents:
+            cx.exec_driver_sql(
+                "INSERT OR IGNORE INTO job_deps(parent_id, child_id) VALUES(?,?)",
+                [(p, job_id) for p in parents]
+            )
+        ids[n["key"]] = job_id
+    return ids
+
+def _children(cx, parent_ids: List[Any]) -> List[Any]:
+    if not parent_ids:
+        return []
+    marks = ",".join("?" * len(parent_ids))
+    return [r[0] for r in cx.exec_driver_sql(
+        f"SELECT child_id FROM job_deps WHERE parent_id IN ({marks})", tuple(parent_ids)
+    ).fetchall()]
+
+def settle_dependents(cx, finished: Iterable[Tuple[Any, str]], cols: Set[str]) -> int:
+    """
+    Propagate (job_id, status) completions to waiting children. Returns how
+    many children became claimable (or scheduled, for a future run_at).
+    cols is the jobs column set from job_queue.ensure_job_schema().
+    """
+    finished = list(finished)
+    done = [j for j, s in finished if s == "completed"]
+    failed = [j for j, s in finished if s == "failed"]
+    promoted = 0
+    for job_id in done:
+        # one decrement per edge; job_deps' PK is (parent_id, child_id)
+        cx.exec_driver_sql(
+            "UPDATE jobs SET pending_deps = pending_deps - 1 "
+            "WHERE status='waiting' AND id IN (SELECT child_id FROM job_deps WHERE parent_id=?)",
+            (job_id,)
+        )
+        promoted += cx.exec_driver_sql(
+            "UPDATE jobs SET status=CASE WHEN run_at > ? THEN 'scheduled' ELSE 'queued' END "
+            "WHERE status='waiting' AND pending_deps <= 0 "
+            "AND id IN (SELECT child_id FROM job_deps WHERE parent_id=?)",
+            (time.time(), job_id)
+        ).rowcount
+    frontier = failed
+    # raw-SQL schema keeps output_json on jobs; the ORM schema puts it in results
+    set_output = ", output_json=?" if failed and "output_json" in cols else ""
+    while frontier:
+        kids = _children(cx, frontier)
+        if not kids:
+            break
+        marks = ",".join("?" * len(kids))
+        frontier = [r[0] for r in cx.exec_driver_sql(
+            f"UPDATE jobs SET status='failed'{set_output} WHERE status='waiting' AND id IN ({marks}) "
+            "RETURNING id",
+            ((DEPENDENCY_FAILED,) if set_output else ()) + tuple(kids)
+        ).fetchall()]
+    return promoted
+
+def parent_outputs(cx, child_ids: List[Any], cols: Set[str]) -> Dict[Any, Dict[str, Any]]:
+    """{child id: {parent id: output_json}} for the given (fan-in) jobs."""
+    if not child_ids:
+        return {}
+    marks = ",".join("?" * len(child_ids))
+    source = "jobs j ON j.id" if "output_json" in cols else "results j ON j.job_id"
+    rows = cx.exec_driver_sql(
+        "SELECT d.child_id, d.parent_id, j.output_json, j.output_blob FROM job_deps d "
+        f"JOIN {source} = d.parent_id WHERE d.child_id IN ({marks})",
+        tuple(child_ids)
+    ).fetchall()
+    out: Dict[Any, Dict[str, Any]] = {}
+    for child, parent, output_json, output_blob in rows:
+        out.setdefault(child, {})[str(parent)] = blob_store.resolve(output_json, output_blob)
+    return out
@@ -0,0 +1,143 @@
+"""
+Execution lanes for job handlers: inline, thread pool or process pool.
+
+Used by ops/agent_worker.py and EnhancedJobHandlers.handle_job so that a
+CPU-heavy handler (artifact scans, big JSON transforms) never holds the
+event loop that runs claims, heartbeats and completes.
+
+- inline: awaited (or called) on the loop. For handlers that only await.
+- thread: run in a thread pool. For blocking I/O: subprocess, requests.
+- process: run in a warm process pool, for CPU-bound work. The handler
+  must be a module-level function so the child can import it.
+
+A handler declares itself CPU-bound with @cpu_bound. A per-kind policy
+("safety_scan:process,shell_exec:thread") overrides that. Without either,
+coroutine functions run inline and plain functions in a thread.
+
+Arguments bound for the process pool are pickled once. Ones at least
+shm_threshold bytes long go through multiprocessing.shared_memory instead
+of the pool's pipe; smaller ones are not worth the segment setup. Results
+come back through the pipe.
+
+One Lanes per process: the agent worker registers its instance with
+share() and EnhancedJobHandlers runs on shared() when there is one.
+
+Standard library only: the agent worker imports this without the server's
+dependencies.
+"""
+import asyncio
+import inspect
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, Optional
+
+LANES = ("inline", "thread", "process")
+
+def cpu_bound(fn: Callable) -> Callable:
+    """Mark a module-level handler to run in the process lane by default."""
+    fn.cpu_bound = True
+    return fn
+
+def parse_lanes(spec: str) -> Dict[str, str]:
+    # "safety_scan:process,shell_exec:thread" -> {"safety_scan": "process", "shell_exec": "thread"}
+    out: Dict[str, str] = {}
+    for part in spec.split(","):
+        if ":" not in part:
+            continue
+        kind, lane = (x.strip() for x in part.split(":", 1))
+        if lane not in LANES:
+            raise ValueError(f"unknown lane {lane!r} for kind {kind!r}")
+        out[kind] = lane
+    return out
+
+_shared: Optional["Lanes"] = None
+
+def share(lanes: "Lanes") -> "Lanes":
+    """Make `lanes` this process's instance, so every handler set runs on one pair of pools."""
+    global _shared
+    _shared = lanes
+    return lanes
+
+def shared() -> Optional["Lanes"]:
+    """The Lanes registered with share() in this process, if any."""
+    return _shared
+
+def _call(fn: Callable, arg: Any) -> Any:
+    if inspect.iscoroutinefunction(fn):
+        return asyncio.run(fn(arg))  # a private loop in the pool thread / child
+    return fn(arg)
+
+def _run_in_child(fn: Callable, data: Optional[bytes], shm_name: Optional[str], size: int) -> Any:
+    if shm_name is None:
+        return _call(fn, pickle.loads(data))
+    # pool children share the parent's resource tracker, so attaching here
+    # does not register a second owner; the parent unlinks
+    shm = shared_memory.SharedMemory(name=shm_name)
+    view = shm.buf[:size]
+    try:
+        arg = pickle.loads(view)
+    finally:
+        view.release()
+        shm.close()
+    return _call(fn, arg)
+
+def _noop() -> None:
+    return None
+
+class Lanes:
+    def __init__(self, policy: Optional[Dict[str, str]] = None, process_workers: Optional[int] = None,
+                 thread_workers: Optional[int] = None, shm_threshold: int = 1 << 20):
+        self.policy = dict(policy or {})
+        self.process_workers = process_workers or os.cpu_count() or 1
+        self.shm_threshold = shm_threshold
+        self._threads = ThreadPoolExecutor(max_workers=thread_workers, thread_name_prefix="job-lane")
+        self._processes: Optional[ProcessPoolExecutor] = None
+
+    def lane_for(self, kind: str, fn: Callable) -> str:
+        if kind in self.policy:
+            return self.policy[kind]
+        if getattr(fn, "cpu_bound", False):
+            return "process"
+        return "inline" if inspect.iscoroutinefunction(fn) else "thread"
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._processes is None:
+            # spawn: children must not inherit the parent's event loop and threads
+            self._processes = ProcessPoolExecutor(self.process_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._processes
+
+    async def warm(self) -> None:
+        """Start every process-pool worker now rather than on the first CPU-bound job."""
+        loop = asyncio.get_running_loop()
+        pool = self._pool()
+        await asyncio.gather(*(loop.run_in_executor(pool, _noop) for _ in range(self.process_workers)))
+
+    async def run(self, kind: str, fn: Callable, arg: Any) -> Any:
+        lane = self.lane_for(kind, fn)
+        if lane == "inline":
+            result = fn(arg)
+            return await result if inspect.isawaitable(result) else result
+        loop = asyncio.get_running_loop()
+        if lane == "thread":
+            return await loop.run_in_executor(self._threads, _call, fn, arg)
+        data = pickle.dumps(arg, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) < self.shm_threshold:
+            return await loop.run_in_executor(self._pool(), _run_in_child, fn, data, None, 0)
+        size = len(data)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        try:
+            shm.buf[:size] = data
+            del data
+            # shm.size can be rounded up to a page; the child reads exactly `size`
+            return await loop.run_in_executor(self._pool(), _run_in_child, fn, None, shm.name, size)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def close(self) -> None:
+        self._threads.shutdown(wait=False)
+        if self._processes is not None:
+            self._processes.shutdown(wait=True, cancel_futures=True)
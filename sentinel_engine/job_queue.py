@@ -0,0 +1,375 @@
+"""
+Shared job claim engine.
+
+Every claim path (routes/jobs.py, routes/jobs_claim_mvp.py and
+routes/orchestrator_agent_mvp.py) goes through claim_next() or
+claim_batch(), which claim queued jobs (priority DESC, id) with a single
+UPDATE ... WHERE id = (SELECT ...) RETURNING statement served by partial
+indexes on queued rows.
+"""
+import itertools
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy.exc import OperationalError
+
+from . import blob_store
+from .config import settings
+from .db import get_engine
+from .job_counters import ensure_counters
+from .job_dedup import DEDUP_INDEX_DDL
+from .job_graph import ensure_deps_schema, parent_outputs
+
+# Columns added after the jobs table first shipped (raw-SQL and ORM schemas).
+JOB_COLUMN_MIGRATIONS = {
+    "priority": "ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 0",
+    "tenant": "ALTER TABLE jobs ADD COLUMN tenant INTEGER NOT NULL DEFAULT 1",
+    "lease_expires_at": "ALTER TABLE jobs ADD COLUMN lease_expires_at REAL",  # unix seconds
+    "pending_deps": "ALTER TABLE jobs ADD COLUMN pending_deps INTEGER NOT NULL DEFAULT 0",
+    "run_at": "ALTER TABLE jobs ADD COLUMN run_at REAL",  # unix seconds, see job_schedule
+    "cron": "ALTER TABLE jobs ADD COLUMN cron TEXT",
+    "idempotency_key": "ALTER TABLE jobs ADD COLUMN idempotency_key TEXT",  # see job_dedup
+    "dedup_hash": "ALTER TABLE jobs ADD COLUMN dedup_hash TEXT",
+    "payload_blob": "ALTER TABLE jobs ADD COLUMN payload_blob TEXT",  # digest set by blob_store.offload
+}
+# The output's blob digest sits next to output_json: on jobs (raw-SQL schema)
+# or on results (ORM schema).
+OUTPUT_BLOB_DDL = "ALTER TABLE {table} ADD COLUMN output_blob TEXT"
+
+# Job ids are time-ordered (see ids.py; INTEGER autoincrement on the ORM
+# schema), so within a priority level the primary key is queue order.
+JOB_INDEX_DDL = (
+    "CREATE INDEX IF NOT EXISTS ix_jobs_queued_prio ON jobs(priority DESC, id) WHERE status='queued'",
+    "CREATE INDEX IF NOT EXISTS ix_jobs_queued_id ON jobs(id) WHERE status='queued'",
+    # per-tenant virtual queues for fair-share claims
+    "CREATE INDEX IF NOT EXISTS ix_jobs_queued_tenant ON jobs(tenant, priority DESC, id) WHERE status='queued'",
+    # only leased (claimed, not yet completed) jobs carry a lease
+    "CREATE INDEX IF NOT EXISTS ix_jobs_lease ON jobs(lease_expires_at) WHERE lease_expires_at IS NOT NULL",
+    # delayed / recurring jobs: promote_due() and the timer's next-wake lookup
+    "CREATE INDEX IF NOT EXISTS ix_jobs_status_run_at ON jobs(status, run_at)",
+    # GET /v0/jobs listing: each filter shape walks its index in id order, no sort step
+    "CREATE INDEX IF NOT EXISTS ix_jobs_status_id ON jobs(status, id)",
+    "CREATE INDEX IF NOT EXISTS ix_jobs_kind_status_id ON jobs(kind, status, id)",
+    "CREATE INDEX IF NOT EXISTS ix_jobs_created_at ON jobs(created_at)",
+    # blob garbage collection (job_archive.referenced_blobs)
+    "CREATE INDEX IF NOT EXISTS ix_jobs_payload_blob ON jobs(payload_blob) WHERE payload_blob IS NOT NULL",
+)
+# claimer column differs between the raw-SQL (claimed_by) and ORM (agent_id) schemas
+AGENT_COLUMNS = ("claimed_by", "agent_id")
+
+# Skip-scan over ix_jobs_queued_tenant: one index seek per tenant with work.
+ACTIVE_TENANTS_SQL = """
+WITH RECURSIVE t(tenant) AS (
+  SELECT MIN(tenant) FROM jobs WHERE status='queued'
+  UNION ALL
+  SELECT (SELECT MIN(tenant) FROM jobs WHERE status='queued' AND tenant > t.tenant)
+  FROM t WHERE t.tenant IS NOT NULL
+)
+SELECT tenant FROM t WHERE tenant IS NOT NULL
+"""
+LEGACY_INDEX_DROPS = (
+    "DROP INDEX IF EXISTS ix_jobs_queued_created",
+)
+
+CLAIM_RETRIES = 8
+CLAIM_BACKOFF_SECONDS = 0.01
+
+_schema_lock = threading.Lock()
+_columns: set[str] | None = None
+_text_ids = True
+_claims = itertools.count(1)
+
+def ensure_job_schema(cx=None) -> set[str]:
+    """
+    Bring an existing jobs table up to date (added columns, claim indexes)
+    and return its column names. The jobs table has been created by both the
+    raw-SQL routes and the ORM models, so claim only touches the bookkeeping
+    columns that exist.
+    """
+    global _columns, _text_ids
+    if _columns is not None:
+        return _columns
+    if cx is None:
+        with get_engine(immediate=True).begin() as cx:
+            return ensure_job_schema(cx)
+    with _schema_lock:
+        if _columns is None:
+            info = cx.exec_driver_sql("PRAGMA table_info(jobs)").fetchall()
+            cols = {r[1] for r in info}
+            if not cols:
+                return cols  # not created yet
+            # raw-SQL schema: TEXT ids minted by ids.new_id(); ORM schema: INTEGER autoincrement
+            _text_ids = not any(r[1] == "id" and "INT" in (r[2] or "").upper() for r in info)
+            for col, ddl in JOB_COLUMN_MIGRATIONS.items():
+                if col not in cols:
+                    cx.exec_driver_sql(ddl)
+                    cols.add(col)
+            results = {r[1] for r in cx.exec_driver_sql("PRAGMA table_info(results)").fetchall()}
+            for table, have in (("jobs", cols), ("results", results)):
+                if "output_json" not in have:
+                    continue
+                if "output_blob" not in have:
+                    cx.exec_driver_sql(OUTPUT_BLOB_DDL.format(table=table))
+                    have.add("output_blob")
+                cx.exec_driver_sql(
+                    f"CREATE INDEX IF NOT EXISTS ix_{table}_output_blob ON {table}(output_blob) "
+                    "WHERE output_blob IS NOT NULL"
+                )
+            for ddl in LEGACY_INDEX_DROPS + JOB_INDEX_DDL + DEDUP_INDEX_DDL:
+                cx.exec_driver_sql(ddl)
+            ensure_deps_schema(cx, "TEXT" if _text_ids else "INTEGER")
+            for col in AGENT_COLUMNS:
+                if col in cols:
+                    cx.exec_driver_sql(
+                        f"CREATE INDEX IF NOT EXISTS ix_jobs_leased_{col} ON jobs({col}) "
+                        "WHERE lease_expires_at IS NOT NULL"
+                    )
+                    cx.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS ix_jobs_{col}_id ON jobs({col}, id)")
+            ensure_counters(cx)
+            _columns = cols
+    return _columns
+
+def ids_are_text(cx=None) -> bool:
+    """True when job ids are minted by the application rather than the table."""
+    ensure_job_schema(cx)
+    return _text_ids
+
+def aging_pick() -> bool:
+    # With aging on, every Nth claim ignores priority and takes the oldest
+    # queued job, so low-priority work keeps a guaranteed share of claims.
+    every = settings.queue_aging_every
+    return every > 0 and next(_claims) % every == 0
+
+def parse_weights(spec: str) -> Dict[Any, float]:
+    # "1:3,2:1" -> {1: 3.0, 2: 1.0}
+    out: Dict[Any, float] = {}
+    for part in (spec or "").split(","):
+        if ":" not in part:
+            continue
+        tenant, weight = (x.strip() for x in part.split(":", 1))
+        try:
+            w = float(weight)
+        except ValueError:
+            continue
+        if w > 0:
+            out[int(tenant) if tenant.isdigit() else tenant] = w
+    return out
+
+class FairShareScheduler:
+    """
+    Weighted deficit round robin over the tenants that have queued jobs.
+    Each visit credits a tenant with its weight; a tenant is served one job
+    per whole unit of credit before the ring moves on, so a tenant with
+    weight 3 gets three claims for every one of a weight-1 tenant no matter
+    how deep either backlog is.
+    """
+
+    def __init__(self, weights: Dict[Any, float], refresh_seconds: float = 1.0,
+                 active: Optional[Callable[[Any], List[Any]]] = None):
+        self.weights = weights
+        self.refresh_seconds = refresh_seconds
+        # tenants with queued work; the SQLite skip-scan unless a backend supplies its own
+        self._active = active or (lambda cx: [r[0] for r in cx.exec_driver_sql(ACTIVE_TENANTS_SQL).fetchall()])
+        self._lock = threading.Lock()
+        self._ring: List[Any] = []
+        self._deficit: Dict[Any, float] = {}
+        self._pos = 0
+        self._refreshed = 0.0
+
+    def _refresh(self, cx):
+        tenants = self._active(cx)
+        current = self._ring[self._pos] if self._ring else None
+        self._deficit = {t: self._deficit.get(t, 0.0) for t in tenants}
+        self._ring = tenants
+        self._pos = tenants.index(current) if current in tenants else 0
+        self._refreshed = time.monotonic()
+
+    def plan(self, cx, n: int) -> Dict[Any, int]:
+        """Split `n` claims across tenants; {} when no tenant has work."""
+        out: Dict[Any, int] = {}
+        with self._lock:
+            if not self._ring or time.monotonic() - self._refreshed > self.refresh_seconds:
+                self._refresh(cx)
+            while n > 0 and self._ring:
+                t = self._ring[self._pos]
+                if self._deficit[t] < 1:
+                    self._deficit[t] += self.weights.get(t, 1.0)
+                take = min(n, int(self._deficit[t]))
+                if take:
+                    out[t] = out.get(t, 0) + take
+                    self._deficit[t] -= take
+                    n -= take
+                if self._deficit[t] < 1:
+                    self._pos = (self._pos + 1) % len(self._ring)
+        return out
+
+    def drained(self, tenant: Any):
+        with self._lock:
+            if tenant in self._deficit:
+                current = self._ring[self._pos]
+                self._ring.remove(tenant)
+                del self._deficit[tenant]
+                if not self._ring:
+                    self._pos = 0
+                elif current == tenant:
+                    self._pos %= len(self._ring)
+                else:
+                    self._pos = self._ring.index(current)
+
+fair_share = FairShareScheduler(parse_weights(settings.tenant_weights))
+
+def _claim_sql(cols: set[str], batch: bool, fifo: bool, tenant: bool = False) -> tuple[str, list[str]]:
+    sets, params = ["status=?"], ["status"]
+    for col, param in (("claimed_by", "agent"), ("agent_id", "agent"),
+                       ("claimed_at", "iso"), ("updated_at", "db_ts"),
+                       ("lease_expires_at", "lease")):
+        if col in cols:
+            sets.append(f"{col}=?")
+            params.append(param)
+    order = "id" if fifo or "priority" not in cols else "priority DESC, id"
+    scope = "status='queued'"
+    source = "jobs"
+    if tenant:
+        scope += " AND tenant=?"
+        params.append("tenant")
+    elif order != "id":
+        # left to itself the planner takes a status index and sorts the whole
+        # queue in a temp B-tree; this walk stops after LIMIT rows
+        source = "jobs INDEXED BY ix_jobs_queued_prio"
+    if batch:
+        where = f"id IN (SELECT id FROM {source} WHERE {scope} ORDER BY {order} LIMIT ?)"
+        params.append("limit")
+    else:
+        where = f"id = (SELECT id FROM {source} WHERE {scope} ORDER BY {order} LIMIT 1)"
+    sql = (
+        f"UPDATE jobs SET {', '.join(sets)} "
+        f"WHERE {where} AND status='queued' "
+        "RETURNING id, kind, payload_json, created_at, priority, tenant, payload_blob"
+    )
+    return sql, params
+
+def _run_claim(cx, cols: set[str], values: Dict[str, Any], limit: int, fifo: bool, tenant: Any = None) -> list:
+    sql, params = _claim_sql(cols, batch=limit > 1, fifo=fifo, tenant=tenant is not None)
+    values = dict(values, limit=limit, tenant=tenant)
+    return cx.exec_driver_sql(sql, tuple(values[p] for p in params)).fetchall()
+
+def _fair_claim(cx, cols: set[str], values: Dict[str, Any], limit: int) -> list:
+    rows: list = []
+    for _ in range(4):  # a stale ring can hand out drained tenants; re-plan
+        plan = fair_share.plan(cx, limit - len(rows))
+        if not plan:
+            break
+        for tenant, k in plan.items():
+            got = _run_claim(cx, cols, values, k, fifo=False, tenant=tenant)
+            if len(got) < k:
+                fair_share.drained(tenant)
+            rows.extend(got)
+        if len(rows) >= limit:
+            break
+    return rows
+
+def _is_busy(e: OperationalError) -> bool:
+    msg = str(e).lower()
+    return "locked" in msg or "busy" in msg
+
+def claim_batch(agent_id: Any, limit: int, claimed_status: str = "claimed") -> List[Dict[str, Any]]:
+    """
+    Atomically move up to `limit` queued jobs (highest priority, then oldest)
+    to `claimed_status` for `agent_id` in one transaction. With fair share on,
+    the claims are split across tenants by FairShareScheduler and each
+    tenant's share is one statement against its own virtual queue.
+    Returns the claimed jobs in claim order; an empty list means the queue is
+    empty.
+    Contention on the SQLite write lock is retried here rather than surfaced
+    to the caller as an empty claim.
+    """
+    eng = get_engine(immediate=True)
+    fifo = aging_pick()
+    for attempt in range(CLAIM_RETRIES):
+        now = datetime.now(timezone.utc)
+        values = {
+            "status": claimed_status,
+            "agent": agent_id,
+            "iso": now.isoformat(),
+            "db_ts": now.replace(tzinfo=None).strftime("%Y-%m-%d %H:%M:%S.%f"),
+            "lease": now.timestamp() + settings.job_lease_seconds,
+        }
+        try:
+            with eng.begin() as cx:
+                cols = ensure_job_schema(cx)
+                if settings.queue_fair_share and not fifo and "tenant" in cols:
+                    rows = _fair_claim(cx, cols, values, limit)
+                else:
+                    rows = _run_claim(cx, cols, values, limit, fifo=fifo)
+                parents = parent_outputs(cx, [r[0] for r in rows], cols)
+        except OperationalError as e:
+            if not _is_busy(e) or attempt == CLAIM_RETRIES - 1:
+                raise
+            time.sleep(CLAIM_BACKOFF_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5))
+            continue
+        # RETURNING order is unspecified, hand jobs back in queue order
+        rows.sort(key=(lambda r: r[0]) if fifo else (lambda r: (-r[4], r[0])))
+        jobs = [
+            {
+                "id": job_id,
+                "kind": kind,
+                "payload_json": blob_store.resolve(payload_json, payload_blob),
+                "status": claimed_status,
+                "claimed_by": agent_id,
+                "created_at": created_at,
+                "claimed_at": values["iso"],
+                "priority": priority,
+                "tenant": tenant,
+            }
+            for job_id, kind, payload_json, created_at, priority, tenant, payload_blob in rows
+        ]
+        for job in jobs:
+            if job["id"] in parents:
+                job["parent_outputs"] = parents[job["id"]]  # fan-in
+        return jobs
+    return []
+
+def claim_next(agent_id: Any, claimed_status: str = "claimed") -> Optional[Dict[str, Any]]:
+    """
+    Atomically move the next queued job to `claimed_status` for `agent_id`.
+    Returns the claimed job as a dict, or None when the queue is empty.
+    """
+    jobs = claim_batch(agent_id, 1, claimed_status)
+    return jobs[0] if jobs else None
+
+def extend_leases(agent_id: Any, cx=None) -> int:
+    """Push out the lease of every job `agent_id` holds; returns how many."""
+    if cx is None:
+        with get_engine(immediate=True).begin() as cx:
+            return extend_leases(agent_id, cx)
+    cols = ensure_job_schema(cx)
+    if "lease_expires_at" not in cols:
+        return 0
+    expires = time.time() + settings.job_lease_seconds
+    n = 0
+    for col in AGENT_COLUMNS:
+        if col in cols:
+            n += cx.exec_driver_sql(
+                f"UPDATE jobs SET lease_expires_at=? WHERE {col}=? AND lease_expires_at IS NOT NULL",
+                (expires, agent_id)
+            ).rowcount
+    return n
+
+def requeue_expired_leases() -> int:
+    """
+    Return jobs whose lease ran out (crashed or hung agent) to the queue in
+    one set-based UPDATE over ix_jobs_lease. Returns how many were requeued.
+    """
+    with get_engine(immediate=True).begin() as cx:
+        cols = ensure_job_schema(cx)
+        if "lease_expires_at" not in cols:
+            return 0
+        resets = "".join(f", {col}=NULL" for col in AGENT_COLUMNS if col in cols)
+        return cx.exec_driver_sql(
+            f"UPDATE jobs SET status='queued', lease_expires_at=NULL{resets} "
+            "WHERE lease_expires_at IS NOT NULL AND lease_expires_at < ?",
+            (time.time(),)
+        ).rowcount
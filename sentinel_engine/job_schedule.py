@@ -0,0 +1,177 @@
+"""
+Delayed and recurring jobs.
+
+A job enqueued with run_at in the future (or with a cron spec) is stored in
+status 'scheduled' with jobs.run_at in unix seconds. promote_due() moves due
+rows to 'queued' through the (status, run_at) index, and next_run_at() tells
+the orchestrator timer how long it may sleep, so nothing polls on a fixed
+interval.
+
+Recurring jobs keep a template row: the row with the cron spec stays
+'scheduled' (its id is the stable handle for the recurrence) and every time
+it comes due a plain copy is queued and the template's run_at moves to the
+next occurrence. Missed occurrences are not replayed; a recurrence that was
+due several times while the server was down runs once.
+
+Specs are five-field cron ("m h dom mon dow", with *, lists, ranges and
+/steps), the aliases @hourly, @daily, @weekly and @monthly, or
+"@every <n>[smhd]".
+"""
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, List, Optional
+
+from .db import get_engine
+from .ids import new_id
+from .job_queue import ensure_job_schema, ids_are_text
+
+ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+}
+FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+_EVERY_RE = re.compile(r"^@every\s+(\d+(?:\.\d+)?)\s*([smhd]?)$")
+
+class ScheduleError(ValueError):
+    pass
+
+def _field(spec: str, lo: int, hi: int) -> set[int]:
+    out: set[int] = set()
+    for part in spec.split(","):
+        rng, _, step = part.partition("/")
+        if rng == "*":
+            a, b = lo, hi
+        elif "-" in rng:
+            a, b = (int(x) for x in rng.split("-", 1))
+        else:
+            a = b = int(rng)
+            if step:
+                b = hi  # "5/15" means from 5 every 15
+        n = int(step) if step else 1
+        if not (lo <= a <= b <= hi) or n < 1:
+            raise ValueError(part)
+        out.update(range(a, b + 1, n))
+    return out
+
+def every_seconds(spec: str) -> Optional[float]:
+    """The interval of an "@every" spec, None for calendar specs."""
+    m = _EVERY_RE.match(spec.strip())
+    if not m:
+        return None
+    return float(m.group(1)) * UNITS[m.group(2) or "s"]
+
+def cron_next(spec: str, after: float) -> float:
+    """Next occurrence of `spec` strictly after unix time `after` (UTC)."""
+    interval = every_seconds(spec)
+    if interval is not None:
+        if interval <= 0:
+            raise ScheduleError(f"bad schedule {spec!r}")
+        return after + interval
+    fields = ALIASES.get(spec.strip(), spec).split()
+    if len(fields) != 5:
+        raise ScheduleError(f"bad schedule {spec!r}")
+    try:
+        minute, hour, dom, month, dow = (_field(f, lo, hi) for f, (lo, hi) in zip(fields, FIELD_RANGES))
+    except ValueError:
+        raise ScheduleError(f"bad schedule {spec!r}")
+    # cron semantics: when both day fields are restricted either may match
+    any_dom, any_dow = fields[2] == "*", fields[4] == "*"
+    t = datetime.fromtimestamp(after, timezone.utc).replace(second=0, microsecond=0) + timedelta(minutes=1)
+    limit = t + timedelta(days=366 * 5)
+    while t < limit:
+        if t.month not in month:
+            t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            continue
+        wd = (t.weekday() + 1) % 7  # cron: 0 = Sunday
+        if any_dom and any_dow:
+            day_ok = True
+        elif any_dom or any_dow:
+            day_ok = (t.day in dom) if any_dow else (wd in dow)
+        else:
+            day_ok = t.day in dom or wd in dow
+        if not day_ok:
+            t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            continue
+        if t.hour not in hour:
+            t = t.replace(minute=0) + timedelta(hours=1)
+            continue
+        if t.minute not in minute:
+            t += timedelta(minutes=1)
+            continue
+        return t.timestamp()
+    raise ScheduleError(f"schedule {spec!r} never fires")
+
+def initial_run_at(run_at: Optional[float], cron: Optional[str], now: float) -> Optional[float]:
+    """run_at for a new job: the explicit time, else the first cron occurrence."""
+    if run_at is not None:
+        return run_at
+    if cron:
+        return cron_next(cron, now)
+    return None
+
+def _queue_occurrence(cx, cols: set[str], template_id: Any, due: float) -> None:
+    now = datetime.now(timezone.utc)
+    db_ts = now.replace(tzinfo=None).strftime("%Y-%m-%d %H:%M:%S.%f")
+    # ORM schema stores DateTime strings; the raw-SQL schema ISO timestamps
+    stamp = db_ts if "updated_at" in cols else now.isoformat()
+    names = ["kind", "payload_json", "status", "run_at", "created_at"]
+    exprs = ["kind", "payload_json", "'queued'", "?", "?"]
+    params: List[Any] = [due, stamp]
+    for col in ("priority", "tenant", "payload_blob"):
+        if col in cols:
+            names.append(col)
+            exprs.append(col)
+    if "updated_at" in cols:
+        names.append("updated_at")
+        exprs.append("?")
+        params.append(db_ts)
+    if ids_are_text(cx):
+        names.insert(0, "id")
+        exprs.insert(0, "?")
+        params.insert(0, new_id())
+    cx.exec_driver_sql(
+        f"INSERT INTO jobs({', '.join(names)}) SELECT {', '.join(exprs)} FROM jobs WHERE id=?",
+        tuple(params) + (template_id,)
+    )
+
+def promote_due(now: Optional[float] = None) -> int:
+    """
+    Queue every scheduled job whose run_at has passed, in one transaction.
+    Returns how many jobs became claimable.
+    """
+    now = time.time() if now is None else now
+    with get_engine(immediate=True).begin() as cx:
+        cols = ensure_job_schema(cx)
+        if "run_at" not in cols:
+            return 0
+        n = cx.exec_driver_sql(
+            "UPDATE jobs SET status='queued' WHERE status='scheduled' AND run_at <= ? AND cron IS NULL",
+            (now,)
+        ).rowcount
+        recurring = cx.exec_driver_sql(
+            "SELECT id, run_at, cron FROM jobs WHERE status='scheduled' AND run_at <= ? AND cron IS NOT NULL",
+            (now,)
+        ).fetchall()
+        for job_id, due, spec in recurring:
+            try:
+                nxt = cron_next(spec, max(now, due))
+            except ScheduleError:
+                cx.exec_driver_sql("UPDATE jobs SET status='failed', run_at=NULL WHERE id=?", (job_id,))
+                continue
+            _queue_occurrence(cx, cols, job_id, due)
+            cx.exec_driver_sql("UPDATE jobs SET run_at=? WHERE id=?", (nxt, job_id))
+            n += 1
+    return n
+
+def next_run_at() -> Optional[float]:
+    """Earliest run_at among scheduled jobs (one index seek), or None."""
+    with get_engine().begin() as cx:
+        if "run_at" not in ensure_job_schema(cx):
+            return None
+        row = cx.exec_driver_sql("SELECT MIN(run_at) FROM jobs WHERE status='scheduled'").first()
+    return row[0] if row else None
@@ -0,0 +1,223 @@
+"""
+Latency histograms kept by agent workers and aggregated by the API.
+
+ops/agent_worker.py observes four timings, in seconds:
+
+- claim_latency: round trip of a claim that returned jobs (includes any
+  long-poll wait the server held it for)
+- queue_wait: claimed_at minus created_at, per kind
+- handler_duration: time spent in the handler, per kind
+- completion_latency: handler finished to complete acknowledged by the
+  server (ack batching, spooling and replay included), per kind
+
+The worker serves them in the Prometheus text format on a local port
+(serve_prometheus) and sends snapshot() with every heartbeat. Every
+histogram uses the fixed BUCKETS, so the API can add up the latest
+snapshot of each agent (FleetTelemetry) and read fleet-wide percentiles
+off the merged buckets. Snapshots are cumulative since the worker started:
+a lost heartbeat loses nothing, the next one carries it.
+
+Standard library only: the agent worker imports this without the server's
+dependencies.
+"""
+import asyncio
+import math
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+METRICS = {
+    "claim_latency": "Claim round trip for claims that returned jobs",
+    "queue_wait": "Time from enqueue to claim",
+    "handler_duration": "Time spent in the job handler",
+    "completion_latency": "Time from handler end to acknowledged complete",
+}
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+QUANTILES = (0.5, 0.9, 0.99)
+
+def parse_ts(value: Any) -> Optional[float]:
+    """Unix seconds from an ISO timestamp (naive ones are UTC), or None."""
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+class Histogram:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self, counts: Optional[List[int]] = None, total: float = 0.0):
+        self.counts = list(counts) if counts else [0] * (len(BUCKETS) + 1)  # last one is +Inf
+        self.sum = total
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, seconds: float) -> None:
+        seconds = max(seconds, 0.0)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                break
+        else:
+            i = len(BUCKETS)
+        self.counts[i] += 1
+        self.sum += seconds
+
+    def merge(self, other: "Histogram") -> None:
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.sum += other.sum
+
+    def quantile(self, q: float) -> Optional[float]:
+        # linear within the bucket the rank falls in, as Prometheus' histogram_quantile
+        total = self.count
+        if not total:
+            return None
+        rank, seen = q * total, 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                if i == len(BUCKETS):
+                    return BUCKETS[-1]
+                lo = BUCKETS[i - 1] if i else 0.0
+                return lo + (BUCKETS[i] - lo) * (rank - seen) / n
+            seen += n
+        return BUCKETS[-1]
+
+def _render(series: Dict[Tuple[str, str], Histogram], prefix: str) -> str:
+    lines: List[str] = []
+    for metric, help_text in METRICS.items():
+        rows = sorted((kind, h) for (m, kind), h in series.items() if m == metric)
+        if not rows:
+            continue
+        name = f"{prefix}_{metric}_seconds"
+        lines += [f"# HELP {name} {help_text}.", f"# TYPE {name} histogram"]
+        for kind, h in rows:
+            escaped = kind.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            label = f'kind="{escaped}",' if kind else ""
+            cumulative = 0
+            for bound, n in zip(BUCKETS + (math.inf,), h.counts):
+                cumulative += n
+                le = "+Inf" if bound == math.inf else repr(float(bound))
+                lines.append(f'{name}_bucket{{{label}le="{le}"}} {cumulative}')
+            braces = f"{{{label[:-1]}}}" if label else ""
+            lines.append(f"{name}_sum{braces} {h.sum}")
+            lines.append(f"{name}_count{braces} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+def _summary(series: Dict[Tuple[str, str], Histogram]) -> Dict[str, Dict[str, Any]]:
+    out: Dict[str, Dict[str, Any]] = {}
+    for (metric, kind), h in sorted(series.items()):
+        n = h.count
+        row: Dict[str, Any] = {"count": n, "mean": h.sum / n if n else None}
+        for q in QUANTILES:
+            row[f"p{int(q * 100)}"] = h.quantile(q)
+        out.setdefault(metric, {})[kind or "*"] = row
+    return out
+
+class Telemetry:
+    """One worker's histograms, keyed by (metric, kind); kind "" for claims."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str], Histogram] = {}
+
+    def observe(self, metric: str, seconds: float, kind: str = "") -> None:
+        with self._lock:
+            h = self._series.get((metric, kind))
+            if h is None:
+                h = self._series[(metric, kind)] = Histogram()
+            h.observe(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Heartbeat payload: bucket bounds plus every series' counts and sum."""
+        with self._lock:
+            series = [{"metric": m, "kind": k, "counts": list(h.counts), "sum": h.sum}
+                      for (m, k), h in self._series.items()]
+        return {"buckets": list(BUCKETS), "series": series}
+
+    def render(self, prefix: str = "sentinel_worker") -> str:
+        with self._lock:
+            series = {key: Histogram(h.counts, h.sum) for key, h in self._series.items()}
+        return _render(series, prefix)
+
+class FleetTelemetry:
+    """
+    Latest snapshot per agent, summed on read. Agents that have not
+    reported for `ttl` seconds drop out. In-process: with several API
+    processes each aggregates the agents that heartbeat to it.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._agents: Dict[str, Tuple[float, Dict[Tuple[str, str], Histogram]]] = {}
+
+    def record(self, agent_id: str, snap: Any) -> None:
+        """Store one heartbeat's snapshot; ValueError if it is malformed."""
+        try:
+            buckets = [float(b) for b in snap.get("buckets") or ()]
+        except (AttributeError, TypeError, ValueError):
+            buckets = None
+        if buckets != [float(b) for b in BUCKETS]:
+            raise ValueError("telemetry buckets do not match")
+        series: Dict[Tuple[str, str], Histogram] = {}
+        for s in snap.get("series") or ():
+            try:
+                metric, kind, counts, total = s["metric"], str(s.get("kind") or ""), [int(n) for n in s["counts"]], float(s["sum"])
+            except (AttributeError, KeyError, TypeError) as e:
+                raise ValueError(f"bad telemetry series: {e}") from None
+            if metric not in METRICS or len(counts) != len(BUCKETS) + 1 or min(counts) < 0:
+                raise ValueError(f"bad telemetry series {metric!r}")
+            series[(metric, kind)] = Histogram(counts, total)
+        with self._lock:
+            self._agents[agent_id] = (time.monotonic(), series)
+
+    def merged(self) -> Tuple[int, Dict[Tuple[str, str], Histogram]]:
+        """(live agent count, fleet-wide histograms)."""
+        cutoff = time.monotonic() - self.ttl
+        out: Dict[Tuple[str, str], Histogram] = {}
+        with self._lock:
+            for agent_id in [a for a, (at, _) in self._agents.items() if at < cutoff]:
+                del self._agents[agent_id]
+            agents = list(self._agents.values())
+        for _, series in agents:
+            for key, h in series.items():
+                out.setdefault(key, Histogram()).merge(h)
+        return len(agents), out
+
+    def summary(self) -> Dict[str, Any]:
+        """count, mean and percentiles per metric and kind ("*" for claims)."""
+        agents, series = self.merged()
+        return {"agents": agents, "metrics": _summary(series)}
+
+    def render(self, prefix: str = "sentinel_fleet") -> str:
+        return _render(self.merged()[1], prefix)
+
+async def serve_prometheus(telemetry: Telemetry, host: str, port: int) -> asyncio.AbstractServer:
+    """Answer GET /metrics on host:port with telemetry.render()."""
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)).strip():
+                pass  # headers
+            parts = request.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] in ("GET", "HEAD") and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", telemetry.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            head = (f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                    f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode("latin-1")
+            writer.write(head if parts[:1] == ["HEAD"] else head + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
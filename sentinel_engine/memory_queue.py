@@ -0,0 +1,549 @@
+"""
+In-memory queue backend for single-node and test deployments.
+
+Jobs are dicts keyed by id (UUIDv7 strings, so id order is enqueue order).
+Claimable jobs sit in heaps keyed (-priority, id): one per tenant with fair
+share on, a single global one otherwise, plus an id-ordered heap while
+aging is enabled. Scheduled jobs and leases have their own (time, id)
+heaps. Heap entries are never removed in place; an entry whose job has
+moved on is skipped when it surfaces, and heaps are rebuilt once stale
+entries dominate.
+
+State lives only in this process. With a snapshot path the whole state is
+written as JSON by snapshot() (periodically by the orchestrator timer and on
+shutdown) and reloaded at start; jobs claimed at snapshot time come back
+with their leases and are requeued by the reaper if nobody completes them.
+"""
+import heapq
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .blob_store import reject_ref
+from .config import settings
+from .ids import new_id
+from .job_counters import STATUSES
+from .job_events import publish
+from .job_graph import DEPENDENCY_FAILED, GraphError, topo_order
+from .job_queue import FairShareScheduler, aging_pick, parse_weights
+from .job_schedule import ScheduleError, cron_next, initial_run_at
+from .queue_backend import JobQuery, JobSpec, QueueBackend, initial_state
+from .task_queue import notify_new_jobs, notify_schedule_changed
+
+CLAIMED = ("claimed", "in_progress")
+TERMINAL = ("completed", "failed")
+SNAPSHOT_VERSION = 1
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+def _ts(iso: Optional[str]) -> float:
+    return datetime.fromisoformat(iso).timestamp() if iso else 0.0
+
+def _epoch(when: Optional[datetime]) -> Optional[float]:
+    if when is None:
+        return None
+    return (when.replace(tzinfo=timezone.utc) if when.tzinfo is None else when).timestamp()
+
+def _matches(job: Dict[str, Any], query: JobQuery, after: Optional[float], until: Optional[float]) -> bool:
+    if query.status and job["status"] not in query.status:
+        return False
+    if query.kind and job["kind"] not in query.kind:
+        return False
+    if query.agent is not None and str(job["claimed_by"]) != query.agent:
+        return False
+    if after is not None or until is not None:
+        created = _ts(job["created_at"])
+        if (after is not None and created < after) or (until is not None and created >= until):
+            return False
+    return True
+
+class MemoryQueueBackend(QueueBackend):
+    name = "memory"
+
+    def __init__(self, snapshot_path: Optional[str] = None):
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self._lock = threading.RLock()
+        self._fair_share = settings.queue_fair_share
+        self._fair = FairShareScheduler(
+            parse_weights(settings.tenant_weights), refresh_seconds=0,
+            active=lambda _: sorted(t for t, h in self._by_tenant.items() if h),
+        )
+        self._reset()
+        if self.snapshot_path and self.snapshot_path.exists():
+            self._load(json.loads(self.snapshot_path.read_text(encoding="utf-8")))
+
+    def _reset(self):
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._by_tenant: Dict[Any, list] = {}
+        self._ready: list = []
+        self._fifo: list = []
+        self._scheduled: list = []
+        self._leases: list = []
+        self._parents: Dict[str, List[str]] = {}
+        self._children: Dict[str, List[str]] = {}
+        self._keys: Dict[Tuple[Any, str], str] = {}
+        self._coalesce: Dict[Tuple[Any, str], str] = {}
+        self._held: Dict[Any, set] = {}
+        self._counts: Counter = Counter()
+        self._queued = 0
+
+    # -- state transitions --
+
+    def _set_status(self, job: Dict[str, Any], status: str):
+        self._counts[(job["status"], job["kind"], job["tenant"])] -= 1
+        self._counts[(status, job["kind"], job["tenant"])] += 1
+        self._queued += (status == "queued") - (job["status"] == "queued")
+        job["status"] = status
+
+    def _push_ready(self, job: Dict[str, Any]):
+        entry = (-job["priority"], job["id"])
+        if self._fair_share:
+            heapq.heappush(self._by_tenant.setdefault(job["tenant"], []), entry)
+        else:
+            heapq.heappush(self._ready, entry)
+        if settings.queue_aging_every > 0:
+            heapq.heappush(self._fifo, (job["id"],))
+        if job.get("dedup_hash"):
+            self._coalesce[(job["tenant"], job["dedup_hash"])] = job["id"]
+
+    def _push_scheduled(self, job: Dict[str, Any]):
+        heapq.heappush(self._scheduled, (job["run_at"], job["id"]))
+
+    def _make_ready(self, job: Dict[str, Any], now: float) -> str:
+        """queued, or scheduled while run_at is in the future; returns the status."""
+        if job.get("run_at") is not None and job["run_at"] > now:
+            self._set_status(job, "scheduled")
+            self._push_scheduled(job)
+        else:
+            self._set_status(job, "queued")
+            self._push_ready(job)
+        return job["status"]
+
+    def _release(self, job: Dict[str, Any]):
+        held = self._held.get(job.get("claimed_by"))
+        if held:
+            held.discard(job["id"])
+        job["claimed_by"] = job["lease_expires_at"] = None
+
+    def _new_job(self, spec: JobSpec, status: str, run_at: Optional[float], dedup_hash: Optional[str],
+                 now: float, pending: int = 0, output_json: Optional[str] = None) -> Dict[str, Any]:
+        job = {
+            "id": new_id(), "kind": spec.kind, "payload_json": spec.payload_json or "{}",
+            "status": status, "priority": spec.priority, "tenant": spec.tenant,
+            "created_at": _iso(now), "claimed_by": None, "claimed_at": None, "completed_at": None,
+            "output_json": output_json, "lease_expires_at": None, "pending_deps": pending,
+            "run_at": run_at, "cron": spec.cron, "idempotency_key": spec.idempotency_key,
+            "dedup_hash": dedup_hash,
+        }
+        self._jobs[job["id"]] = job
+        self._counts[(status, job["kind"], job["tenant"])] += 1
+        if status == "queued":
+            self._queued += 1
+            self._push_ready(job)
+        elif status == "scheduled":
+            self._push_scheduled(job)
+        if spec.idempotency_key:
+            self._keys[(spec.tenant, spec.idempotency_key)] = job["id"]
+        return job
+
+    def _compact(self):
+        # drop stale heap entries once they outnumber live queued jobs
+        size = len(self._ready) + len(self._fifo) + sum(len(h) for h in self._by_tenant.values())
+        if size <= 4 * self._queued + 1024:
+            return
+        live = [j for j in self._jobs.values() if j["status"] == "queued"]
+        self._by_tenant, self._ready, self._fifo = {}, [], []
+        for job in live:
+            self._push_ready(job)
+
+    # -- enqueue --
+
+    def _duplicate(self, spec: JobSpec, dedup_hash: Optional[str], now: float) -> Optional[Dict[str, Any]]:
+        if spec.idempotency_key:
+            job = self._jobs.get(self._keys.get((spec.tenant, spec.idempotency_key)))
+            if job is not None and now - _ts(job["created_at"]) <= settings.idempotency_window_seconds:
+                return job
+        if dedup_hash:
+            job = self._jobs.get(self._coalesce.get((spec.tenant, dedup_hash)))
+            if job is not None and job["status"] == "queued":
+                return job
+        return None
+
+    def enqueue_many(self, specs: List[JobSpec]) -> List[Dict[str, Any]]:
+        for spec in specs:
+            reject_ref(spec.payload_json)  # same contract as the SQLite backend's blob offload
+        now = time.time()
+        states = [initial_state(s, now) for s in specs]
+        results = []
+        with self._lock:
+            for spec, (status, run_at, dedup_hash) in zip(specs, states):
+                dup = self._duplicate(spec, dedup_hash, now)
+                if dup is not None:
+                    results.append({"id": dup["id"], "status": dup["status"], "duplicate": True})
+                    continue
+                job = self._new_job(spec, status, run_at, dedup_hash, now)
+                publish("enqueued", [job])
+                res = {"id": job["id"], "status": status}
+                if run_at is not None:
+                    res["run_at"] = run_at
+                results.append(res)
+        fresh = [r for r in results if not r.get("duplicate")]
+        queued = sum(1 for r in fresh if r["status"] == "queued")
+        if queued:
+            notify_new_jobs(queued)
+        if any(r["status"] == "scheduled" for r in fresh):
+            notify_schedule_changed()
+        return results
+
+    def enqueue_graph(self, nodes: Dict[str, JobSpec]) -> Dict[str, Dict[str, Any]]:
+        now = time.time()
+        graph = []
+        for key, spec in nodes.items():
+            if spec.idempotency_key or spec.coalesce:
+                raise GraphError(f"node {key!r}: idempotency_key/coalesce are not supported in a graph")
+            reject_ref(spec.payload_json)
+            if spec.cron:
+                raise GraphError(f"node {key!r}: recurring jobs cannot be part of a graph")
+            graph.append({"key": key, "spec": spec, "depends_on": spec.depends_on,
+                          "run_at": initial_run_at(spec.run_at, None, now)})
+        with self._lock:
+            order = topo_order(graph)
+            ids: Dict[str, str] = {}
+            # validate everything before creating anything
+            for n in order:
+                for d in n["depends_on"] or []:
+                    if d not in nodes and d not in self._jobs:
+                        raise GraphError(f"unknown dependency {d!r}")
+            for n in order:
+                parents = list(dict.fromkeys(ids.get(d, d) for d in n["depends_on"] or []))
+                pending, failed = 0, False
+                for p in parents:
+                    status = self._jobs[p]["status"]
+                    if status == "failed":
+                        failed = True
+                    elif status != "completed":
+                        pending += 1
+                if failed:
+                    status = "failed"
+                elif pending:
+                    status = "waiting"
+                else:
+                    status = "scheduled" if n["run_at"] is not None and n["run_at"] > now else "queued"
+                job = self._new_job(n["spec"], status, n["run_at"], None, now, pending,
+                                    DEPENDENCY_FAILED if failed else None)
+                self._parents[job["id"]] = parents
+                for p in parents:
+                    self._children.setdefault(p, []).append(job["id"])
+                ids[n["key"]] = job["id"]
+            publish("enqueued", [self._jobs[i] for i in ids.values()])
+            out = {k: {"id": i, "status": self._jobs[i]["status"]} for k, i in ids.items()}
+        queued = sum(1 for v in out.values() if v["status"] == "queued")
+        if queued:
+            notify_new_jobs(queued)
+        if any(v["status"] == "scheduled" for v in out.values()):
+            notify_schedule_changed()
+        return out
+
+    # -- claim / complete / leases --
+
+    def _pop(self, heap: list, k: int, taken: List[str]) -> int:
+        got = 0
+        while heap and got < k:
+            job = self._jobs.get(heapq.heappop(heap)[-1])
+            if job is not None and job["status"] == "queued" and job["id"] not in taken:
+                taken.append(job["id"])
+                got += 1
+        return got
+
+    def claim(self, agent_id: Any, limit: int = 1, claimed_status: str = "claimed") -> List[Dict[str, Any]]:
+        now = time.time()
+        fifo = aging_pick()
+        with self._lock:
+            taken: List[str] = []
+            if fifo and self._fifo:
+                self._pop(self._fifo, limit, taken)
+            elif self._fair_share:
+                for _ in range(4):  # a stale ring can hand out drained tenants; re-plan
+                    plan = self._fair.plan(None, limit - len(taken))
+                    if not plan:
+                        break
+                    for tenant, k in plan.items():
+                        if self._pop(self._by_tenant.get(tenant, []), k, taken) < k:
+                            self._fair.drained(tenant)
+                    if len(taken) >= limit:
+                        break
+            else:
+                self._pop(self._ready, limit, taken)
+            jobs = []
+            for job_id in taken:
+                job = self._jobs[job_id]
+                self._set_status(job, claimed_status)
+                job.update(claimed_by=agent_id, claimed_at=_iso(now),
+                           lease_expires_at=now + settings.job_lease_seconds)
+                heapq.heappush(self._leases, (job["lease_expires_at"], job_id))
+                self._held.setdefault(agent_id, set()).add(job_id)
+                out = {k: job[k] for k in ("id", "kind", "payload_json", "status", "claimed_by",
+                                           "created_at", "claimed_at", "priority", "tenant")}
+                parents = self._parents.get(job_id)
+                if parents:
+                    out["parent_outputs"] = {p: self._jobs[p]["output_json"] for p in parents if p in self._jobs}
+                jobs.append(out)
+            publish("claimed", jobs)
+            self._compact()
+        if not fifo:
+            jobs.sort(key=lambda j: (-j["priority"], j["id"]))
+        return jobs
+
+    def _settle(self, finished: List[Tuple[str, str]], now: float) -> int:
+        promoted = 0
+        frontier = []
+        for job_id, status in finished:
+            if status == "failed":
+                frontier.append(job_id)
+                continue
+            for c in self._children.get(job_id, []):
+                child = self._jobs.get(c)
+                if child is not None and child["status"] == "waiting":
+                    child["pending_deps"] -= 1
+                    if child["pending_deps"] <= 0:
+                        self._make_ready(child, now)
+                        promoted += 1
+        while frontier:
+            nxt = []
+            for p in frontier:
+                for c in self._children.get(p, []):
+                    child = self._jobs.get(c)
+                    if child is not None and child["status"] == "waiting":
+                        self._set_status(child, "failed")
+                        child["output_json"] = DEPENDENCY_FAILED
+                        nxt.append(c)
+            frontier = nxt
+        return promoted
+
+    def complete(self, results: List[Tuple[Any, str, Optional[str]]]) -> List[Any]:
+        for _, _, output_json in results:
+            reject_ref(output_json)
+        now = time.time()
+        missing, finished = [], []
+        with self._lock:
+            for job_id, status, output_json in results:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    missing.append(job_id)
+                    continue
+                if job["status"] in TERMINAL:
+                    continue  # replayed result: the first one stands
+                self._release(job)
+                self._set_status(job, status)
+                job.update(completed_at=_iso(now), output_json=output_json or "{}")
+                finished.append((job_id, status))
+            publish("completed", [self._jobs[j] for j, _ in finished])
+            promoted = self._settle(finished, now)
+        if promoted:
+            notify_new_jobs(promoted)
+        return missing
+
+    def extend_lease(self, agent_id: Any) -> int:
+        expires = time.time() + settings.job_lease_seconds
+        with self._lock:
+            held = [self._jobs[i] for i in self._held.get(agent_id, ()) if i in self._jobs]
+            for job in held:
+                job["lease_expires_at"] = expires
+                heapq.heappush(self._leases, (expires, job["id"]))
+        return len(held)
+
+    def held_by(self, agent_id: Any, job_ids: List[Any]) -> List[Any]:
+        with self._lock:
+            held = self._held.get(agent_id, ())
+            return [j for j in job_ids if j in held]
+
+    # -- reads / admin --
+
+    def stats(self, breakdown: Optional[str] = None) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+        out: Dict[str, Any] = {s: 0 for s in STATUSES}
+        by: Dict[str, Dict[str, int]] = {}
+        for (status, kind, tenant), n in counts.items():
+            if n <= 0:
+                continue
+            if status in out:
+                out[status] += n
+            if breakdown in ("kind", "tenant"):
+                key = str(kind if breakdown == "kind" else tenant)
+                by.setdefault(key, {})[status] = by.get(key, {}).get(status, 0) + n
+        if breakdown in ("kind", "tenant"):
+            out[f"by_{breakdown}"] = by
+        return out
+
+    def get(self, job_id: Any, include_archive: bool = False) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(str(job_id))
+            return dict(job) if job else None
+
+    def recent(self, limit: int, include_archive: bool = False) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(self._jobs[i]) for i in heapq.nlargest(limit, self._jobs)]
+
+    def list_jobs(self, query: JobQuery, limit: int, before: Any = None) -> List[Dict[str, Any]]:
+        after, until = _epoch(query.created_after), _epoch(query.created_before)
+        with self._lock:
+            ids = (i for i, j in self._jobs.items()
+                   if (before is None or i < before) and _matches(j, query, after, until))
+            return [dict(self._jobs[i]) for i in heapq.nlargest(limit, ids)]
+
+    def export(self, query: JobQuery, before: Any = None, batch: int = 1000) -> Iterator[Dict[str, Any]]:
+        # one sort up front instead of a scan per page; the jobs are in memory anyway
+        after, until = _epoch(query.created_after), _epoch(query.created_before)
+        with self._lock:
+            ids = sorted((i for i in self._jobs if before is None or i < before), reverse=True)
+        for start in range(0, len(ids), batch):
+            with self._lock:
+                page = [dict(j) for j in (self._jobs.get(i) for i in ids[start:start + batch])
+                        if j is not None and _matches(j, query, after, until)]
+            yield from page
+
+    def _requeue(self, jobs: List[Dict[str, Any]]) -> int:
+        for job in jobs:
+            self._release(job)
+            self._set_status(job, "queued")
+            self._push_ready(job)
+        if jobs:
+            notify_new_jobs(len(jobs))
+        return len(jobs)
+
+    def retry(self, job_id: Any) -> bool:
+        with self._lock:
+            job = self._jobs.get(str(job_id))
+            return job is not None and self._requeue([job]) == 1
+
+    def requeue_stale(self, age_seconds: float) -> int:
+        cutoff = time.time() - age_seconds
+        with self._lock:
+            return self._requeue([j for j in self._jobs.values()
+                                  if j["status"] in CLAIMED and _ts(j["claimed_at"]) < cutoff])
+
+    # -- maintenance --
+
+    def requeue_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            lapsed = []
+            while self._leases and self._leases[0][0] < now:
+                expires, job_id = heapq.heappop(self._leases)
+                job = self._jobs.get(job_id)
+                if job is not None and job["status"] in CLAIMED and job["lease_expires_at"] == expires:
+                    lapsed.append(job)
+            return self._requeue(lapsed)
+
+    def promote_due(self) -> int:
+        now = time.time()
+        n = 0
+        with self._lock:
+            while self._scheduled and self._scheduled[0][0] <= now:
+                due, job_id = heapq.heappop(self._scheduled)
+                job = self._jobs.get(job_id)
+                if job is None or job["status"] != "scheduled" or job["run_at"] != due:
+                    continue
+                if not job["cron"]:
+                    self._set_status(job, "queued")
+                    self._push_ready(job)
+                    n += 1
+                    continue
+                try:
+                    job["run_at"] = cron_next(job["cron"], max(now, due))
+                except ScheduleError:
+                    self._set_status(job, "failed")
+                    job["run_at"] = None
+                    continue
+                self._push_scheduled(job)
+                spec = JobSpec(kind=job["kind"], payload_json=job["payload_json"],
+                               priority=job["priority"], tenant=job["tenant"])
+                self._new_job(spec, "queued", due, None, now)
+                n += 1
+        if n:
+            notify_new_jobs(n)
+        return n
+
+    def next_run_at(self) -> Optional[float]:
+        with self._lock:
+            while self._scheduled:
+                due, job_id = self._scheduled[0]
+                job = self._jobs.get(job_id)
+                if job is not None and job["status"] == "scheduled" and job["run_at"] == due:
+                    return due
+                heapq.heappop(self._scheduled)
+        return None
+
+    def archive(self, older_than: timedelta) -> int:
+        # Finished jobs are dropped (totals keep counting them); parents stay
+        # while a child is unfinished, as in the SQLite backend.
+        cutoff = time.time() - older_than.total_seconds()
+        with self._lock:
+            old = [j for j in self._jobs.values()
+                   if j["status"] in TERMINAL and _ts(j["completed_at"]) < cutoff
+                   and all(self._jobs[c]["status"] in TERMINAL
+                           for c in self._children.get(j["id"], []) if c in self._jobs)]
+            for job in old:
+                del self._jobs[job["id"]]
+                self._children.pop(job["id"], None)
+                self._parents.pop(job["id"], None)
+                if job["idempotency_key"]:
+                    self._keys.pop((job["tenant"], job["idempotency_key"]), None)
+        return len(old)
+
+    # -- snapshots --
+
+    def snapshot(self) -> None:
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            state = {
+                "version": SNAPSHOT_VERSION,
+                "jobs": list(self._jobs.values()),
+                "parents": self._parents,
+                "counts": [[*k, n] for k, n in self._counts.items() if n],
+            }
+            data = json.dumps(state, separators=(",", ":"))
+        self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.snapshot_path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.snapshot_path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+    def _load(self, state: Dict[str, Any]):
+        if state.get("version") != SNAPSHOT_VERSION:
+            return
+        self._reset()
+        for job in state["jobs"]:
+            self._jobs[job["id"]] = job
+            if job["status"] == "queued":
+                self._queued += 1
+                self._push_ready(job)
+            elif job["status"] == "scheduled":
+                self._push_scheduled(job)
+            elif job["status"] in CLAIMED and job["lease_expires_at"] is not None:
+                heapq.heappush(self._leases, (job["lease_expires_at"], job["id"]))
+                self._held.setdefault(job["claimed_by"], set()).add(job["id"])
+            if job["idempotency_key"]:
+                self._keys[(job["tenant"], job["idempotency_key"])] = job["id"]
+        for child, parents in state["parents"].items():
+            self._parents[child] = parents
+            for p in parents:
+                self._children.setdefault(p, []).append(child)
+        # totals include archived jobs, which are not in "jobs"
+        self._counts = Counter({(s, k, t): n for s, k, t, n in state["counts"]})
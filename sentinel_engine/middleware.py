@@ -3,12 +3,13 @@ import re
 from typing import Callable
 
 from fastapi import Request, HTTPException
+from fastapi.responses import JSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
 from sqlalchemy import text
 
 from .metrics_speedops import request_latency, requests_total
 from .db import get_apikey_by_value, touch_apikey_usage, engine
-from .auth import _consume_token
+from .auth import _consume_token, retry_after_seconds
 
 SECURED_PREFIXES = ("/tasks", "/tenants", "/metrics", "/tools")
 
@@ -52,7 +53,10 @@ class TimingAndAuthMiddleware(BaseHTTPMiddleware):
                     if not row or not row.get("is_active"):
                         raise HTTPException(status_code=401, detail="Invalid API key")
                     if not _consume_token(api_key):
-                        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+                        # returned, not raised: exceptions from middleware skip FastAPI's handlers
+                        code = 429
+                        return JSONResponse({"detail": "Rate limit exceeded"}, status_code=429,
+                                            headers={"Retry-After": str(retry_after_seconds(api_key))})
                     touch_apikey_usage(row["id"])
 
             # Pass request through
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Float
 from sqlalchemy.orm import relationship
 from .db import Base
 
@@ -17,10 +17,19 @@ class Job(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     kind = Column(String(128), nullable=False)
     payload_json = Column(Text, nullable=True)
+    payload_blob = Column(String(64), nullable=True)  # sha256 of an offloaded payload, see blob_store
     status = Column(String(32), nullable=False, default="queued")  # queued | in_progress | completed | failed
+    priority = Column(Integer, nullable=False, default=0, server_default="0")  # higher is claimed first
+    tenant = Column(Integer, nullable=False, default=1, server_default="1")
     agent_id = Column(Integer, ForeignKey("agents.id"), nullable=True)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    lease_expires_at = Column(Float, nullable=True)  # unix seconds, set while claimed
+    pending_deps = Column(Integer, nullable=False, default=0, server_default="0")  # unfinished depends_on parents
+    run_at = Column(Float, nullable=True)  # unix seconds; status 'scheduled' until due
+    cron = Column(String(128), nullable=True)  # recurrence spec on recurring templates
+    idempotency_key = Column(String(255), nullable=True)  # unique per tenant, see job_dedup
+    dedup_hash = Column(String(64), nullable=True)  # sha256(kind, payload) for coalesced enqueues
 
     agent = relationship("Agent", back_populates="jobs")
     result = relationship("Result", back_populates="job", uselist=False)
@@ -31,6 +40,7 @@ class Result(Base):
     job_id = Column(Integer, ForeignKey("jobs.id"), nullable=False, unique=True)
     status = Column(String(32), nullable=False)  # completed | failed
     output_json = Column(Text, nullable=True)
+    output_blob = Column(String(64), nullable=True)  # sha256 of an offloaded output
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
 
     job = relationship("Job", back_populates="result")
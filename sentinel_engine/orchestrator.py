@@ -1,8 +1,14 @@
 import asyncio
 import json
-from typing import Dict, Any
+import logging
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict
 from .db import init_db, next_queued_task, update_task_status, get_task, get_tenant
-from .task_queue import wait_for_task_id
+from .task_queue import wait_for_task_id, notify_schedule_changed, wait_for_schedule_change
+from .job_schedule import ScheduleError, cron_next, every_seconds
+from .queue_backend import get_queue
 from .config import settings
 from .agents.planner import make_plan
 from .agents.builder import build_artifact
@@ -14,32 +20,113 @@ from .redteam import simulate_attacks
 from .upgrader import upgrader_tick
 from .metrics import tasks_inflight, tasks_failed
 
+TIMER_MIN_SLEEP_SECONDS = 0.05
+
+logger = logging.getLogger(__name__)
+
 _worker_task: asyncio.Task | None = None
-_upgrader_task: asyncio.Task | None = None
+_timer_task: asyncio.Task | None = None
+_started_at = 0.0
 _shutdown = asyncio.Event()
 
+@dataclass(frozen=True)
+class PeriodicTask:
+    name: str
+    schedule: str  # cron spec or "@every <n>[smhd]" (see job_schedule); "" disables
+    run: Callable[[], Awaitable[Any]]
+    background: bool = False  # long passes run as a task so the timer keeps promoting jobs meanwhile
+
+async def _reap_leases():
+    # Jobs whose agent stopped heartbeating go back to the queue. Not right
+    # after a restart though: agents need a moment to heartbeat again and
+    # replay the completions they spooled while the API was down.
+    if time.monotonic() - _started_at < settings.lease_reap_grace_seconds:
+        return
+    await asyncio.to_thread(get_queue().requeue_expired)
+
+async def _archive():
+    # Keep the hot jobs table to the in-flight working set.
+    await asyncio.to_thread(get_queue().archive, timedelta(hours=settings.job_retention_hours))
+
+async def _snapshot_queue():
+    await asyncio.to_thread(get_queue().snapshot)
+
+async def _market_scan():
+    from market_scanner import market_scanner  # repo-root module, on sys.path under main.py
+    await market_scanner.daily_market_scan()
+
+SYSTEM_TASKS = (
+    PeriodicTask("lease_reaper", f"@every {settings.lease_reap_interval_seconds}s", _reap_leases),
+    PeriodicTask("archive", f"@every {settings.archive_interval_seconds}s" if settings.job_retention_hours > 0 else "",
+                 _archive, background=True),
+    PeriodicTask("upgrader", settings.upgrader_schedule, upgrader_tick),
+    PeriodicTask("market_scan", settings.market_scan_schedule, _market_scan),
+    PeriodicTask("queue_snapshot",
+                 f"@every {settings.queue_snapshot_interval_seconds}s"
+                 if settings.queue_backend == "memory" and settings.queue_snapshot_path else "",
+                 _snapshot_queue),
+)
+
 async def startup_event():
     init_db()
-    global _worker_task, _upgrader_task
+    global _worker_task, _timer_task, _started_at
+    _started_at = time.monotonic()
     _worker_task = asyncio.create_task(worker_loop())
-    _upgrader_task = asyncio.create_task(upgrader_loop())
+    _timer_task = asyncio.create_task(timer_loop())
 
 async def shutdown_event():
     _shutdown.set()
+    notify_schedule_changed()
     tasks = []
     if _worker_task: tasks.append(_worker_task)
-    if _upgrader_task: tasks.append(_upgrader_task)
+    if _timer_task: tasks.append(_timer_task)
     if tasks:
         await asyncio.wait(tasks)
+    await asyncio.to_thread(get_queue().close)
+
+async def _run_periodic(t: PeriodicTask):
+    try:
+        await t.run()
+    except Exception:
+        logger.exception("periodic task %s failed", t.name)
 
-async def upgrader_loop():
+def _first_due(t: PeriodicTask, now: float) -> float:
+    # interval tasks run at startup like the loops they replaced; cron tasks wait for their slot
+    return now if every_seconds(t.schedule) is not None else cron_next(t.schedule, now)
+
+async def timer_loop():
+    # The one timer: runs SYSTEM_TASKS when due, promotes scheduled jobs, then
+    # sleeps until whichever comes first. Enqueueing a scheduled job wakes it
+    # early via notify_schedule_changed().
+    due: Dict[str, float] = {}
+    running: Dict[str, asyncio.Task] = {}  # background tasks' current pass
+    now = time.time()
+    for t in SYSTEM_TASKS:
+        if t.schedule:
+            try:
+                due[t.name] = _first_due(t, now)
+            except ScheduleError:
+                logger.exception("periodic task %s disabled: bad schedule %r", t.name, t.schedule)
     while not _shutdown.is_set():
+        for t in SYSTEM_TASKS:
+            if t.name in due and due[t.name] <= time.time():
+                if not t.background:
+                    await _run_periodic(t)
+                elif t.name not in running or running[t.name].done():  # never two passes at once
+                    running[t.name] = asyncio.create_task(_run_periodic(t))
+                due[t.name] = cron_next(t.schedule, time.time())
+        next_job = None
         try:
-            _ = await upgrader_tick()
-        except Exception as e:
-            # log later
-            pass
-        await asyncio.sleep(60)  # check every minute in Phase 3 (fast for demo)
+            q = get_queue()
+            await asyncio.to_thread(q.promote_due)  # signals long-pollers itself
+            next_job = await asyncio.to_thread(q.next_run_at)
+        except Exception:
+            logger.exception("promoting scheduled jobs failed")
+        wake = min([*due.values(), time.time() + settings.scheduler_max_sleep_seconds]
+                   + ([next_job] if next_job is not None else []))
+        await wait_for_schedule_change(max(TIMER_MIN_SLEEP_SECONDS, wake - time.time()))
+    # let a pass in flight finish before shutdown closes the queue
+    await asyncio.gather(*running.values())
 
 async def worker_loop():
     poll = settings.worker_poll_interval_seconds
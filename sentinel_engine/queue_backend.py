@@ -0,0 +1,168 @@
+"""
+Job queue backend interface.
+
+Every route and background task reaches the job queue through get_queue(),
+which returns the backend picked by settings.queue_backend:
+
+- "sqlite" (default): SQLiteQueueBackend in sqlite_queue.py, the jobs table
+  tuned for WAL with BEGIN IMMEDIATE writes and a busy timeout.
+- "memory": MemoryQueueBackend in memory_queue.py, heaps in process memory
+  for single-node and test deployments, optionally snapshotted to disk.
+
+Both implement the same semantics (priority, tenant fair share, leases,
+dependencies, scheduling, dedup) so they can be swapped and benchmarked
+against each other.
+"""
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .config import settings
+from .job_dedup import payload_hash
+from .job_schedule import initial_run_at
+
+@dataclass
+class JobSpec:
+    kind: str
+    payload_json: Optional[str] = None
+    priority: int = 0
+    tenant: int = 1
+    run_at: Optional[float] = None  # unix seconds
+    cron: Optional[str] = None
+    idempotency_key: Optional[str] = None
+    coalesce: bool = False
+    depends_on: List[Any] = field(default_factory=list)  # job ids (or graph keys)
+
+@dataclass
+class JobQuery:
+    """Filters for list_jobs()/export(); None matches everything."""
+    status: Optional[set[str]] = None
+    kind: Optional[set[str]] = None
+    agent: Optional[str] = None
+    created_after: Optional[datetime] = None  # inclusive
+    created_before: Optional[datetime] = None  # exclusive
+
+def initial_state(spec: JobSpec, now: float) -> Tuple[str, Optional[float], Optional[str]]:
+    """(status, run_at, dedup_hash) for a new independent job."""
+    run_at = initial_run_at(spec.run_at, spec.cron, now)
+    status = "scheduled" if spec.cron or (run_at is not None and run_at > now) else "queued"
+    # coalescing only ever matches queued jobs
+    dedup_hash = payload_hash(spec.kind, spec.payload_json) if spec.coalesce and status == "queued" else None
+    return status, run_at, dedup_hash
+
+class QueueBackend(ABC):
+    """
+    Job ids are whatever the backend mints; results are plain dicts. Methods
+    that make jobs claimable signal long-pollers (task_queue) themselves.
+    Validation problems surface as ValueError subclasses (GraphError,
+    ScheduleError, BlobRefError) for routes to turn into 400s.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def enqueue_many(self, specs: List[JobSpec]) -> List[Dict[str, Any]]:
+        """Insert independent jobs; one {"id", "status"[, "duplicate", "run_at"]} per spec."""
+
+    @abstractmethod
+    def enqueue_graph(self, nodes: Dict[str, JobSpec]) -> Dict[str, Dict[str, Any]]:
+        """Insert a DAG keyed by local names (depends_on: keys or job ids); {key: {"id", "status"}}."""
+
+    def enqueue(self, spec: JobSpec) -> Dict[str, Any]:
+        if spec.depends_on:
+            return self.enqueue_graph({"job": spec})["job"]
+        return self.enqueue_many([spec])[0]
+
+    @abstractmethod
+    def claim(self, agent_id: Any, limit: int = 1, claimed_status: str = "claimed") -> List[Dict[str, Any]]:
+        """Lease up to `limit` jobs to `agent_id`, in queue order."""
+
+    @abstractmethod
+    def complete(self, results: List[Tuple[Any, str, Optional[str]]]) -> List[Any]:
+        """Record (job id, "completed"|"failed", output_json) results; returns the unknown ids."""
+
+    @abstractmethod
+    def extend_lease(self, agent_id: Any) -> int:
+        """Push out the lease of every job `agent_id` holds; returns how many."""
+
+    @abstractmethod
+    def held_by(self, agent_id: Any, job_ids: List[Any]) -> List[Any]:
+        """The ids among `job_ids` that are still leased to `agent_id`."""
+
+    @abstractmethod
+    def stats(self, breakdown: Optional[str] = None) -> Dict[str, Any]:
+        """Status totals, optionally with by_kind / by_tenant."""
+
+    @abstractmethod
+    def get(self, job_id: Any, include_archive: bool = False) -> Optional[Dict[str, Any]]:
+        """One job as a column dict, or None."""
+
+    @abstractmethod
+    def recent(self, limit: int, include_archive: bool = False) -> List[Dict[str, Any]]:
+        """Newest jobs first."""
+
+    @abstractmethod
+    def list_jobs(self, query: JobQuery, limit: int, before: Any = None) -> List[Dict[str, Any]]:
+        """Up to `limit` matching jobs with id < `before`, newest (highest id) first."""
+
+    def export(self, query: JobQuery, before: Any = None, batch: int = 1000) -> Iterator[Dict[str, Any]]:
+        """Every matching job, newest first, one keyset page in memory at a time."""
+        while True:
+            rows = self.list_jobs(query, batch, before)
+            yield from rows
+            if len(rows) < batch:
+                return
+            before = rows[-1]["id"]
+
+    @abstractmethod
+    def retry(self, job_id: Any) -> bool:
+        """Put a job back in the queue whatever its state; False if unknown."""
+
+    @abstractmethod
+    def requeue_stale(self, age_seconds: float) -> int:
+        """Requeue claimed jobs whose claim is older than `age_seconds`."""
+
+    # -- background maintenance, driven by the orchestrator timer --
+
+    @abstractmethod
+    def requeue_expired(self) -> int:
+        """Return jobs with lapsed leases to the queue."""
+
+    @abstractmethod
+    def promote_due(self) -> int:
+        """Queue scheduled jobs whose run_at has passed."""
+
+    @abstractmethod
+    def next_run_at(self) -> Optional[float]:
+        """Earliest run_at among scheduled jobs, or None."""
+
+    @abstractmethod
+    def archive(self, older_than: timedelta) -> int:
+        """Drop finished jobs older than `older_than` from the hot set."""
+
+    def snapshot(self) -> None:
+        """Persist in-memory state, where there is any."""
+
+    def close(self) -> None:
+        self.snapshot()
+
+_lock = threading.Lock()
+_backend: Optional[QueueBackend] = None
+
+def get_queue() -> QueueBackend:
+    global _backend
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                kind = settings.queue_backend.lower()
+                if kind == "memory":
+                    from .memory_queue import MemoryQueueBackend
+                    _backend = MemoryQueueBackend(settings.queue_snapshot_path or None)
+                elif kind == "sqlite":
+                    from .sqlite_queue import SQLiteQueueBackend
+                    _backend = SQLiteQueueBackend()
+                else:
+                    raise ValueError(f"unknown SENTINEL_QUEUE_BACKEND {settings.queue_backend!r}")
+    return _backend
@@ -1,8 +1,17 @@
-﻿from datetime import datetime, timezone
-from fastapi import APIRouter, HTTPException, Depends, Request
+﻿import asyncio
+from datetime import datetime, timezone
+from fastapi import APIRouter, HTTPException, Depends, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from typing import Any, Dict
+from ..config import settings
 from ..db import get_engine
-from ..security import guard_api_key
+from ..ids import new_id
+from ..job_telemetry import FleetTelemetry
+from ..queue_backend import get_queue
+from ..security import guard_api_key, verify_api_key
+from ..task_queue import job_seq, wait_for_new_jobs
+from .jobs import LONG_POLL_RECHECK_SECONDS, MAX_CLAIM_BATCH, _job_out
 
 router_v0 = APIRouter(prefix="/v0/agents", tags=["agents"])
 router    = APIRouter(prefix="/agents",    tags=["agents"])
@@ -25,10 +34,8 @@ def ensure_schema():
 
 ensure_schema()
 
-def _uuid_sql(cx):
-    return cx.exec_driver_sql(
-        "SELECT lower(hex(randomblob(4)))||'-'||lower(hex(randomblob(2)))||'-'||lower(hex(randomblob(2)))||'-'||lower(hex(randomblob(2)))||'-'||lower(hex(randomblob(6)))"
-    ).first()[0]
+# latest latency histograms per agent, from heartbeats (see job_telemetry)
+fleet = FleetTelemetry(settings.agent_telemetry_ttl_seconds)
 
 def _register_flex(payload: Dict[str, Any]):
     # accept many shapes: {name, host, tenant}, or alternative keys
@@ -42,8 +49,8 @@ def _register_flex(payload: Dict[str, Any]):
 
     eng = get_engine()
     now = datetime.now(timezone.utc).isoformat()
+    agent_id = new_id()
     with eng.begin() as cx:
-        agent_id = _uuid_sql(cx)
         cx.exec_driver_sql(
             "INSERT INTO agents(id,name,host,tenant,last_heartbeat,created_at) VALUES(?,?,?,?,?,?)",
             (agent_id, name, host, tenant, now, now)
@@ -67,7 +74,22 @@ def _heartbeat_flex(payload: Dict[str, Any]):
         )
         if upd.rowcount == 0:
             raise HTTPException(status_code=404, detail="agent_not_found")
-    return {"ok": True, "id": agent_id, "at": at}
+    leases = get_queue().extend_lease(agent_id)
+    out = {"ok": True, "id": agent_id, "at": at, "leases_extended": leases}
+    if payload.get("telemetry") is not None:
+        # a bad snapshot must not fail the heartbeat: the leases are what matter
+        try:
+            fleet.record(str(agent_id), payload["telemetry"])
+        except ValueError as e:
+            out["telemetry_error"] = str(e)
+    return out
+
+def _telemetry(format: str):
+    if format == "prometheus":
+        return PlainTextResponse(fleet.render(), media_type="text/plain; version=0.0.4")
+    if format != "json":
+        raise HTTPException(status_code=400, detail="format must be json or prometheus")
+    return fleet.summary()
 
 @router_v0.post("/register", dependencies=[Depends(guard_api_key)])
 async def register_v0(req: Request):
@@ -88,3 +110,164 @@ async def heartbeat_v0(req: Request):
 async def heartbeat(req: Request):
     body = await req.json()
     return _heartbeat_flex(body if isinstance(body, dict) else {})
+
+@router_v0.get("/telemetry", dependencies=[Depends(guard_api_key)])
+async def telemetry_v0(format: str = "json"):
+    return _telemetry(format)
+
+@router.get("/telemetry", dependencies=[Depends(guard_api_key)])
+async def telemetry(format: str = "json"):
+    return _telemetry(format)
+
+# -------- /v0/agents/ws --------
+# One connection per agent carrying register, heartbeat, claim and complete
+# as JSON text frames, authenticated once at connect instead of per request.
+# Requests may carry a "ref" that their reply echoes.
+#   {"op": "register", "name", "host", "tenant"}  -> {"op": "registered", "id", ...}
+#   {"op": "register", "agent_id"}                  resume after a reconnect
+#   {"op": "heartbeat", "telemetry"?}               -> {"op": "heartbeat", ...}
+#   {"op": "claim", "max": n}   add n to the credit -> {"op": "claim", "credit": c}
+#   {"op": "complete", "results": [{"id", "status", "output_json"}]}
+#                                                   -> {"op": "complete", "completed", "missing"}
+# and pushed by the server:
+#   {"op": "assign", "jobs": [...]}  leased against the credit as soon as they are claimable
+#   {"op": "cancel", "ids": [...]}   jobs the agent no longer holds (lease reaped, retried),
+#                                    checked on every heartbeat
+# Failures come back as {"op": "error", "ref", "status", "detail"}.
+
+class _AgentSession:
+    def __init__(self, ws: WebSocket):
+        self.ws = ws
+        self.agent_id: str | None = None
+        self.credit = 0
+        self.assigned: Dict[str, Any] = {}  # str(id) -> id, leased over this connection and not completed
+        self.undelivered: Dict[str, Any] = {}  # str(id) -> id, leased but the assign frame not sent yet
+        self._claiming: asyncio.Future | None = None
+        self._send_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+
+    async def send(self, msg: Dict[str, Any]):
+        async with self._send_lock:
+            await self.ws.send_json(msg)
+
+    async def assign_loop(self):
+        # the push side of a claim long-poll: lease while there is credit,
+        # park on the enqueue signal (with the same recheck) while there is none
+        while True:
+            if self.credit <= 0 or self.agent_id is None:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            seen = job_seq()
+            # the claim thread runs on if this task is cancelled; release() collects its jobs
+            self._claiming = asyncio.ensure_future(
+                run_in_threadpool(get_queue().claim, self.agent_id, min(self.credit, MAX_CLAIM_BATCH)))
+            try:
+                jobs = await asyncio.shield(self._claiming)
+            except Exception:
+                jobs = []  # e.g. the write lock stayed busy; try again on the next signal or recheck
+            self._claiming = None
+            if not jobs:
+                await wait_for_new_jobs(seen, LONG_POLL_RECHECK_SECONDS)
+                continue
+            self.credit -= len(jobs)
+            self.undelivered = {str(j["id"]): j["id"] for j in jobs}
+            await self.send({"op": "assign", "jobs": [_job_out(j) for j in jobs]})
+            self.assigned.update(self.undelivered)
+            self.undelivered = {}
+
+    async def release(self):
+        # the connection is gone: hand back what never reached the agent now
+        # rather than at lease expiry (delivered jobs stay leased for a resume)
+        if self._claiming is not None:
+            try:
+                jobs = await self._claiming
+            except Exception:
+                jobs = []
+            self.undelivered.update((str(j["id"]), j["id"]) for j in jobs)
+        for job_id in self.undelivered.values():
+            await run_in_threadpool(get_queue().retry, job_id)
+        self.undelivered = {}
+
+    async def handle(self, msg: Dict[str, Any]) -> Dict[str, Any]:
+        op = msg.get("op")
+        if op == "register":
+            if msg.get("agent_id"):
+                out = await run_in_threadpool(_heartbeat_flex, {"agent_id": msg["agent_id"]})
+                self.agent_id = str(msg["agent_id"])
+                return {"op": "registered", "id": self.agent_id, "resumed": True, "leases_extended": out["leases_extended"]}
+            out = await run_in_threadpool(_register_flex, msg)
+            self.agent_id = out["id"]
+            return {"op": "registered", **out}
+        if self.agent_id is None:
+            raise HTTPException(status_code=409, detail="register first")
+        if op == "heartbeat":
+            out = await run_in_threadpool(_heartbeat_flex, {"agent_id": self.agent_id, "telemetry": msg.get("telemetry")})
+            await self._revoke()
+            return {**out, "op": "heartbeat"}
+        if op == "claim":
+            try:
+                n = int(msg.get("max", 1))
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=422, detail="max must be an integer")
+            self.credit = max(0, min(self.credit + n, settings.agent_ws_max_credit))
+            self._wake.set()
+            return {"op": "claim", "credit": self.credit}
+        if op == "complete":
+            results = msg.get("results") or []
+            try:
+                items = [(r["id"], r["status"], r.get("output_json")) for r in results]
+            except (KeyError, TypeError):
+                raise HTTPException(status_code=422, detail="results need id and status")
+            bad = [job_id for job_id, st, _ in items if st not in ("completed", "failed")]
+            if bad:
+                raise HTTPException(status_code=400, detail={"error": "bad_status", "ids": bad})
+            for job_id, _, _ in items:
+                self.assigned.pop(str(job_id), None)
+            missing = await run_in_threadpool(get_queue().complete, items)
+            return {"op": "complete", "completed": len(items) - len(missing), "missing": missing}
+        raise HTTPException(status_code=400, detail=f"unknown op {op!r}")
+
+    async def _revoke(self):
+        if not self.assigned:
+            return
+        held = await run_in_threadpool(get_queue().held_by, self.agent_id, list(self.assigned.values()))
+        gone = set(self.assigned) - {str(j) for j in held}
+        if gone:
+            revoked = [self.assigned.pop(k) for k in gone]
+            await self.send({"op": "cancel", "ids": revoked})
+
+@router_v0.websocket("/ws")
+async def agent_ws(ws: WebSocket):
+    try:
+        await verify_api_key(ws)
+    except HTTPException:
+        await ws.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await ws.accept()
+    session = _AgentSession(ws)
+    assigner = asyncio.create_task(session.assign_loop())
+    try:
+        while True:
+            try:
+                msg = await ws.receive_json()
+            except (ValueError, KeyError, TypeError):
+                # not JSON text (a decode error, or a binary frame)
+                await ws.close(code=status.WS_1003_UNSUPPORTED_DATA)
+                break
+            if not isinstance(msg, dict):
+                await session.send({"op": "error", "status": 422, "detail": "frames are JSON objects"})
+                continue
+            try:
+                reply = await session.handle(msg)
+            except HTTPException as e:
+                reply = {"op": "error", "status": e.status_code, "detail": e.detail}
+            if "ref" in msg:
+                reply["ref"] = msg["ref"]
+            await session.send(reply)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        assigner.cancel()
+        await asyncio.gather(assigner, return_exceptions=True)
+        await session.release()
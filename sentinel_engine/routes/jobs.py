@@ -1,24 +1,52 @@
-﻿from datetime import datetime, timezone
-from fastapi import APIRouter, HTTPException, Depends, Query
+﻿import json
+import time
+from datetime import datetime, timezone
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
 from pydantic import BaseModel
 from sqlalchemy import text
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from .. import blob_store
+from ..blob_store import BlobRefError
+from ..config import settings
 from ..db import get_engine
+from ..job_events import EventFilter, bus
+from ..job_graph import GraphError
+from ..job_schedule import ScheduleError
+from ..job_queue import ensure_job_schema
+from ..queue_backend import JobSpec, get_queue
 from ..security import guard_api_key
+from ..task_queue import job_seq, wait_for_new_jobs
 
 router_v0 = APIRouter(prefix="/v0/jobs", tags=["jobs"])
 router    = APIRouter(prefix="/jobs",    tags=["jobs"])
 
+MAX_CLAIM_BATCH = 100
+BULK_CHUNK = 5000
+MAX_CLAIM_WAIT = 60
+LONG_POLL_RECHECK_SECONDS = 5
+
 DDL = """
 CREATE TABLE IF NOT EXISTS jobs (
   id TEXT PRIMARY KEY,
   kind TEXT NOT NULL,
   payload_json TEXT,
+  payload_blob TEXT,
   status TEXT NOT NULL DEFAULT 'queued',
+  priority INTEGER NOT NULL DEFAULT 0,
+  tenant INTEGER NOT NULL DEFAULT 1,
   created_at TEXT NOT NULL,
   claimed_by TEXT,
   claimed_at TEXT,
   completed_at TEXT,
-  output_json TEXT
+  output_json TEXT,
+  output_blob TEXT,
+  lease_expires_at REAL,
+  pending_deps INTEGER NOT NULL DEFAULT 0,
+  run_at REAL,
+  cron TEXT,
+  idempotency_key TEXT,
+  dedup_hash TEXT
 );
 """
 
@@ -26,47 +54,180 @@ def ensure_schema():
   eng = get_engine()
   with eng.begin() as cx:
     cx.exec_driver_sql(DDL)
+    ensure_job_schema(cx)
 
 ensure_schema()
 
 class EnqueueJob(BaseModel):
   kind: str
   payload_json: str | None = None
+  priority: int = 0  # higher is claimed first
+  tenant: int = 1
+  depends_on: list[str] | None = None  # job ids; waits until all complete
+  run_at: datetime | None = None  # not claimable before this time
+  cron: str | None = None  # recurring: "m h dom mon dow", @daily, "@every 10m" (see job_schedule)
+  idempotency_key: str | None = None  # retries with the same key get the original job back
+  coalesce: bool = False  # collapse into an identical (kind + payload) job that is still queued
 
-def _uuid_sql(cx):
-  return cx.exec_driver_sql("SELECT lower(hex(randomblob(4)))||'-'||lower(hex(randomblob(2)))||'-'||lower(hex(randomblob(2)))||'-'||lower(hex(randomblob(2)))||'-'||lower(hex(randomblob(6)))").first()[0]
+def _spec(body: EnqueueJob, depends_on=None) -> JobSpec:
+  run_at = body.run_at
+  if run_at is not None and run_at.tzinfo is None:
+    run_at = run_at.replace(tzinfo=timezone.utc)
+  return JobSpec(
+    kind=body.kind, payload_json=body.payload_json, priority=body.priority, tenant=body.tenant,
+    run_at=run_at.timestamp() if run_at else None, cron=body.cron,
+    idempotency_key=body.idempotency_key, coalesce=body.coalesce,
+    depends_on=list(depends_on if depends_on is not None else body.depends_on or []),
+  )
 
 def _enqueue(body: EnqueueJob):
-  eng = get_engine()
-  now = datetime.now(timezone.utc).isoformat()
-  with eng.begin() as cx:
-    job_id = _uuid_sql(cx)
-    cx.exec_driver_sql(
-      "INSERT INTO jobs(id,kind,payload_json,status,created_at) VALUES(?,?,?,?,?)",
-      (job_id, body.kind, body.payload_json or "{}", "queued", now)
-    )
-  return {"id": job_id, "kind": body.kind, "status": "queued"}
-
-def _claim(agent_id: str):
-  eng = get_engine()
-  now = datetime.now(timezone.utc).isoformat()
-  with eng.begin() as cx:
-    # claim the oldest queued job atomically
-    row = cx.exec_driver_sql(
-      "SELECT id, kind, payload_json FROM jobs WHERE status='queued' ORDER BY created_at LIMIT 1"
-    ).first()
-    if not row:
-      return {}  # no job
-    job_id, kind, payload_json = row
-    cx.exec_driver_sql(
-      "UPDATE jobs SET status='claimed', claimed_by=?, claimed_at=? WHERE id=? AND status='queued'",
-      (agent_id, now, job_id)
-    )
-    # confirm claimed
-    chk = cx.exec_driver_sql("SELECT status FROM jobs WHERE id=?", (job_id,)).first()
-    if not chk or chk[0] != "claimed":
-      return {}  # race lost
-  return {"id": job_id, "kind": kind, "payload_json": payload_json}
+  try:
+    res = get_queue().enqueue(_spec(body))
+  except (GraphError, ScheduleError, BlobRefError) as e:
+    raise HTTPException(status_code=400, detail=str(e))
+  out = {"id": res["id"], "kind": body.kind, "status": res["status"]}
+  if res.get("duplicate"):
+    out["duplicate"] = True
+  if res.get("run_at") is not None:
+    out["run_at"] = datetime.fromtimestamp(res["run_at"], timezone.utc).isoformat()
+  return out
+
+class GraphJob(EnqueueJob):
+  key: str  # local name, referenced by other nodes' depends_on
+
+class EnqueueGraph(BaseModel):
+  jobs: list[GraphJob]
+
+def _enqueue_graph(body: EnqueueGraph):
+  # The whole DAG is inserted at once: roots go straight to 'queued', the
+  # rest wait in 'waiting' until their parents complete (see job_graph).
+  nodes = {}
+  for j in body.jobs:
+    if j.key in nodes:
+      raise HTTPException(status_code=400, detail=f"duplicate key {j.key!r}")
+    nodes[j.key] = _spec(j)
+  try:
+    return {"jobs": get_queue().enqueue_graph(nodes)}
+  except (GraphError, ScheduleError, BlobRefError) as e:
+    raise HTTPException(status_code=400, detail=str(e))
+
+def _parse_bulk_line(raw: bytes) -> JobSpec:
+  rec = json.loads(raw)
+  if not isinstance(rec, dict) or not isinstance(rec.get("kind"), str) or not rec["kind"]:
+    raise ValueError("expected an object with a non-empty 'kind'")
+  payload_json = rec.get("payload_json")
+  if payload_json is None and "payload" in rec:
+    payload_json = json.dumps(rec["payload"])
+  if payload_json is not None and not isinstance(payload_json, str):
+    raise ValueError("'payload_json' must be a string")
+  blob_store.reject_ref(payload_json)
+  priority, tenant = rec.get("priority", 0), rec.get("tenant", 1)
+  for name, v in (("priority", priority), ("tenant", tenant)):
+    if not isinstance(v, int) or isinstance(v, bool):
+      raise ValueError(f"'{name}' must be an integer")
+  key = rec.get("idempotency_key")
+  if key is not None and not isinstance(key, str):
+    raise ValueError("'idempotency_key' must be a string")
+  return JobSpec(kind=rec["kind"], payload_json=payload_json or "{}", priority=priority, tenant=tenant,
+                 idempotency_key=key, coalesce=bool(rec.get("coalesce")))
+
+async def _enqueue_bulk(req: Request):
+  # NDJSON body, one {"kind":..., "payload_json": "...", "priority": n,
+  # "tenant": n, "idempotency_key": "...", "coalesce": bool} (or
+  # "payload": {...}) per line. Lines are parsed as they arrive and inserted
+  # BULK_CHUNK at a time, one backend call (one transaction on SQLite) per
+  # chunk.
+  results, pending = [], []
+  enqueued = failed = duplicates = 0
+  line_no = 0
+  buf = b""
+
+  async def flush():
+    nonlocal enqueued, failed, duplicates
+    specs = [spec for spec, _ in pending]
+    try:
+      out = await run_in_threadpool(get_queue().enqueue_many, specs)
+      for (_, res), r in zip(pending, out):
+        res["id"] = r["id"]
+        if r.get("duplicate"):
+          res["duplicate"] = True
+          duplicates += 1
+        else:
+          enqueued += 1
+    except Exception as e:
+      failed += len(specs)
+      for _, res in pending:
+        res["error"] = f"insert_failed: {e}"
+    pending.clear()
+
+  async def take(raw: bytes):
+    nonlocal failed, line_no
+    line_no += 1
+    if not raw.strip():
+      return
+    try:
+      spec = _parse_bulk_line(raw)
+    except ValueError as e:
+      failed += 1
+      results.append({"line": line_no, "error": str(e)})
+      return
+    res = {"line": line_no}
+    results.append(res)
+    pending.append((spec, res))
+    if len(pending) >= BULK_CHUNK:
+      await flush()
+
+  async for chunk in req.stream():
+    buf += chunk
+    *lines, buf = buf.split(b"\n")
+    for raw in lines:
+      await take(raw)
+  if buf:
+    await take(buf)
+  if pending:
+    await flush()
+  return {"ok": failed == 0, "enqueued": enqueued, "duplicates": duplicates, "failed": failed, "results": results}
+
+def _job_out(job):
+  out = {"id": job["id"], "kind": job["kind"], "payload_json": job["payload_json"]}
+  for key in ("created_at", "claimed_at"):  # workers time queue wait from these
+    if job.get(key) is not None:
+      out[key] = job[key]
+  if "parent_outputs" in job:
+    out["parent_outputs"] = job["parent_outputs"]
+  return out
+
+def _claim(agent_id: str, max_jobs: int | None = None):
+  if max_jobs is not None:
+    # batch lease: up to max_jobs in one statement / one transaction
+    return {"jobs": [_job_out(j) for j in get_queue().claim(agent_id, max_jobs, claimed_status="claimed")]}
+  jobs = get_queue().claim(agent_id, 1, claimed_status="claimed")
+  if not jobs:
+    return {}  # no job
+  return _job_out(jobs[0])
+
+async def _claim_wait(req: Request, agent_id: str, max_jobs: int | None, wait: float):
+  # Long-poll: re-claim whenever _enqueue signals, until something is leased
+  # or `wait` runs out. The periodic recheck picks up jobs inserted by other
+  # processes, which cannot signal this one. Longer waits are cut to
+  # MAX_CLAIM_WAIT rather than rejected. A client that hung up stops the
+  # poll, and jobs leased after it left go straight back to the queue.
+  deadline = time.monotonic() + min(wait, MAX_CLAIM_WAIT)
+  while True:
+    if await req.is_disconnected():
+      return {}
+    seen = job_seq()
+    out = await run_in_threadpool(_claim, agent_id, max_jobs)
+    if out.get("id") or out.get("jobs"):
+      if await req.is_disconnected():
+        for j in out.get("jobs") or [out]:
+          await run_in_threadpool(get_queue().retry, j["id"])
+        return {}
+      return out
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+      return out
+    await wait_for_new_jobs(seen, min(remaining, LONG_POLL_RECHECK_SECONDS))
 
 class CompleteJob(BaseModel):
   status: str
@@ -75,28 +236,113 @@ class CompleteJob(BaseModel):
 def _complete(job_id: str, body: CompleteJob):
   if body.status not in ("completed","failed"):
     raise HTTPException(status_code=400, detail="bad_status")
-  eng = get_engine()
-  now = datetime.now(timezone.utc).isoformat()
-  with eng.begin() as cx:
-    upd = cx.exec_driver_sql(
-      "UPDATE jobs SET status=?, completed_at=?, output_json=? WHERE id=?",
-      (body.status, now, body.output_json or "{}", job_id)
-    )
-    if upd.rowcount == 0:
-      raise HTTPException(status_code=404, detail="job_not_found")
+  try:
+    missing = get_queue().complete([(job_id, body.status, body.output_json)])
+  except BlobRefError as e:
+    raise HTTPException(status_code=400, detail=str(e))
+  if missing:
+    raise HTTPException(status_code=404, detail="job_not_found")
   return {"ok": True, "id": job_id, "status": body.status}
 
+class CompleteJobItem(CompleteJob):
+  id: str
+
+def _complete_batch(items: list[CompleteJobItem]):
+  bad = [it.id for it in items if it.status not in ("completed","failed")]
+  if bad:
+    raise HTTPException(status_code=400, detail={"error": "bad_status", "ids": bad})
+  try:
+    missing = get_queue().complete([(it.id, it.status, it.output_json) for it in items])
+  except BlobRefError as e:
+    raise HTTPException(status_code=400, detail=str(e))
+  return {"ok": True, "completed": len(items) - len(missing), "missing": missing}
+
+def _csv(value: str | None) -> set[str] | None:
+  return {v.strip() for v in value.split(",") if v.strip()} if value else None
+
+def _sse(cursor: str | None, event: dict) -> str:
+  head = f"id: {cursor}\n" if cursor else ""
+  return f"{head}event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+async def _events(req: Request, kind: str | None, tenant: str | None, job_id: str | None, cursor: str | None):
+  # SSE feed of enqueue/claim/complete transitions (see job_events). Resume
+  # with ?cursor= or the Last-Event-ID header browsers send on reconnect.
+  flt = EventFilter(kinds=_csv(kind), tenants=_csv(tenant), job_ids=_csv(job_id))
+  sub, backlog = bus.subscribe(flt, cursor or req.headers.get("last-event-id"))
+
+  async def stream():
+    try:
+      for item in backlog:
+        yield _sse(*item)
+      while not await req.is_disconnected():
+        item = await sub.next(settings.job_events_keepalive_seconds)
+        if item is None:
+          yield ": keepalive\n\n"  # also how a dropped client gets noticed
+          continue
+        yield _sse(*item)
+        if sub.overflowed:
+          break  # sent "reset"; the client reconnects from its last cursor
+    finally:
+      bus.unsubscribe(sub)
+
+  return StreamingResponse(stream(), media_type="text/event-stream",
+                           headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @router_v0.post("/enqueue", dependencies=[Depends(guard_api_key)])
 def enqueue_v0(body: EnqueueJob): return _enqueue(body)
 
 @router.post("/enqueue", dependencies=[Depends(guard_api_key)])
 def enqueue(body: EnqueueJob):     return _enqueue(body)
 
+@router_v0.post("/enqueue:graph", dependencies=[Depends(guard_api_key)])
+def enqueue_graph_v0(body: EnqueueGraph): return _enqueue_graph(body)
+
+@router.post("/enqueue:graph", dependencies=[Depends(guard_api_key)])
+def enqueue_graph(body: EnqueueGraph):     return _enqueue_graph(body)
+
+@router_v0.post("/enqueue:bulk", dependencies=[Depends(guard_api_key)])
+async def enqueue_bulk_v0(req: Request): return await _enqueue_bulk(req)
+
+@router.post("/enqueue:bulk", dependencies=[Depends(guard_api_key)])
+async def enqueue_bulk(req: Request):     return await _enqueue_bulk(req)
+
+def _blob(digest: str):
+  # payloads/outputs stored as {"$blob": "sha256:<digest>"} references
+  if not blob_store.exists(digest):
+    raise HTTPException(status_code=404, detail="blob_not_found")
+  return StreamingResponse(blob_store.iter_blob(digest), media_type="application/json")
+
+@router_v0.get("/blobs/{digest}", dependencies=[Depends(guard_api_key)])
+def blob_v0(digest: str): return _blob(digest)
+
+@router.get("/blobs/{digest}", dependencies=[Depends(guard_api_key)])
+def blob(digest: str):     return _blob(digest)
+
+@router_v0.get("/events", dependencies=[Depends(guard_api_key)])
+async def events_v0(req: Request, kind: str | None = None, tenant: str | None = None,
+                    job_id: str | None = None, cursor: str | None = None):
+  return await _events(req, kind, tenant, job_id, cursor)
+
+@router.get("/events", dependencies=[Depends(guard_api_key)])
+async def events(req: Request, kind: str | None = None, tenant: str | None = None,
+                 job_id: str | None = None, cursor: str | None = None):
+  return await _events(req, kind, tenant, job_id, cursor)
+
 @router_v0.get("/claim", dependencies=[Depends(guard_api_key)])
-def claim_v0(agent_id: str = Query(...)): return _claim(agent_id)
+async def claim_v0(req: Request, agent_id: str = Query(...),
+                   max: int | None = Query(None, ge=1, le=MAX_CLAIM_BATCH), wait: float = Query(0, ge=0)):
+  return await _claim_wait(req, agent_id, max, wait)
 
 @router.get("/claim", dependencies=[Depends(guard_api_key)])
-def claim(agent_id: str = Query(...)):     return _claim(agent_id)
+async def claim(req: Request, agent_id: str = Query(...),
+                max: int | None = Query(None, ge=1, le=MAX_CLAIM_BATCH), wait: float = Query(0, ge=0)):
+  return await _claim_wait(req, agent_id, max, wait)
+
+@router_v0.post("/complete:batch", dependencies=[Depends(guard_api_key)])
+def complete_batch_v0(body: list[CompleteJobItem]): return _complete_batch(body)
+
+@router.post("/complete:batch", dependencies=[Depends(guard_api_key)])
+def complete_batch(body: list[CompleteJobItem]):     return _complete_batch(body)
 
 @router_v0.post("/{job_id}/complete", dependencies=[Depends(guard_api_key)])
 def complete_v0(job_id: str, body: CompleteJob): return _complete(job_id, body)
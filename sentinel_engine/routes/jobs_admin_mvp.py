@@ -1,110 +1,149 @@
-﻿import json
-from datetime import datetime, timezone, timedelta
-from typing import Dict, Any, List, Optional
+﻿import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Dict, Any, List, Literal, Optional, Union
 
 from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
-from sentinel_engine.db import SessionLocal
-from sentinel_engine.models_agent_mvp import Job
+from sentinel_engine.blob_store import BlobRefError
+from sentinel_engine.job_queue import AGENT_COLUMNS, ensure_job_schema
+from sentinel_engine.queue_backend import JobQuery, JobSpec, get_queue
 
 router = APIRouter(prefix="/v0/jobs", tags=["jobs-admin"])
 
+ensure_job_schema()
+
 # ---- Pydantic models ----
 class EnqueueRequest(BaseModel):
     kind: str
     payload: Dict[str, Any] = Field(default_factory=dict)
+    priority: int = 0
+    tenant: int = 1
+    idempotency_key: Optional[str] = None
+    coalesce: bool = False  # join an identical job that is still queued
 
 class EnqueueResponse(BaseModel):
-    id: int
+    id: Union[int, str]
     status: str
+    duplicate: bool = False
 
 class JobOut(BaseModel):
-    id: int
+    id: Union[int, str]
     kind: str
     status: str
     payload_json: Optional[str] = None
     updated_at: Optional[str] = None
+    tenant: Optional[int] = None
+    agent: Optional[str] = None
+    created_at: Optional[str] = None
+
+class JobPage(BaseModel):
+    jobs: List[JobOut]
+    next_cursor: Optional[str] = None  # pass back as ?cursor= for the next (older) page
 
 class TotalsOut(BaseModel):
     queued: int
+    claimed: int = 0  # leased through /v0/jobs/claim
     in_progress: int
     completed: int
     failed: int
+    waiting: int = 0  # blocked on depends_on
+    scheduled: int = 0  # run_at in the future / recurring templates
+    by_kind: Optional[Dict[str, Dict[str, int]]] = None
+    by_tenant: Optional[Dict[str, Dict[str, int]]] = None
 
 # ---- Endpoints ----
 @router.post("/enqueue", response_model=EnqueueResponse)
 def enqueue_job(req: EnqueueRequest):
-    now = datetime.now(timezone.utc)
-    with SessionLocal() as db:
-        j = Job(
-            kind=req.kind,
-            payload_json=json.dumps(req.payload),
-            status="queued",
-            created_at=now,
-            updated_at=now,
-        )
-        db.add(j)
-        db.flush()
-        jid = j.id
-        db.commit()
-    return {"id": jid, "status": "queued"}
+    try:
+        res = get_queue().enqueue(JobSpec(
+            kind=req.kind, payload_json=json.dumps(req.payload), priority=req.priority, tenant=req.tenant,
+            idempotency_key=req.idempotency_key, coalesce=req.coalesce,
+        ))
+    except BlobRefError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"id": res["id"], "status": res["status"], "duplicate": bool(res.get("duplicate"))}
+
+def _job_out(r: Dict[str, Any]) -> JobOut:
+    ts = r.get("updated_at") or r.get("completed_at") or r.get("claimed_at") or r.get("created_at")
+    agent = next((r[c] for c in AGENT_COLUMNS if r.get(c) is not None), None)
+    return JobOut(
+        id=r["id"], kind=r["kind"], status=r["status"],
+        payload_json=r.get("payload_json"), updated_at=str(ts) if ts else None,
+        tenant=r.get("tenant"), agent=str(agent) if agent is not None else None,
+        created_at=str(r["created_at"]) if r.get("created_at") else None
+    )
+
+# Keyset cursors: the last id of a page, opaque to clients. JSON keeps
+# INTEGER (ORM schema) and TEXT ids apart.
+def _encode_cursor(job_id: Any) -> str:
+    return base64.urlsafe_b64encode(json.dumps([job_id]).encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> Any:
+    try:
+        (job_id,) = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="bad cursor")
+    return job_id
+
+def _csv(value: Optional[str]) -> Optional[set]:
+    return {v.strip() for v in value.split(",") if v.strip()} if value else None
+
+@router.get("", response_model=JobPage, response_model_exclude_none=True)
+def list_jobs(
+    status: Optional[str] = Query(None, description="comma-separated, e.g. queued,failed"),
+    kind: Optional[str] = Query(None, description="comma-separated"),
+    agent: Optional[str] = None,
+    since: Optional[datetime] = Query(None, description="created_at >= since"),
+    until: Optional[datetime] = Query(None, description="created_at < until"),
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=1000),
+    format: Literal["json", "ndjson"] = "json",
+):
+    """
+    Newest first, keyset-paginated on id. format=ndjson streams every
+    matching job (all columns, one per line, from `cursor` on) instead of a
+    page, in constant memory.
+    """
+    query = JobQuery(status=_csv(status), kind=_csv(kind), agent=agent,
+                     created_after=since, created_before=until)
+    before = _decode_cursor(cursor) if cursor else None
+    q = get_queue()
+    if format == "ndjson":
+        rows = q.export(query, before)
+        return StreamingResponse((json.dumps(r, default=str) + "\n" for r in rows),
+                                 media_type="application/x-ndjson")
+    rows = q.list_jobs(query, limit, before)
+    next_cursor = _encode_cursor(rows[-1]["id"]) if len(rows) == limit else None
+    return JobPage(jobs=[_job_out(r) for r in rows], next_cursor=next_cursor)
 
 @router.get("/recent", response_model=List[JobOut])
-def recent_jobs(limit: int = Query(20, ge=1, le=200)):
-    with SessionLocal() as db:
-        rows = db.query(Job).order_by(Job.id.desc()).limit(limit).all()
-        def iso(dt): return dt.isoformat() if dt else None
-        return [
-            JobOut(
-                id=r.id, kind=r.kind, status=r.status,
-                payload_json=r.payload_json, updated_at=iso(r.updated_at)
-            ) for r in rows
-        ]
+def recent_jobs(limit: int = Query(20, ge=1, le=200), include_archive: bool = False):
+    return [_job_out(r) for r in get_queue().recent(limit, include_archive)]
 
 @router.get("/get/{job_id}", response_model=JobOut)
-def get_job(job_id: int):
-    with SessionLocal() as db:
-        j = db.get(Job, job_id)
-        if not j:
-            raise HTTPException(status_code=404, detail="Job not found")
-        def iso(dt): return dt.isoformat() if dt else None
-        return JobOut(
-            id=j.id, kind=j.kind, status=j.status,
-            payload_json=j.payload_json, updated_at=iso(j.updated_at)
-        )
-
-@router.get("/totals", response_model=TotalsOut)
-def totals():
-    with SessionLocal() as db:
-        def c(s): return db.query(Job).filter(Job.status == s).count()
-        return TotalsOut(
-            queued=c("queued"),
-            in_progress=c("in_progress"),
-            completed=c("completed"),
-            failed=c("failed"),
-        )
+def get_job(job_id: str, include_archive: bool = False):
+    j = get_queue().get(job_id, include_archive)
+    if not j:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_out(j)
+
+@router.get("/totals", response_model=TotalsOut, response_model_exclude_none=True)
+def totals(breakdown: Optional[Literal["kind", "tenant"]] = None):
+    # served from job_counters (or the memory backend's counts), never scans jobs
+    return TotalsOut(**get_queue().stats(breakdown))
 
 @router.post("/retry/{job_id}")
-def retry(job_id: int):
-    now = datetime.now(timezone.utc)
-    with SessionLocal() as db:
-        j = db.get(Job, job_id)
-        if not j:
-            raise HTTPException(status_code=404, detail="Job not found")
-        j.status = "queued"
-        j.updated_at = now
-        db.commit()
+def retry(job_id: str):
+    if not get_queue().retry(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
     return {"ok": True, "id": job_id, "status": "queued"}
 
 @router.post("/unblock_stuck")
 def unblock_stuck(age_seconds: int = 300):
-    cutoff = datetime.now(timezone.utc) - timedelta(seconds=age_seconds)
-    with SessionLocal() as db:
-        q = db.query(Job).filter(Job.status == "in_progress", Job.updated_at < cutoff)
-        n = q.count()
-        for j in q.all():
-            j.status = "queued"
-            j.updated_at = datetime.now(timezone.utc)
-        db.commit()
+    # Manual override; lapsed leases are normally requeued by the lease reaper.
+    n = get_queue().requeue_stale(age_seconds)
     return {"ok": True, "requeued": n, "older_than_seconds": age_seconds}
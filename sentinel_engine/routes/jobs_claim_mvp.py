@@ -1,71 +1,62 @@
 ﻿from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import Optional, Dict, Any
-from datetime import datetime, timezone
 
 try:
     # local imports relative to your repo layout
-    from sentinel_engine.db import SessionLocal
-    from sentinel_engine.models_agent_mvp import Job
+    from sentinel_engine.blob_store import BlobRefError
+    from sentinel_engine.job_queue import ensure_job_schema
+    from sentinel_engine.queue_backend import get_queue
 except Exception as e:
     # If imports fail, raise a clear error in logs
     raise
 
 router = APIRouter(prefix="/v0", tags=["jobs"])
 
-def _now_utc():
-    return datetime.now(timezone.utc)
+ensure_job_schema()
 
-def _job_to_dict(j) -> Dict[str, Any]:
-    # Be defensive in case your Job model shape differs
+def _job_to_dict(j: Dict[str, Any]) -> Dict[str, Any]:
+    # Be defensive: the row shape depends on the backend and jobs schema
     return {
-        "id": getattr(j, "id", None),
-        "kind": getattr(j, "kind", None),
-        "payload_json": getattr(j, "payload_json", None),
-        "status": getattr(j, "status", None),
-        "claimed_by_agent_id": getattr(j, "claimed_by_agent_id", None),
-        "created_at": getattr(j, "created_at", None),
-        "updated_at": getattr(j, "updated_at", None),
-        "output_json": getattr(j, "output_json", None),
+        "id": j.get("id"),
+        "kind": j.get("kind"),
+        "payload_json": j.get("payload_json"),
+        "status": j.get("status"),
+        "claimed_by_agent_id": j.get("claimed_by") or j.get("agent_id"),
+        "created_at": j.get("created_at"),
+        "updated_at": j.get("updated_at") or j.get("completed_at"),
+        "output_json": j.get("output_json"),
     }
 
 @router.get("/jobs/claim")
 def claim_job(agent_id: str = Query(..., description="UUID from /v0/agents/register")):
-    # Oldest queued first
-    with SessionLocal() as db:
-        j = (
-            db.query(Job)
-            .filter(Job.status == "queued")
-            .order_by(Job.id.asc())
-            .first()
-        )
-        if not j:
-            return None
-        # Mark as claimed (set field only if it exists on your model)
-        if hasattr(j, "claimed_by_agent_id"):
-            setattr(j, "claimed_by_agent_id", agent_id)
-        j.status = "in_progress"
-        j.updated_at = _now_utc()
-        db.add(j)
-        db.commit()
-        db.refresh(j)
-        return _job_to_dict(j)
+    # Highest priority, then oldest; one statement on the SQLite backend
+    jobs = get_queue().claim(agent_id, 1, claimed_status="in_progress")
+    if not jobs:
+        return None
+    j = jobs[0]
+    return {
+        "id": j["id"],
+        "kind": j["kind"],
+        "payload_json": j["payload_json"],
+        "status": j["status"],
+        "claimed_by_agent_id": agent_id,
+        "created_at": j["created_at"],
+        "updated_at": j["claimed_at"],
+        "output_json": None,
+        "parent_outputs": j.get("parent_outputs"),
+    }
 
 @router.post("/jobs/{job_id}/complete")
-def complete_job(job_id: int, body: Dict[str, Any]):
+def complete_job(job_id: str, body: Dict[str, Any]):
     # Expected body: {"status":"completed","output_json":"{...}"}
     status = body.get("status", "completed")
-    output_json = body.get("output_json")
-    with SessionLocal() as db:
-        j = db.query(Job).filter(Job.id == job_id).first()
-        if not j:
-            raise HTTPException(status_code=404, detail="job not found")
-        j.status = status
-        if output_json is not None:
-            # Some schemas store a string; others a JSON column.
-            # We just assign what we're given.
-            setattr(j, "output_json", output_json)
-        j.updated_at = _now_utc()
-        db.add(j)
-        db.commit()
-        db.refresh(j)
-        return {"ok": True, "job": _job_to_dict(j)}
+    if status not in ("completed", "failed"):
+        raise HTTPException(status_code=400, detail="invalid status")
+    q = get_queue()
+    try:
+        missing = q.complete([(job_id, status, body.get("output_json"))])
+    except BlobRefError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if missing:
+        raise HTTPException(status_code=404, detail="job not found")
+    return {"ok": True, "job": _job_to_dict(q.get(job_id))}
@@ -1,16 +1,20 @@
 ﻿from datetime import datetime
-from typing import Optional
+from typing import Optional, Union
 
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from pydantic import BaseModel
-from sqlalchemy import select, update
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
+from ..blob_store import BlobRefError
 from ..db import SessionLocal, engine, Base
-from ..models_agent_mvp import Agent, Job, Result
+from ..job_queue import ensure_job_schema
+from ..models_agent_mvp import Agent
+from ..queue_backend import get_queue
 
 # Ensure tables exist (idempotent)
 Base.metadata.create_all(bind=engine)
+ensure_job_schema()
 
 router = APIRouter(tags=["agents", "jobs"])
 
@@ -27,9 +31,10 @@ class AgentHeartbeatIn(BaseModel):
     id: int
 
 class JobOut(BaseModel):
-    id: int
+    id: Union[int, str]
     kind: str
     payload_json: Optional[str] = None
+    parent_outputs: Optional[dict[str, Optional[str]]] = None  # fan-in jobs only
 
 class JobCompleteIn(BaseModel):
     status: str  # "completed" | "failed"
@@ -70,56 +75,30 @@ def agent_heartbeat(payload: AgentHeartbeatIn, request: Request, db: Session = D
     if a.status == "unknown":
         a.status = "idle"
     db.commit()
-    return {"ok": True}
+    return {"ok": True, "leases_extended": get_queue().extend_lease(a.id)}
 
 @router.get("/jobs/claim", response_model=Optional[JobOut])
-def claim_job(request: Request, agent_id: int, db: Session = Depends(get_db)):
-    # Atomic-ish claim for SQLite:
-    # 1) find oldest queued job id
-    job_id = db.execute(
-        select(Job.id).where(Job.status == "queued").order_by(Job.created_at.asc()).limit(1)
-    ).scalar_one_or_none()
-    if not job_id:
+def claim_job(request: Request, agent_id: int):
+    # Same claim path as routes/jobs.py, through the queue backend
+    jobs = get_queue().claim(agent_id, 1, claimed_status="in_progress")
+    if not jobs:
         return None  # no jobs to claim
-
-    # 2) attempt to transition queued -> in_progress (only if still queued)
-    res = db.execute(
-        update(Job)
-        .where(Job.id == job_id, Job.status == "queued")
-        .values(status="in_progress", agent_id=agent_id, updated_at=datetime.utcnow())
-    )
-    if res.rowcount != 1:
-        db.rollback()
-        return None
-
-    db.commit()
-    job = db.get(Job, job_id)
-    if not job:
-        return None
-    return JobOut(id=job.id, kind=job.kind, payload_json=job.payload_json)
+    job = jobs[0]
+    return JobOut(id=job["id"], kind=job["kind"], payload_json=job["payload_json"],
+                  parent_outputs=job.get("parent_outputs"))
 
 @router.post("/jobs/{job_id}/complete")
-def complete_job(job_id: int, payload: JobCompleteIn, request: Request, db: Session = Depends(get_db)):
-    job = db.get(Job, job_id)
-    if not job:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="job not found")
-
+def complete_job(job_id: str, payload: JobCompleteIn, request: Request):
     if payload.status not in ("completed", "failed"):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="invalid status")
 
-    job.status = payload.status
-    job.updated_at = datetime.utcnow()
-    db.add(job)
-
-    # Upsert a result row (deterministic)
-    existing = db.execute(select(Result).where(Result.job_id == job_id)).scalar_one_or_none()
-    if existing:
-        existing.status = payload.status
-        existing.output_json = payload.output_json
-    else:
-        db.add(Result(job_id=job_id, status=payload.status, output_json=payload.output_json))
-
-    db.commit()
+    # The backend records the output (results on the ORM schema) in the same
+    # transaction that finishes the job, and only if it finishes it: a
+    # replayed completion leaves the first result in place.
+    try:
+        missing = get_queue().complete([(job_id, payload.status, payload.output_json)])
+    except BlobRefError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if missing:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="job not found")
     return {"ok": True}
-
-
@@ -1,5 +1,9 @@
+import json
 from typing import Dict, Any, Tuple, List
 
+from .job_lanes import cpu_bound
+from .safety import check_policy
+
 def scan_security(artifact_bundle: Dict[str, Any]) -> Tuple[bool, List[str]]:
     """Stub security scan. Returns (ok, notes)."""
     notes = []
@@ -10,3 +14,16 @@ def scan_security(artifact_bundle: Dict[str, Any]) -> Tuple[bool, List[str]]:
         return False, notes
     notes.append("Security scan clean (stub).")
     return True, notes
+
+@cpu_bound
+def scan_artifact(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Job handler ("safety_scan"): safety policy plus security scan over payload["artifact"]."""
+    artifact = payload.get("artifact", payload)
+    allowed, safety_notes = check_policy(artifact)
+    ok, sec_notes = scan_security(artifact)
+    return {"ok": allowed and ok, "safety": safety_notes, "secops": sec_notes}
+
+@cpu_bound
+def scan_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """scan_artifact for ops/agent_worker.py, whose handlers take the claimed job."""
+    return scan_artifact(json.loads(job.get("payload_json") or "{}"))
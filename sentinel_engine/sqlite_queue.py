@@ -0,0 +1,374 @@
+"""
+SQLite queue backend (the default): jobs live in the shared jobs table.
+
+tune_engine() puts the database in WAL mode (readers never block the
+writer), sets a busy timeout so writers queue on the lock inside SQLite
+instead of failing, and makes transactions begun through
+get_engine(immediate=True) open with BEGIN IMMEDIATE. A claim or enqueue
+then takes the write lock up front rather than upgrading a read lock
+halfway through, which is what produces SQLITE_BUSY under load.
+
+The jobs table has two historical shapes (raw-SQL TEXT ids and ISO
+timestamps, ORM INTEGER ids and DateTime columns); inserts and updates only
+touch the columns that exist.
+"""
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+
+from . import blob_store
+from .config import settings
+from .db import get_engine
+from .ids import new_id
+from .job_archive import archive_finished, collect_blobs, fetch_archived, recent_archived
+from .job_counters import read_totals
+from .job_dedup import find_duplicate, is_key_conflict
+from .job_events import publish
+from .job_graph import GraphError, insert_graph, settle_dependents
+from .job_queue import AGENT_COLUMNS, claim_batch, ensure_job_schema, extend_leases, ids_are_text, requeue_expired_leases
+from .job_schedule import initial_run_at, next_run_at, promote_due
+from .queue_backend import JobQuery, JobSpec, QueueBackend, initial_state
+from .task_queue import notify_new_jobs, notify_schedule_changed
+
+# ORM schema: outputs go to results, one row per job (a retried job's new
+# result replaces the old one)
+RESULT_UPSERT_SQL = (
+    "INSERT INTO results(job_id, status, output_json, output_blob, created_at) VALUES(?, ?, ?, ?, ?) "
+    "ON CONFLICT(job_id) DO UPDATE SET status=excluded.status, output_json=excluded.output_json, "
+    "output_blob=excluded.output_blob, created_at=excluded.created_at"
+)
+
+_tuned: set[int] = set()
+
+def tune_engine(engine, busy_timeout_ms: int, synchronous: str = "NORMAL") -> None:
+    if id(engine) in _tuned:
+        return
+
+    @event.listens_for(engine, "connect")
+    def _pragmas(dbapi_conn, _record):
+        dbapi_conn.isolation_level = None  # BEGIN is issued by the "begin" hook below
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute(f"PRAGMA synchronous={synchronous}")  # NORMAL is crash-safe under WAL
+        cur.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        cur.close()
+
+    @event.listens_for(engine, "begin")
+    def _begin(conn):
+        mode = conn.get_execution_options().get("sqlite_begin")
+        conn.exec_driver_sql(f"BEGIN {mode}" if mode else "BEGIN")
+
+    engine.dispose()  # pooled connections predate the hooks
+    _tuned.add(id(engine))
+
+def _stamps(cols: set[str], now: datetime) -> Dict[str, str]:
+    # ORM schema: naive DateTime strings; raw-SQL schema: ISO text
+    db_ts = now.replace(tzinfo=None).strftime("%Y-%m-%d %H:%M:%S.%f")
+    if "updated_at" in cols:
+        return {"created_at": db_ts, "updated_at": db_ts}
+    return {"created_at": now.isoformat()}
+
+def _created_at(cols: set[str], when: datetime) -> str:
+    # a bound comparable with created_at as stored (UTC either way)
+    when = when.replace(tzinfo=timezone.utc) if when.tzinfo is None else when.astimezone(timezone.utc)
+    return _stamps(cols, when)["created_at"]
+
+class SQLiteQueueBackend(QueueBackend):
+    name = "sqlite"
+
+    def __init__(self):
+        tune_engine(get_engine(), settings.sqlite_busy_timeout_ms, settings.sqlite_synchronous)
+
+    # -- inserts --
+
+    def _row(self, spec: JobSpec, payload: Tuple[str, Optional[str]], status: str, run_at: Optional[float],
+             dedup_hash: Optional[str], stamps: Dict[str, str], pending: int = 0,
+             output_json: Optional[str] = None) -> Dict[str, Any]:
+        payload_json, payload_blob = payload  # blob_store.offload(), done before the transaction
+        return {
+            "kind": spec.kind,
+            "payload_json": payload_json,
+            "payload_blob": payload_blob,
+            "status": status,
+            "priority": spec.priority,
+            "tenant": spec.tenant,
+            "run_at": run_at,
+            "cron": spec.cron,
+            "idempotency_key": spec.idempotency_key,
+            "dedup_hash": dedup_hash,
+            "pending_deps": pending,
+            "output_json": output_json,
+            **stamps,
+        }
+
+    def _insert(self, cx, cols: set[str], rows: List[Dict[str, Any]]) -> List[Any]:
+        if not rows:
+            return []
+        names = [k for k in rows[0] if k in cols]
+        if ids_are_text(cx):
+            ids = [new_id() for _ in rows]
+            cx.exec_driver_sql(
+                f"INSERT INTO jobs(id, {', '.join(names)}) VALUES(?{', ?' * len(names)})",
+                [(i,) + tuple(r[k] for k in names) for i, r in zip(ids, rows)]
+            )
+            return ids
+        sql = f"INSERT INTO jobs({', '.join(names)}) VALUES({', '.join('?' * len(names))}) RETURNING id"
+        return [cx.exec_driver_sql(sql, tuple(r[k] for k in names)).first()[0] for r in rows]
+
+    def enqueue_many(self, specs: List[JobSpec]) -> List[Dict[str, Any]]:
+        # blob files are written before BEGIN IMMEDIATE, not under the write lock
+        payloads = [blob_store.offload(s.payload_json or "{}") for s in specs]
+        now = time.time()
+        states = [initial_state(s, now) for s in specs]
+        for attempt in range(2):
+            try:
+                results = self._enqueue_many(specs, payloads, states)
+                break
+            except IntegrityError as e:
+                # a concurrent enqueue took the same idempotency key; the retry finds it
+                if attempt or not is_key_conflict(e):
+                    raise
+        publish("enqueued", [{"id": r["id"], "kind": s.kind, "tenant": s.tenant, "status": r["status"]}
+                             for s, r in zip(specs, results) if not r.get("duplicate")])
+        queued = sum(1 for r in results if r["status"] == "queued" and not r.get("duplicate"))
+        if queued:
+            notify_new_jobs(queued)
+        if any(r["status"] == "scheduled" and not r.get("duplicate") for r in results):
+            notify_schedule_changed()
+        return results
+
+    def _enqueue_many(self, specs, payloads, states) -> List[Dict[str, Any]]:
+        results: List[Dict[str, Any]] = [{} for _ in specs]
+        with get_engine(immediate=True).begin() as cx:
+            cols = ensure_job_schema(cx)
+            stamps = _stamps(cols, datetime.now(timezone.utc))
+            seen: Dict[Tuple, int] = {}  # dedup marks -> index of the spec that claimed them
+            fresh: List[int] = []
+            twins: Dict[int, int] = {}
+            for i, (spec, (status, run_at, dedup_hash)) in enumerate(zip(specs, states)):
+                marks = [m for m in (("key", spec.tenant, spec.idempotency_key),
+                                     ("hash", spec.tenant, dedup_hash)) if m[2]]
+                twin = next((seen[m] for m in marks if m in seen), None)
+                if twin is not None:
+                    twins[i] = twin  # duplicate within this batch
+                    continue
+                dup = find_duplicate(cx, spec.tenant, spec.idempotency_key, dedup_hash) if marks else None
+                if dup is not None:
+                    results[i] = {"id": dup[0], "status": dup[1], "duplicate": True}
+                    continue
+                seen.update((m, i) for m in marks)
+                fresh.append(i)
+            ids = self._insert(cx, cols, [self._row(specs[i], payloads[i], *states[i], stamps) for i in fresh])
+        for i, job_id in zip(fresh, ids):
+            results[i] = {"id": job_id, "status": states[i][0]}
+            if states[i][1] is not None:
+                results[i]["run_at"] = states[i][1]
+        for i, twin in twins.items():
+            results[i] = {"id": results[twin]["id"], "status": results[twin]["status"], "duplicate": True}
+        return results
+
+    def enqueue_graph(self, nodes: Dict[str, JobSpec]) -> Dict[str, Dict[str, Any]]:
+        now = time.time()
+        graph = []
+        for key, spec in nodes.items():
+            if spec.idempotency_key or spec.coalesce:
+                raise GraphError(f"node {key!r}: idempotency_key/coalesce are not supported in a graph")
+            graph.append({
+                "key": key, "spec": spec, "payload": blob_store.offload(spec.payload_json or "{}"),
+                "kind": spec.kind, "cron": spec.cron,
+                "run_at": None if spec.cron else initial_run_at(spec.run_at, None, now),
+                "depends_on": spec.depends_on,
+            })
+        with get_engine(immediate=True).begin() as cx:
+            cols = ensure_job_schema(cx)
+            stamps = _stamps(cols, datetime.now(timezone.utc))
+
+            def insert(cx, n, status, pending, output_json):
+                return self._insert(cx, cols, [self._row(n["spec"], n["payload"], status, n["run_at"], None,
+                                                         stamps, pending, output_json)])[0]
+
+            ids = insert_graph(cx, graph, insert)
+            marks = ",".join("?" * len(ids))
+            status = dict(cx.exec_driver_sql(
+                f"SELECT id, status FROM jobs WHERE id IN ({marks})", tuple(ids.values())
+            ).fetchall())
+        publish("enqueued", [{"id": ids[k], "kind": n.kind, "tenant": n.tenant, "status": status[ids[k]]}
+                             for k, n in nodes.items()])
+        queued = sum(1 for s in status.values() if s == "queued")
+        if queued:
+            notify_new_jobs(queued)
+        if "scheduled" in status.values():
+            notify_schedule_changed()
+        return {k: {"id": i, "status": status[i]} for k, i in ids.items()}
+
+    # -- claim / complete / leases --
+
+    def claim(self, agent_id: Any, limit: int = 1, claimed_status: str = "claimed") -> List[Dict[str, Any]]:
+        jobs = claim_batch(agent_id, limit, claimed_status)
+        if jobs:
+            publish("claimed", jobs)
+        return jobs
+
+    def complete(self, results: List[Tuple[Any, str, Optional[str]]]) -> List[Any]:
+        now = datetime.now(timezone.utc)
+        db_ts = now.replace(tzinfo=None).strftime("%Y-%m-%d %H:%M:%S.%f")
+        outputs = [blob_store.offload(out or "{}") for _, _, out in results]
+        missing: List[Any] = []
+        done: List[Dict[str, Any]] = []
+        with get_engine(immediate=True).begin() as cx:
+            cols = ensure_job_schema(cx)
+            sets = ["status=?", "lease_expires_at=NULL"]
+            extra: List[Any] = []
+            if "completed_at" in cols:
+                sets.append("completed_at=?")
+                extra.append(now.isoformat())
+            if "updated_at" in cols:
+                sets.append("updated_at=?")
+                extra.append(db_ts)
+            if "output_json" in cols:
+                sets.append("output_json=?, output_blob=?")
+            # first result wins: workers replay spooled completions after an
+            # outage, so a repeat for a finished job must not settle its
+            # dependents twice
+            sql = (f"UPDATE jobs SET {', '.join(sets)} WHERE id=? "
+                   "AND status NOT IN ('completed','failed') RETURNING kind, tenant")
+            for (job_id, status, _), output in zip(results, outputs):
+                params = [status, *extra] + (list(output) if "output_json" in cols else []) + [job_id]
+                row = cx.exec_driver_sql(sql, tuple(params)).first()
+                if row is not None:
+                    done.append({"id": job_id, "kind": row[0], "tenant": row[1], "status": status})
+                    if "output_json" not in cols:
+                        cx.exec_driver_sql(RESULT_UPSERT_SQL, (job_id, status, *output, db_ts))
+                elif cx.exec_driver_sql("SELECT 1 FROM jobs WHERE id=?", (job_id,)).first() is None:
+                    missing.append(job_id)
+            promoted = settle_dependents(cx, [(j["id"], j["status"]) for j in done], cols)
+        if done:
+            publish("completed", done)
+        if promoted:
+            notify_new_jobs(promoted)
+        return missing
+
+    def extend_lease(self, agent_id: Any) -> int:
+        return extend_leases(agent_id)
+
+    def held_by(self, agent_id: Any, job_ids: List[Any]) -> List[Any]:
+        if not job_ids:
+            return []
+        with get_engine().begin() as cx:
+            cols = ensure_job_schema(cx)
+            agent_cols = [col for col in AGENT_COLUMNS if col in cols]
+            if not agent_cols:
+                return list(job_ids)  # no owner recorded: nothing to revoke
+            marks = ",".join("?" * len(job_ids))
+            rows = cx.exec_driver_sql(
+                f"SELECT id FROM jobs WHERE id IN ({marks}) AND status IN ('claimed','in_progress') "
+                f"AND ({' OR '.join(f'{col}=?' for col in agent_cols)})",
+                (*job_ids, *[agent_id] * len(agent_cols))
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    # -- reads / admin --
+
+    def stats(self, breakdown: Optional[str] = None) -> Dict[str, Any]:
+        return read_totals(breakdown)
+
+    def get(self, job_id: Any, include_archive: bool = False) -> Optional[Dict[str, Any]]:
+        with get_engine().begin() as cx:
+            cols = ensure_job_schema(cx)
+            sql = "SELECT * FROM jobs WHERE id=?"
+            if "output_json" not in cols:
+                # ORM schema: the output lives in results
+                sql = ("SELECT j.*, r.output_json, r.output_blob FROM jobs j "
+                       "LEFT JOIN results r ON r.job_id = j.id WHERE j.id=?")
+            row = cx.exec_driver_sql(sql, (job_id,)).mappings().first()
+        if row:
+            return blob_store.resolve_row(dict(row))
+        return fetch_archived(job_id) if include_archive else None
+
+    def recent(self, limit: int, include_archive: bool = False) -> List[Dict[str, Any]]:
+        with get_engine().begin() as cx:
+            ensure_job_schema(cx)
+            rows = [dict(r) for r in cx.exec_driver_sql(
+                "SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)
+            ).mappings().all()]
+        if include_archive:
+            rows = sorted(rows + recent_archived(limit), key=lambda r: r["id"], reverse=True)[:limit]
+        return rows
+
+    def list_jobs(self, query: JobQuery, limit: int, before: Any = None) -> List[Dict[str, Any]]:
+        with get_engine().begin() as cx:
+            cols = ensure_job_schema(cx)
+            where: List[str] = []
+            params: List[Any] = []
+            for col, values in (("status", query.status), ("kind", query.kind)):
+                if values:
+                    where.append(f"{col} IN ({', '.join('?' * len(values))})")
+                    params.extend(sorted(values))
+            if query.agent is not None:
+                agent_col = next((c for c in AGENT_COLUMNS if c in cols), None)
+                if agent_col is None:
+                    return []
+                where.append(f"{agent_col}=?")
+                params.append(query.agent)
+            if query.created_after is not None:
+                where.append("created_at >= ?")
+                params.append(_created_at(cols, query.created_after))
+            if query.created_before is not None:
+                where.append("created_at < ?")
+                params.append(_created_at(cols, query.created_before))
+            if before is not None:
+                where.append("id < ?")
+                params.append(before)
+            sql = "SELECT * FROM jobs" + (f" WHERE {' AND '.join(where)}" if where else "")
+            return [dict(r) for r in cx.exec_driver_sql(
+                f"{sql} ORDER BY id DESC LIMIT ?", tuple(params) + (limit,)
+            ).mappings().all()]
+
+    def _requeue(self, where: str, params: tuple) -> int:
+        with get_engine(immediate=True).begin() as cx:
+            cols = ensure_job_schema(cx)
+            resets = "".join(f", {col}=NULL" for col in AGENT_COLUMNS if col in cols)
+            n = cx.exec_driver_sql(
+                f"UPDATE jobs SET status='queued', lease_expires_at=NULL{resets} WHERE {where}", params
+            ).rowcount
+        if n:
+            notify_new_jobs(n)
+        return n
+
+    def retry(self, job_id: Any) -> bool:
+        return self._requeue("id=?", (job_id,)) > 0
+
+    def requeue_stale(self, age_seconds: float) -> int:
+        cols = ensure_job_schema()
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=age_seconds)
+        if "claimed_at" in cols:
+            return self._requeue("status IN ('claimed','in_progress') AND claimed_at < ?", (cutoff.isoformat(),))
+        return self._requeue(
+            "status IN ('claimed','in_progress') AND updated_at < ?",
+            (cutoff.replace(tzinfo=None).strftime("%Y-%m-%d %H:%M:%S.%f"),)
+        )
+
+    # -- maintenance --
+
+    def requeue_expired(self) -> int:
+        n = requeue_expired_leases()
+        if n:
+            notify_new_jobs(n)
+        return n
+
+    def promote_due(self) -> int:
+        n = promote_due()
+        if n:
+            notify_new_jobs(n)
+        return n
+
+    def next_run_at(self) -> Optional[float]:
+        return next_run_at()
+
+    def archive(self, older_than: timedelta) -> int:
+        n = archive_finished(older_than)
+        collect_blobs()
+        return n
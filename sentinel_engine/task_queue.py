@@ -1,4 +1,5 @@
 import asyncio
+import threading
 
 # Global asyncio queue is used as an in-memory trigger, but tasks persist in DB.
 # The worker loop polls DB for 'queued' tasks as well.
@@ -12,3 +13,63 @@ async def wait_for_task_id():
     task_id = await queue.get()
     queue.task_done()
     return task_id
+
+# Jobs table wakeups: claim long-polls park on _job_cond and enqueue paths
+# (which usually run in the threadpool) signal it via notify_new_jobs().
+_job_cond = asyncio.Condition()
+_job_loop: asyncio.AbstractEventLoop | None = None
+_job_seq = 0
+_job_seq_lock = threading.Lock()
+
+def job_seq() -> int:
+    return _job_seq
+
+async def _wake_job_waiters(count: int):
+    async with _job_cond:
+        _job_cond.notify(count)
+
+def notify_new_jobs(count: int = 1):
+    """Thread-safe: wake up to `count` long-polling claimers."""
+    global _job_seq
+    with _job_seq_lock:
+        _job_seq += 1
+    loop = _job_loop
+    if loop is None or loop.is_closed():
+        return  # nobody has ever waited
+    asyncio.run_coroutine_threadsafe(_wake_job_waiters(count), loop)
+
+async def wait_for_new_jobs(seen_seq: int, timeout: float) -> bool:
+    """Wait until a job is enqueued after `seen_seq` was read. False on timeout."""
+    global _job_loop
+    _job_loop = asyncio.get_running_loop()
+    try:
+        async with _job_cond:
+            await asyncio.wait_for(_job_cond.wait_for(lambda: _job_seq != seen_seq), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+# Scheduler wakeups: the orchestrator timer sleeps until the nearest due
+# job or system task; enqueueing a scheduled job (or shutdown) wakes it early
+# so it can re-plan.
+_timer_wake = asyncio.Event()
+_timer_loop: asyncio.AbstractEventLoop | None = None
+
+def notify_schedule_changed():
+    """Thread-safe: make the timer re-read the next run_at."""
+    loop = _timer_loop
+    if loop is None or loop.is_closed():
+        return  # timer not running
+    loop.call_soon_threadsafe(_timer_wake.set)
+
+async def wait_for_schedule_change(timeout: float) -> bool:
+    """Sleep up to `timeout` seconds; True if woken by notify_schedule_changed()."""
+    global _timer_loop
+    _timer_loop = asyncio.get_running_loop()
+    try:
+        await asyncio.wait_for(_timer_wake.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        _timer_wake.clear()
@@ -0,0 +1,104 @@
+"""
+Shared fixtures. Every test gets its own SQLite file and blob directory
+under tmp_path instead of ops/data, and queue tests run against both
+historical jobs schemas (raw-SQL TEXT ids, ORM INTEGER ids) and, where the
+semantics are shared, the memory backend too.
+"""
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from sentinel_engine import blob_store, db, job_archive, job_lanes, job_queue  # noqa: E402
+from sentinel_engine.config import settings  # noqa: E402
+
+# The raw-SQL jobs table as routes/jobs.py creates it.
+TEXT_JOBS_DDL = """
+CREATE TABLE IF NOT EXISTS jobs (
+  id TEXT PRIMARY KEY,
+  kind TEXT NOT NULL,
+  payload_json TEXT,
+  payload_blob TEXT,
+  status TEXT NOT NULL DEFAULT 'queued',
+  priority INTEGER NOT NULL DEFAULT 0,
+  tenant INTEGER NOT NULL DEFAULT 1,
+  created_at TEXT NOT NULL,
+  claimed_by TEXT,
+  claimed_at TEXT,
+  completed_at TEXT,
+  output_json TEXT,
+  output_blob TEXT,
+  lease_expires_at REAL,
+  pending_deps INTEGER NOT NULL DEFAULT 0,
+  run_at REAL,
+  cron TEXT,
+  idempotency_key TEXT,
+  dedup_hash TEXT
+);
+"""
+
+@pytest.fixture(autouse=True)
+def blob_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_store, "BLOB_DIR", tmp_path / "blobs")
+    return tmp_path / "blobs"
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    eng = create_engine(f"sqlite:///{tmp_path / 'sentinel.sqlite'}",
+                        connect_args={"check_same_thread": False}, future=True)
+    monkeypatch.setattr(db, "engine", eng)
+    monkeypatch.setattr(db, "_immediate_engine", eng.execution_options(sqlite_begin="IMMEDIATE"))
+    monkeypatch.setattr(job_queue, "_columns", None)
+    monkeypatch.setattr(job_queue, "_text_ids", True)
+    monkeypatch.setattr(job_queue, "fair_share", job_queue.FairShareScheduler({}))
+    monkeypatch.setattr(job_archive, "_ready", False)
+    monkeypatch.setattr(settings, "queue_aging_every", 0)
+    yield eng
+    eng.dispose()
+
+def create_schema(eng, schema: str):
+    if schema == "text":
+        with eng.begin() as cx:
+            cx.exec_driver_sql(TEXT_JOBS_DDL)
+    else:
+        from sentinel_engine.models_agent_mvp import Agent, Job, Result
+        db.Base.metadata.create_all(eng, tables=[Agent.__table__, Job.__table__, Result.__table__])
+
+@pytest.fixture(params=["text", "orm"])
+def schema(request, engine):
+    create_schema(engine, request.param)
+    return request.param
+
+@pytest.fixture
+def sqlite_queue(schema):
+    from sentinel_engine.sqlite_queue import SQLiteQueueBackend
+    return SQLiteQueueBackend()
+
+@pytest.fixture(params=["sqlite-text", "sqlite-orm", "memory"])
+def queue(request, engine):
+    if request.param == "memory":
+        from sentinel_engine.memory_queue import MemoryQueueBackend
+        return MemoryQueueBackend(None)
+    create_schema(engine, request.param.split("-")[1])
+    from sentinel_engine.sqlite_queue import SQLiteQueueBackend
+    return SQLiteQueueBackend()
+
+@pytest.fixture
+def worker(tmp_path, monkeypatch):
+    # a fresh ops/agent_worker per test: its AIMD state, telemetry and clients are module globals
+    monkeypatch.setenv("SENTINEL_SPOOL_DIR", str(tmp_path / "spool"))
+    monkeypatch.setattr(job_lanes, "_shared", None)  # the module shares its Lanes on import
+    spec = importlib.util.spec_from_file_location("agent_worker", ROOT / "ops" / "agent_worker.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    yield module
+    module.lanes.close()
+
+def rows(eng, sql, params=()):
+    with eng.begin() as cx:
+        return cx.exec_driver_sql(sql, params).fetchall()
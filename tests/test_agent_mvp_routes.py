@@ -0,0 +1,49 @@
+import importlib
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from sentinel_engine import queue_backend
+from sentinel_engine.queue_backend import JobSpec
+from sentinel_engine.sqlite_queue import SQLiteQueueBackend
+from conftest import create_schema, rows
+
+@pytest.fixture
+def client(engine, monkeypatch):
+    create_schema(engine, "orm")  # before the import: the module creates tables on import
+    module = importlib.import_module("sentinel_engine.routes.orchestrator_agent_mvp")
+    q = SQLiteQueueBackend()
+    monkeypatch.setattr(queue_backend, "_backend", q)
+    app = FastAPI()
+    app.include_router(module.router)
+    with TestClient(app) as c:
+        yield c, q
+
+def test_replayed_completion_keeps_the_first_result(client, engine):
+    c, q = client
+    job = q.enqueue(JobSpec(kind="scan"))
+    assert c.get("/jobs/claim", params={"agent_id": 1}).json()["id"] == job["id"]
+    first = c.post(f"/jobs/{job['id']}/complete", json={"status": "completed", "output_json": '{"n": 1}'})
+    replay = c.post(f"/jobs/{job['id']}/complete", json={"status": "failed", "output_json": '{"n": 2}'})
+    assert first.status_code == replay.status_code == 200
+    assert rows(engine, "SELECT status, output_json FROM results") == [("completed", '{"n": 1}')]
+    assert q.get(job["id"])["status"] == "completed"
+
+def test_fan_in_child_reads_outputs_written_by_the_route(client):
+    c, q = client
+    out = q.enqueue_graph({"a": JobSpec(kind="fetch"), "b": JobSpec(kind="merge", depends_on=["a"])})
+    c.get("/jobs/claim", params={"agent_id": 1})
+    c.post(f"/jobs/{out['a']['id']}/complete", json={"status": "completed", "output_json": json.dumps([1])})
+    child = c.get("/jobs/claim", params={"agent_id": 1}).json()
+    assert child["parent_outputs"] == {str(out["a"]["id"]): "[1]"}
+
+def test_complete_errors(client):
+    c, q = client
+    assert c.post("/jobs/999/complete", json={"status": "completed"}).status_code == 404
+    job = q.enqueue(JobSpec(kind="scan"))
+    assert c.post(f"/jobs/{job['id']}/complete", json={"status": "done"}).status_code == 400
+    ref = json.dumps({"$blob": "sha256:" + "0" * 64})
+    assert c.post(f"/jobs/{job['id']}/complete",
+                  json={"status": "completed", "output_json": ref}).status_code == 400
@@ -0,0 +1,485 @@
+import asyncio
+import json
+import os
+from collections import Counter
+
+import httpx
+import pytest
+
+class _Acks:
+    def __init__(self):
+        self.results = []
+
+    def add(self, result, kind=""):
+        self.results.append(result)
+
+async def _run(worker, prefetch, jobs, slots):
+    acks = _Acks()
+    runners = [asyncio.create_task(worker.runner(prefetch, acks)) for _ in range(slots)]
+    await prefetch.put(jobs)
+    await asyncio.wait_for(prefetch.drained(), 5)
+    for t in runners:
+        t.cancel()
+    await asyncio.gather(*runners, return_exceptions=True)
+    return acks.results
+
+def _tracking_handler(worker, monkeypatch):
+    running, peak = Counter(), Counter()
+
+    async def handle(job):
+        for k in (job["kind"], "*"):
+            running[k] += 1
+            peak[k] = max(peak[k], running[k])
+        await asyncio.sleep(0.02)
+        for k in (job["kind"], "*"):
+            running[k] -= 1
+        return {"ok": True}
+
+    for kind in ("fast", "slow"):
+        monkeypatch.setitem(worker.HANDLERS, kind, handle)
+    return peak
+
+def test_parse_kind_limits(worker):
+    assert worker.parse_kind_limits("http:16, echo : 0,bad:x,junk") == {"http": 16, "echo": 1}
+
+def test_jobs_run_concurrently_within_kind_caps(worker, monkeypatch):
+    peak = _tracking_handler(worker, monkeypatch)
+    jobs = [{"id": i, "kind": "slow" if i % 2 else "fast"} for i in range(12)] + [{"id": 99, "kind": "nope"}]
+
+    async def go():
+        prefetch = worker.Prefetch(worker.Aimd(4, 4), 0, 300, {"slow": 1})
+        return await _run(worker, prefetch, jobs, 4)
+
+    results = asyncio.run(go())
+    assert peak["*"] == 4 and peak["slow"] == 1
+    by_id = {r["id"]: r for r in results}
+    assert sorted(by_id) == [j["id"] for j in jobs]
+    assert {r["status"] for i, r in by_id.items() if i != 99} == {"completed"}
+    assert by_id[99]["status"] == "failed" and "no handler" in json.loads(by_id[99]["output_json"])["error"]
+
+def test_handler_errors_fail_the_job(worker, monkeypatch):
+    async def boom(job):
+        raise ValueError("bad payload")
+
+    monkeypatch.setitem(worker.HANDLERS, "boom", boom)
+    result = asyncio.run(worker.run_job({"id": "j1", "kind": "boom"}))
+    assert result["status"] == "failed" and json.loads(result["output_json"])["error"] == "bad payload"
+
+def _mock_api(worker, monkeypatch, responses):
+    seen = []
+
+    def handle(request):
+        seen.append((request.method, request.url.path, request.content))
+        out = responses.pop(0)
+        if isinstance(out, Exception):
+            raise out
+        return out
+
+    monkeypatch.setattr(worker, "api", httpx.AsyncClient(transport=httpx.MockTransport(handle)))
+    monkeypatch.setattr(worker, "BACKOFF", 0)
+    return seen
+
+def test_call_retries_overload_and_dropped_connections(worker, monkeypatch):
+    seen = _mock_api(worker, monkeypatch, [
+        httpx.Response(503), httpx.ConnectError("refused"), httpx.Response(200, json={"ok": True}),
+    ])
+    assert asyncio.run(worker.post("/jobs/complete:batch", [{"id": 1}])) == {"ok": True}
+    assert [s[:2] for s in seen] == [("POST", "/v0/jobs/complete:batch")] * 3
+    assert seen[0][2] == b'[{"id": 1}]'
+    assert worker.aimd.last_cut > 0  # the 503 counted as overload
+
+def test_call_gives_up_after_the_retry_budget(worker, monkeypatch):
+    monkeypatch.setattr(worker, "RETRIES", 1)
+    seen = _mock_api(worker, monkeypatch, [httpx.Response(502), httpx.Response(502, text="bad gateway")])
+    with pytest.raises(RuntimeError, match="502 bad gateway"):
+        asyncio.run(worker.get("/jobs/claim"))
+    assert len(seen) == 2
+
+def test_client_errors_are_not_retried(worker, monkeypatch):
+    seen = _mock_api(worker, monkeypatch, [httpx.Response(404, text="gone")])
+    with pytest.raises(RuntimeError, match="404"):
+        asyncio.run(worker.post("/jobs/1/complete", {}))
+    assert len(seen) == 1
+
+def test_retry_after(worker):
+    assert worker.retry_after(httpx.Response(429, headers={"Retry-After": "2.5"})) == 2.5
+    assert worker.retry_after(httpx.Response(429, headers={"Retry-After": "-3"})) == 0.0
+    assert worker.retry_after(httpx.Response(429, headers={"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0.0
+    assert worker.retry_after(httpx.Response(429, headers={"Retry-After": "soon"})) is None
+    assert worker.retry_after(httpx.Response(429)) is None
+
+def test_pooled_clients_keep_connections_alive(worker):
+    async def go():
+        client = worker.make_client(4, retries=2)
+        try:
+            pool = client._transport._pool
+            return pool._max_connections, pool._max_keepalive_connections, pool._keepalive_expiry, pool._retries
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(go()) == (4, 4, worker.KEEPALIVE, 2)
+
+def test_prefetch_depth_keeps_buffered_jobs_inside_half_a_lease(worker):
+    prefetch = worker.Prefetch(worker.Aimd(4, 4), 8, 300, {})
+    assert prefetch.limit() == 8 and prefetch.room() == 12
+    prefetch.avg = 100  # 4 slots x 150s / 100s per job
+    assert prefetch.limit() == 6
+    prefetch.avg = 10_000
+    assert prefetch.limit() == 1
+    prefetch.running, prefetch.jobs = 3, worker.deque([{"id": 1}])
+    assert prefetch.room() == 1
+
+def test_claims_wait_for_room_and_revokes_drop_jobs(worker):
+    async def go():
+        prefetch = worker.Prefetch(worker.Aimd(2, 2), 2, 300, {})
+        await prefetch.put([{"id": i, "kind": "k"} for i in range(4)])
+        waiter = asyncio.create_task(prefetch.wait_room(2))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()  # 2 slots + 2 buffered, nothing running
+        running = asyncio.create_task(asyncio.sleep(10))
+        taken = await prefetch.take()
+        prefetch.active[str(taken["id"])] = running
+        prefetch.revoke([taken["id"], 2, 3])
+        room = await asyncio.wait_for(waiter, 1)
+        await asyncio.sleep(0)
+        return room, [j["id"] for j in prefetch.jobs], running.cancelled()
+
+    assert asyncio.run(go()) == (2, [1], True)
+
+def _recording_complete(worker, monkeypatch):
+    sent = []
+
+    async def complete_jobs(results):
+        sent.append([r["id"] for r in results])
+
+    monkeypatch.setattr(worker, "complete_jobs", complete_jobs)
+    return sent
+
+def _result(i):
+    return {"id": i, "status": "completed", "output_json": "{}"}
+
+def test_acks_go_out_in_batches(worker, monkeypatch, tmp_path):
+    sent = _recording_complete(worker, monkeypatch)
+    spool = worker.Spool(str(tmp_path / "w.ndjson"))
+
+    async def go():
+        acks = worker.Acks(2, 10, spool)
+        flusher = asyncio.create_task(acks.run())
+        for i in range(5):
+            acks.add(_result(i), "scan")
+        await asyncio.sleep(0.05)  # a full batch does not wait out the interval
+        early = list(sent)
+        await acks.flush()
+        flusher.cancel()
+        return early
+
+    assert asyncio.run(go()) == [[0, 1], [2, 3], [4]]
+    assert sent == [[0, 1], [2, 3], [4]]
+    assert spool.outstanding == set() and (tmp_path / "w.ndjson").stat().st_size == 0
+    (latency,) = worker.telemetry.snapshot()["series"]
+    assert (latency["metric"], latency["kind"], sum(latency["counts"])) == ("completion_latency", "scan", 5)
+
+def test_partial_batch_goes_out_after_the_interval(worker, monkeypatch, tmp_path):
+    sent = _recording_complete(worker, monkeypatch)
+
+    async def go():
+        acks = worker.Acks(10, 0.02, worker.Spool(str(tmp_path / "w.ndjson")))
+        flusher = asyncio.create_task(acks.run())
+        acks.add(_result("a"))
+        await asyncio.sleep(0.2)
+        flusher.cancel()
+
+    asyncio.run(go())
+    assert sent == [["a"]]
+
+def test_complete_falls_back_to_per_job_calls(worker, monkeypatch):
+    posted = []
+
+    async def post(path, body):
+        posted.append(path)
+        if path == "/jobs/complete:batch":
+            raise RuntimeError(f"POST {path} -> 404 not found")
+        if path == "/jobs/2/complete":
+            raise RuntimeError(f"POST {path} -> 404 job_not_found")
+        return {"ok": True}
+
+    monkeypatch.setattr(worker, "post", post)
+    asyncio.run(worker.complete_jobs([_result(1), _result(2)]))
+    asyncio.run(worker.complete_jobs([_result(3)]))
+    assert posted == ["/jobs/complete:batch", "/jobs/1/complete", "/jobs/2/complete", "/jobs/3/complete"]
+
+def _clock(worker, monkeypatch, start=1000.0):
+    now = [start]
+    monkeypatch.setattr(worker.time, "monotonic", lambda: now[0])
+    return now
+
+def test_aimd_grows_by_one_slot_per_round(worker, monkeypatch):
+    _clock(worker, monkeypatch)
+    aimd = worker.Aimd(1, 8)
+    changes = []
+    aimd.on_change = lambda: changes.append(aimd.slots())
+    assert aimd.slots() == 4
+    for _ in range(4):
+        aimd.grow()
+    assert aimd.slots() == 4 and changes == []
+    aimd.grow()
+    assert aimd.slots() == 5 and changes == [5]
+    for _ in range(100):
+        aimd.grow()
+    assert aimd.slots() == 8
+
+def test_aimd_cuts_once_per_cooldown_and_honours_retry_after(worker, monkeypatch):
+    now = _clock(worker, monkeypatch)
+    aimd = worker.Aimd(3, 16)
+    aimd.cut()
+    aimd.cut()  # same burst
+    assert aimd.slots() == 4
+    now[0] += 1
+    aimd.cut(retry_after=5)
+    assert aimd.slots() == 3 and aimd.not_before == now[0] + 5  # never below the floor
+    aimd.grow()
+    assert aimd.limit == 3  # paused
+    now[0] += 5
+    aimd.grow()
+    assert aimd.limit > 3
+    aimd.cut(retry_after=10_000)
+    assert aimd.not_before == now[0] + worker.MAX_RETRY_AFTER
+
+def test_slow_control_plane_counts_as_overload(worker, monkeypatch):
+    now = _clock(worker, monkeypatch)
+    aimd = worker.Aimd(1, 8)
+    for _ in range(5):
+        aimd.sample(0.01)
+    assert not aimd.congested() and aimd.slots() == 4
+    for _ in range(5):
+        aimd.sample(0.2)
+    assert aimd.congested() and aimd.slots() == 2
+    now[0] += 60
+    aimd.grow()
+    assert aimd.slots() == 2  # no growth while congested
+
+def test_only_a_saturated_worker_grows(worker):
+    async def go():
+        aimd = worker.Aimd(1, 8)
+        prefetch = worker.Prefetch(aimd, 0, 300, {})
+        await prefetch.put([{"id": i, "kind": "k"} for i in range(4)])
+        jobs = [await prefetch.take() for _ in range(4)]
+        await prefetch.done(jobs.pop(), 0.1)  # 4 of 4 slots busy
+        grown = aimd.limit
+        await prefetch.done(jobs.pop(), 0.1)  # 3 of 4
+        return grown, aimd.limit
+
+    grown, after = asyncio.run(go())
+    assert grown == after == 4.25
+
+def test_spool_keeps_unacked_results_across_restarts(worker, tmp_path):
+    path = str(tmp_path / "w.ndjson")
+
+    async def first_run():
+        spool = worker.Spool(path)
+        await spool.write([_result(1), _result(2), _result(3)])
+        await spool.ack([1])
+        await spool.write([_result(2)])  # replayed again before the crash
+        spool.close()
+
+    asyncio.run(first_run())
+    with open(path, "ab") as f:
+        f.write(b'{"id": 4, "sta')  # torn by the crash
+    spool = worker.Spool(path)
+    assert spool.outstanding == {2, 3}
+    assert [[r["id"] for r in chunk] for chunk in spool.unacked(1)] == [[2], [3]]
+
+    async def drain():
+        await spool.ack([2, 3])
+
+    asyncio.run(drain())
+    spool.close()
+    assert (tmp_path / "w.ndjson").stat().st_size == 0
+    assert worker.Spool(path).outstanding == set()
+
+def test_workers_sharing_a_name_keep_separate_spools(worker, tmp_path):
+    path = str(tmp_path / "w.ndjson")
+
+    async def two_workers():
+        first, second = worker.Spool(path), worker.Spool(path)
+        assert first.path == path and second.path == str(tmp_path / f"w.{os.getpid()}.ndjson")
+        await first.write([_result(1)])
+        await second.write([_result(2)])
+        second.close()  # exits with unacked results
+        first.close()
+
+    asyncio.run(two_workers())
+    spool = worker.Spool(path)
+    assert spool.outstanding == {1, 2}
+    assert sorted(r["id"] for chunk in spool.unacked(10) for r in chunk) == [1, 2]
+    assert sorted(os.listdir(tmp_path)) == ["w.ndjson"]
+
+def test_results_survive_an_outage_and_are_replayed(worker, monkeypatch, tmp_path):
+    monkeypatch.setattr(worker.random, "uniform", lambda a, b: 0)
+    up, sent = [False], []
+
+    async def complete_jobs(results):
+        if not up[0]:
+            raise RuntimeError("POST /v0/jobs/complete:batch -> 503")
+        sent.extend(r["id"] for r in results)
+
+    monkeypatch.setattr(worker, "complete_jobs", complete_jobs)
+    spool = worker.Spool(str(tmp_path / "w.ndjson"))
+
+    async def go():
+        acks = worker.Acks(2, 0, spool)
+        for i in range(3):
+            acks.add(_result(i))
+        await acks.flush()
+        assert acks.offline and spool.outstanding == {0, 1, 2}
+        acks.add(_result(3))
+        await acks.flush()  # offline: spooled only, the replayer sends it
+        replayer = asyncio.create_task(acks.replay())
+        await asyncio.sleep(0.02)  # replays keep failing while the server is down
+        assert sent == [] and acks.offline
+        up[0] = True
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if not acks.offline:
+                break
+        replayer.cancel()
+        return acks.offline
+
+    assert asyncio.run(go()) is False
+    assert sorted(sent) == [0, 1, 2, 3] and spool.outstanding == set()
+
+def test_leftovers_from_a_previous_run_start_offline(worker, tmp_path):
+    path = str(tmp_path / "w.ndjson")
+
+    async def crash():
+        spool = worker.Spool(path)
+        await spool.write([_result("left")])
+        spool.close()
+
+    asyncio.run(crash())
+
+    async def restart():
+        return worker.Acks(2, 0, worker.Spool(path))
+
+    acks = asyncio.run(restart())
+    assert acks.offline and acks._replay.is_set()
+
+class _FakeWs:
+    """The server end of a Channel's connection; `serve` maps a request frame to the frames sent back."""
+
+    def __init__(self, serve):
+        self.serve = serve
+        self.sent = []
+        self._inbox = asyncio.Queue()
+
+    async def send(self, raw):
+        msg = json.loads(raw)
+        self.sent.append(msg)
+        for reply in self.serve(msg):
+            self.push(reply)
+
+    def push(self, msg):
+        self._inbox.put_nowait(json.dumps(msg) if msg is not None else None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        raw = await self._inbox.get()
+        if raw is None:
+            raise StopAsyncIteration
+        return raw
+
+    async def close(self):
+        self.push(None)
+
+def _channel(worker, serve):
+    ch = worker.Channel("ws://test/v0/agents/ws", {})
+    ws = _FakeWs(serve)
+    ch._ws = ws
+    asyncio.create_task(ch._read(ws))
+    return ch, ws
+
+def _server(msg):
+    if msg["op"] == "claim":
+        yield {"op": "claim", "ref": msg["ref"], "credit": msg["max"]}
+        if msg["max"] == 3:  # only the first top-up finds jobs
+            yield {"op": "assign", "jobs": [{"id": "j1"}, {"id": "j2"}]}
+    elif msg["op"] == "complete":
+        yield {"op": "error", "ref": msg["ref"], "status": 400, "detail": "bad_status"}
+    elif msg["op"] == "heartbeat":
+        yield {"op": "cancel", "ids": ["j2"]}
+        yield {"op": "heartbeat", "ref": msg["ref"], "ok": True}
+
+def test_channel_claims_against_server_side_credit(worker):
+    async def go():
+        ch, ws = _channel(worker, _server)
+        first = await ch.claim(3, 1)
+        credit = ch.credit
+        second = await ch.claim(3, 0.05)
+        return first, credit, second, ch.credit, [m.get("max") for m in ws.sent]
+
+    first, credit, second, after, asked = asyncio.run(go())
+    assert first == [{"id": "j1"}, {"id": "j2"}] and credit == 1
+    assert second == [] and after == 3 and asked == [3, 2]
+
+def test_channel_pushes_and_errors(worker):
+    async def go():
+        ch, ws = _channel(worker, _server)
+        cancelled = []
+        ch.on_cancel = cancelled.extend
+        beat = await ch.request("heartbeat", urgent=True)
+        with pytest.raises(RuntimeError, match="400 bad_status"):
+            await ch.request("complete", results=[])
+        return beat, cancelled
+
+    beat, cancelled = asyncio.run(go())
+    assert beat["ok"] and cancelled == ["j2"]
+
+def test_dropped_channel_fails_waiting_requests(worker):
+    async def go():
+        ch, ws = _channel(worker, lambda msg: ())
+        pending = asyncio.create_task(ch.request("heartbeat", urgent=True))
+        await asyncio.sleep(0.01)
+        await ws.close()
+        with pytest.raises(ConnectionError):
+            await pending
+        return ch._ws
+
+    assert asyncio.run(go()) is None
+
+def test_claim_without_long_poll_returns_at_once(worker):
+    async def go():
+        ch, ws = _channel(worker, lambda msg: [{"op": "claim", "ref": msg["ref"], "credit": msg["max"]}])
+        empty = await asyncio.wait_for(ch.claim(2, 0), 1)
+        ws.push({"op": "assign", "jobs": [{"id": "j1"}]})
+        await asyncio.sleep(0.01)
+        return empty, await asyncio.wait_for(ch.claim(2, 0), 1), ch.credit, ch.queued
+
+    assert asyncio.run(go()) == ([], [{"id": "j1"}], 1, 0)
+
+def test_reconnect_asks_again_for_outstanding_credit(worker, monkeypatch):
+    def serve(msg):
+        yield {"op": msg["op"], "ref": msg["ref"], "credit": msg.get("max")}
+        if msg["op"] == "claim" and len(dialled) == 2:
+            yield {"op": "assign", "jobs": [{"id": "j1"}]}
+
+    dialled = []
+
+    async def connect(url, **kwargs):
+        dialled.append(_FakeWs(serve))
+        return dialled[-1]
+
+    monkeypatch.setattr("websockets.connect", connect)
+
+    async def go():
+        ch = worker.Channel("ws://test/v0/agents/ws", {})
+        ch.agent_id = "a1"
+        assert await ch.claim(3, 0.01) == []
+        await dialled[0].close()  # the server requeues whatever it held for this session
+        await asyncio.sleep(0.01)
+        return await ch.claim(3, 1), ch.credit
+
+    jobs, credit = asyncio.run(go())
+    assert jobs == [{"id": "j1"}] and credit == 2
+    assert [(m["op"], m.get("max")) for m in dialled[1].sent] == [("register", None), ("claim", 3)]
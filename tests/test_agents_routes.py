@@ -0,0 +1,120 @@
+import asyncio
+import importlib
+
+import pytest
+from fastapi import FastAPI, WebSocketDisconnect
+from fastapi.testclient import TestClient
+
+from sentinel_engine import queue_backend, task_queue
+from sentinel_engine.job_telemetry import FleetTelemetry, Telemetry
+from sentinel_engine.queue_backend import JobSpec
+from sentinel_engine.security import guard_api_key
+from sentinel_engine.sqlite_queue import SQLiteQueueBackend
+
+@pytest.fixture
+def agents_routes(engine, monkeypatch):
+    importlib.import_module("sentinel_engine.routes.jobs").ensure_schema()
+    module = importlib.import_module("sentinel_engine.routes.agents")
+    module.ensure_schema()  # this test's database
+    monkeypatch.setattr(module, "fleet", FleetTelemetry(60))
+    monkeypatch.setattr(queue_backend, "_backend", SQLiteQueueBackend())
+    # the long-poll condition binds to the first loop that waits on it
+    monkeypatch.setattr(task_queue, "_job_cond", asyncio.Condition())
+    monkeypatch.setattr(task_queue, "_job_loop", None)
+    return module
+
+@pytest.fixture
+def client(agents_routes):
+    app = FastAPI()
+    app.include_router(agents_routes.router_v0)
+    app.dependency_overrides[guard_api_key] = lambda: None
+    with TestClient(app) as c:
+        yield c
+
+def test_heartbeat_telemetry_feeds_the_fleet_view(client):
+    agent = client.post("/v0/agents/register", json={"name": "w1"}).json()["id"]
+    t = Telemetry()
+    t.observe("handler_duration", 0.2, "scan")
+    beat = client.post("/v0/agents/heartbeat", json={"agent_id": agent, "telemetry": t.snapshot()}).json()
+    assert beat["ok"] and "telemetry_error" not in beat
+    bad = client.post("/v0/agents/heartbeat", json={"agent_id": agent, "telemetry": {"buckets": [1]}}).json()
+    assert bad["ok"] and bad["telemetry_error"]  # the lease extension still happened
+    summary = client.get("/v0/agents/telemetry").json()
+    assert summary["agents"] == 1 and summary["metrics"]["handler_duration"]["scan"]["count"] == 1
+    text = client.get("/v0/agents/telemetry", params={"format": "prometheus"}).text
+    assert 'sentinel_fleet_handler_duration_seconds_count{kind="scan"} 1' in text
+    assert client.get("/v0/agents/telemetry", params={"format": "xml"}).status_code == 400
+
+def _frames(ws, *ops):
+    # replies and pushes interleave: read until one frame of each op has arrived
+    got = {}
+    while set(ops) - set(got):
+        msg = ws.receive_json()
+        got.setdefault(msg["op"], msg)
+    return got
+
+def test_ws_rejects_a_bad_key(client, monkeypatch):
+    monkeypatch.setenv("SENTINEL_API_KEY", "k")
+    with pytest.raises(WebSocketDisconnect) as e:
+        with client.websocket_connect("/v0/agents/ws", headers={"X-API-Key": "nope"}) as ws:
+            ws.receive_json()
+    assert e.value.code == 1008
+
+def test_ws_register_claim_complete(client, monkeypatch):
+    monkeypatch.setenv("SENTINEL_API_KEY", "k")
+    q = queue_backend.get_queue()
+    jobs = q.enqueue_many([JobSpec(kind="scan") for _ in range(3)])
+    with client.websocket_connect("/v0/agents/ws", headers={"X-API-Key": "k"}) as ws:
+        ws.send_json({"op": "claim", "max": 1, "ref": 1})
+        assert ws.receive_json() == {"op": "error", "status": 409, "detail": "register first", "ref": 1}
+        ws.send_json({"op": "register", "name": "w1", "ref": 2})
+        reg = ws.receive_json()
+        assert reg["op"] == "registered" and reg["ref"] == 2
+        ws.send_json({"op": "claim", "max": 2, "ref": 3})
+        got = _frames(ws, "claim", "assign")
+        assert got["claim"]["ref"] == 3
+        assigned = [j["id"] for j in got["assign"]["jobs"]]
+        assert assigned == [j["id"] for j in jobs[:2]]
+        assert q.held_by(reg["id"], assigned) == assigned
+        ws.send_json({"op": "complete", "ref": 4, "results": [{"id": assigned[0], "status": "completed"}]})
+        assert ws.receive_json() == {"op": "complete", "completed": 1, "missing": [], "ref": 4}
+        q.retry(assigned[1])  # taken back by an operator
+        ws.send_json({"op": "heartbeat", "ref": 5})
+        got = _frames(ws, "cancel", "heartbeat")
+        assert got["cancel"]["ids"] == [assigned[1]] and got["heartbeat"]["ok"]
+        ws.send_json({"op": "dance", "ref": 6})
+        assert ws.receive_json()["status"] == 400
+    assert q.get(jobs[0]["id"])["status"] == "completed"
+    assert q.get(jobs[2]["id"])["status"] == "queued"
+
+def test_ws_closes_on_a_frame_that_is_not_json(client, monkeypatch):
+    monkeypatch.setenv("SENTINEL_API_KEY", "k")
+    with pytest.raises(WebSocketDisconnect) as e:
+        with client.websocket_connect("/v0/agents/ws", headers={"X-API-Key": "k"}) as ws:
+            ws.send_text("op=claim")
+            ws.receive_json()
+    assert e.value.code == 1003
+
+class _StalledWs:
+    """A socket whose sends never finish, as when the peer vanished mid-frame."""
+
+    async def send_json(self, msg):
+        await asyncio.Event().wait()
+
+def test_jobs_leased_but_not_delivered_are_requeued(agents_routes):
+    q = queue_backend.get_queue()
+    (job,) = q.enqueue_many([JobSpec(kind="scan")])
+
+    async def go():
+        session = agents_routes._AgentSession(_StalledWs())
+        session.agent_id, session.credit = "a1", 1
+        assigner = asyncio.create_task(session.assign_loop())
+        while not session.undelivered:
+            await asyncio.sleep(0.01)
+        assigner.cancel()
+        await asyncio.gather(assigner, return_exceptions=True)
+        await session.release()
+        return session.assigned
+
+    assert asyncio.run(go()) == {}
+    assert q.get(job["id"])["status"] == "queued"
@@ -0,0 +1,124 @@
+import json
+import os
+import sqlite3
+import time
+from datetime import timedelta
+
+import pytest
+
+from sentinel_engine import blob_store
+from sentinel_engine.blob_store import BlobRefError
+from sentinel_engine.config import settings
+from sentinel_engine.queue_backend import JobSpec
+from conftest import rows
+
+BIG = json.dumps({"data": "x" * 4096})
+
+@pytest.fixture(autouse=True)
+def small_inline_limit(monkeypatch):
+    monkeypatch.setattr(settings, "blob_inline_max_bytes", 256)
+
+def test_offload_round_trip():
+    text, digest = blob_store.offload(BIG)
+    assert digest and json.loads(text) == {"$blob": f"sha256:{digest}", "size": len(BIG)}
+    assert blob_store.resolve(text, digest) == BIG
+    assert blob_store.offload('{"small": 1}') == ('{"small": 1}', None)
+    assert blob_store.offload(BIG)[1] == digest  # identical bodies share one blob
+
+def test_reference_shaped_bodies_are_rejected():
+    for text in ('{"$blob": "sha256:' + "0" * 64 + '"}', ' {"size": 1, "$blob": "x"}'):
+        with pytest.raises(BlobRefError):
+            blob_store.offload(text)
+    for text in (None, "", '{"blob": 1}', '["$blob"]', '{"$blob": ', 'not json "$blob"'):
+        blob_store.reject_ref(text)
+
+def test_large_payload_is_offloaded_and_resolved_at_claim(sqlite_queue, engine):
+    job = sqlite_queue.enqueue(JobSpec(kind="scan", payload_json=BIG))
+    ((payload_json, payload_blob),) = rows(engine, "SELECT payload_json, payload_blob FROM jobs WHERE id=?",
+                                           (job["id"],))
+    assert len(payload_json) < 256 and blob_store.exists(payload_blob)
+    (claimed,) = sqlite_queue.claim("agent-1")
+    assert claimed["payload_json"] == BIG
+
+def test_reference_text_is_never_resolved_without_the_digest_column(sqlite_queue, engine):
+    # another tenant's blob, and a row whose payload merely quotes its reference
+    secret, digest = blob_store.offload(json.dumps({"secret": "y" * 4096}))
+    job = sqlite_queue.enqueue(JobSpec(kind="scan", payload_json="{}", tenant=2))
+    with engine.begin() as cx:
+        cx.exec_driver_sql("UPDATE jobs SET payload_json=? WHERE id=?", (secret, job["id"]))
+    (claimed,) = sqlite_queue.claim("agent-1")
+    assert claimed["payload_json"] == secret
+
+def test_client_refs_are_rejected_by_every_backend(queue):
+    ref = json.dumps({"$blob": "sha256:" + "0" * 64, "size": 10})
+    with pytest.raises(BlobRefError):
+        queue.enqueue(JobSpec(kind="scan", payload_json=ref))
+    with pytest.raises(BlobRefError):
+        queue.enqueue_graph({"a": JobSpec(kind="scan", payload_json=ref)})
+    job = queue.enqueue(JobSpec(kind="scan"))
+    queue.claim("agent-1")
+    with pytest.raises(BlobRefError):
+        queue.complete([(job["id"], "completed", ref)])
+    assert queue.get(job["id"])["status"] == "claimed"
+
+def test_large_outputs_reach_fan_in_children(sqlite_queue):
+    out = sqlite_queue.enqueue_graph({"a": JobSpec(kind="fetch"), "b": JobSpec(kind="merge", depends_on=["a"])})
+    sqlite_queue.claim("agent-1")
+    sqlite_queue.complete([(out["a"]["id"], "completed", BIG)])
+    (child,) = sqlite_queue.claim("agent-1")
+    assert child["parent_outputs"] == {str(out["a"]["id"]): BIG}
+
+def _age(digest, seconds=7200):
+    path = next((blob_store.BLOB_DIR / digest[:2]).glob(f"{digest}.*"))
+    t = time.time() - seconds
+    os.utime(path, (t, t))
+
+def test_sweep_spares_referenced_and_recent_blobs():
+    keep, drop, fresh = (blob_store.put(f"{n}".encode() * 100) for n in "abc")
+    _age(keep)
+    _age(drop)
+    assert blob_store.sweep({keep}, grace_seconds=3600) == 1
+    assert blob_store.exists(keep) and blob_store.exists(fresh) and not blob_store.exists(drop)
+
+def test_reused_blob_gets_a_new_grace_period():
+    digest = blob_store.put(b"x" * 1000)
+    _age(digest)
+    assert blob_store.put(b"x" * 1000) == digest  # an enqueue offloading the same body
+    assert blob_store.sweep(set(), grace_seconds=3600) == 0
+
+def test_archive_keeps_blobs_of_archived_jobs(sqlite_queue, engine, schema):
+    shared = json.dumps({"data": "s" * 4096})
+    done = sqlite_queue.enqueue(JobSpec(kind="scan", payload_json=shared))
+    only = sqlite_queue.enqueue(JobSpec(kind="scan", payload_json=BIG))
+    hot = sqlite_queue.enqueue(JobSpec(kind="scan", payload_json=shared, priority=-1))
+    sqlite_queue.claim("agent-1", 2)
+    output = json.dumps({"out": "o" * 4096})
+    sqlite_queue.complete([(done["id"], "completed", output), (only["id"], "completed", None)])
+    orphan = blob_store.put(b"lost a dedup race" * 100)
+    for path in blob_store.BLOB_DIR.glob("*/*"):
+        _age(path.name.split(".")[0])
+    assert sqlite_queue.archive(timedelta(0)) == 2
+    assert not blob_store.exists(orphan)
+    assert blob_store.exists(rows(engine, "SELECT payload_blob FROM jobs WHERE id=?", (hot["id"],))[0][0])
+    archived = sqlite_queue.get(done["id"], include_archive=True)
+    assert (archived["payload_json"], archived["output_json"]) == (shared, output)
+    assert sqlite_queue.get(only["id"], include_archive=True)["payload_json"] == BIG
+
+def test_blobs_are_written_outside_the_write_transaction(sqlite_queue, engine, monkeypatch):
+    put = blob_store.put
+
+    def checked_put(data):
+        # a writer holding the lock would make this BEGIN IMMEDIATE fail at once
+        other = sqlite3.connect(engine.url.database, timeout=0, isolation_level=None)
+        try:
+            other.execute("BEGIN IMMEDIATE")
+            other.execute("ROLLBACK")
+        finally:
+            other.close()
+        return put(data)
+
+    monkeypatch.setattr(blob_store, "put", checked_put)
+    job = sqlite_queue.enqueue(JobSpec(kind="scan", payload_json=BIG))
+    sqlite_queue.enqueue_graph({"a": JobSpec(kind="scan", payload_json=BIG + " ")})
+    sqlite_queue.claim("agent-1", 2)
+    sqlite_queue.complete([(job["id"], "completed", BIG + "  ")])
@@ -0,0 +1,36 @@
+from collections import Counter
+
+from sentinel_engine import job_queue
+from sentinel_engine.job_queue import FairShareScheduler, parse_weights
+from sentinel_engine.queue_backend import JobSpec
+
+def test_parse_weights():
+    assert parse_weights("1:3, 2:1,acme:0.5,bad,3:x,4:0") == {1: 3.0, 2: 1.0, "acme": 0.5}
+    assert parse_weights("") == {}
+
+def test_plan_splits_claims_by_weight():
+    sched = FairShareScheduler({1: 3}, refresh_seconds=60, active=lambda _: [1, 2])
+    assert sched.plan(None, 8) == {1: 6, 2: 2}
+    assert sched.plan(None, 2) == {1: 2}
+    assert sched.plan(None, 2) == {1: 1, 2: 1}  # the ring carries over between calls
+
+def test_drained_tenants_leave_the_ring():
+    active = [1, 2, 3]
+    sched = FairShareScheduler({}, refresh_seconds=60, active=lambda _: list(active))
+    assert sched.plan(None, 1) == {1: 1}
+    sched.drained(2)
+    sched.drained(9)  # unknown tenants are ignored
+    assert sched.plan(None, 4) == {3: 2, 1: 2}
+    active[:] = []
+    sched.drained(1)
+    sched.drained(3)
+    assert sched.plan(None, 4) == {}  # an empty ring re-reads the active tenants
+
+def test_busy_tenant_cannot_starve_a_quiet_one(queue, monkeypatch):
+    monkeypatch.setattr(getattr(queue, "_fair", job_queue.fair_share), "weights", {1: 3})
+    queue.enqueue_many([JobSpec(kind="bulk", tenant=1) for _ in range(50)])
+    queue.enqueue_many([JobSpec(kind="quiet", tenant=2) for _ in range(3)])
+    first = Counter(j["tenant"] for j in queue.claim("agent-1", 8))
+    assert first == {1: 6, 2: 2}
+    rest = Counter(j["tenant"] for _ in range(10) for j in queue.claim("agent-1", 5))
+    assert rest == {1: 44, 2: 1}
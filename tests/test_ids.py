@@ -0,0 +1,31 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from sentinel_engine import ids
+from sentinel_engine.ids import new_id
+
+def test_ids_are_uuidv7_with_the_current_time():
+    before = time.time_ns() // 1_000_000
+    u = uuid.UUID(new_id())
+    assert u.version == 7 and u.variant == uuid.RFC_4122
+    assert before <= u.int >> 80 <= time.time_ns() // 1_000_000 + 1
+
+def test_ids_increase_across_threads():
+    with ThreadPoolExecutor(4) as pool:
+        minted = [i for batch in pool.map(lambda _: [new_id() for _ in range(2000)], range(4)) for i in batch]
+    assert len(set(minted)) == len(minted)
+    assert sorted(minted) == sorted(minted, key=lambda i: uuid.UUID(i).int)
+
+def test_clock_stepping_back_keeps_order(monkeypatch):
+    first = new_id()
+    monkeypatch.setattr(time, "time_ns", lambda: (ids._last_ms - 5000) * 1_000_000)
+    assert new_id() > first
+
+def test_sequence_overflow_borrows_the_next_millisecond(monkeypatch):
+    new_id()
+    frozen = ids._last_ms
+    monkeypatch.setattr(time, "time_ns", lambda: frozen * 1_000_000)
+    minted = [new_id() for _ in range(0x1001)]
+    assert minted == sorted(minted) and len(set(minted)) == len(minted)
+    assert uuid.UUID(minted[-1]).int >> 80 == frozen + 1
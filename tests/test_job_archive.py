@@ -0,0 +1,58 @@
+import json
+from datetime import timedelta
+
+from sentinel_engine.config import settings
+from sentinel_engine.job_archive import archive_batch, archive_finished
+from sentinel_engine.queue_backend import JobSpec
+from conftest import rows
+
+def _finish(queue, n):
+    jobs = queue.enqueue_many([JobSpec(kind="scan") for _ in range(n)])
+    queue.claim("agent-1", n)
+    queue.complete([(j["id"], "completed", '{"ok": true}') for j in jobs])
+    return [j["id"] for j in jobs]
+
+def test_finished_jobs_move_in_batches(sqlite_queue, engine):
+    ids = _finish(sqlite_queue, 5)
+    live = sqlite_queue.enqueue(JobSpec(kind="scan"))
+    assert archive_batch(timedelta(0), batch_size=2) == 2
+    assert archive_finished(timedelta(0), batch_size=2) == 3
+    assert rows(engine, "SELECT id FROM jobs") == [(live["id"],)]
+    assert sorted(r[0] for r in rows(engine, "SELECT id FROM jobs_archive")) == sorted(ids)
+    assert archive_batch(timedelta(0)) == 0
+
+def test_retention_window_is_respected(sqlite_queue):
+    _finish(sqlite_queue, 2)
+    assert sqlite_queue.archive(timedelta(hours=1)) == 0
+
+def test_archived_jobs_stay_readable(sqlite_queue):
+    (job_id,) = _finish(sqlite_queue, 1)
+    sqlite_queue.archive(timedelta(0))
+    assert sqlite_queue.get(job_id) is None
+    archived = sqlite_queue.get(job_id, include_archive=True)
+    assert archived["id"] == job_id and archived["status"] == "completed"
+    assert [r["id"] for r in sqlite_queue.recent(10, include_archive=True)] == [job_id]
+
+def test_parents_stay_hot_until_their_children_finish(sqlite_queue, engine):
+    out = sqlite_queue.enqueue_graph({"a": JobSpec(kind="fetch"), "b": JobSpec(kind="merge", depends_on=["a"])})
+    sqlite_queue.claim("agent-1")
+    sqlite_queue.complete([(out["a"]["id"], "completed", '{"a": 1}')])
+    assert sqlite_queue.archive(timedelta(0)) == 0  # b still needs a's output at claim time
+    (child,) = sqlite_queue.claim("agent-1")
+    assert child["parent_outputs"] == {str(out["a"]["id"]): '{"a": 1}'}
+    sqlite_queue.complete([(out["b"]["id"], "completed", None)])
+    assert sqlite_queue.archive(timedelta(0)) == 2
+    assert rows(engine, "SELECT COUNT(*) FROM job_deps") == [(0,)]
+
+def test_outputs_stay_readable_after_archiving(sqlite_queue, engine, schema, monkeypatch):
+    monkeypatch.setattr(settings, "blob_inline_max_bytes", 256)
+    big = json.dumps({"data": "x" * 4096})
+    jobs = sqlite_queue.enqueue_many([JobSpec(kind="scan") for _ in range(2)])
+    sqlite_queue.claim("agent-1", 2)
+    sqlite_queue.complete([(jobs[0]["id"], "completed", big), (jobs[1]["id"], "failed", '{"e": 1}')])
+    assert sqlite_queue.archive(timedelta(0)) == 2
+    assert sqlite_queue.get(jobs[0]["id"], include_archive=True)["output_json"] == big
+    assert sqlite_queue.get(jobs[1]["id"], include_archive=True)["output_json"] == '{"e": 1}'
+    if schema == "orm":  # the results moved with their jobs
+        assert rows(engine, "SELECT COUNT(*) FROM results") == [(0,)]
+        assert rows(engine, "SELECT COUNT(*) FROM results_archive") == [(2,)]
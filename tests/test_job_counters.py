@@ -0,0 +1,43 @@
+from collections import Counter
+from datetime import timedelta
+
+from sentinel_engine.job_counters import STATUSES
+from sentinel_engine.queue_backend import JobSpec
+from conftest import rows
+
+def _mixed_workload(queue):
+    jobs = queue.enqueue_many([JobSpec(kind="scan", tenant=t) for t in (1, 1, 2, 2, 2, 3)])
+    queue.enqueue(JobSpec(kind="report", cron="@every 1h"))
+    queue.enqueue_graph({"a": JobSpec(kind="fetch"), "b": JobSpec(kind="merge", depends_on=["a"])})
+    leased = queue.claim("agent-1", 2, claimed_status="claimed")
+    queue.claim("agent-2", 2, claimed_status="in_progress")
+    queue.complete([(leased[0]["id"], "completed", None), (leased[1]["id"], "failed", None)])
+    return jobs
+
+def _totals(stats):
+    return {s: stats[s] for s in STATUSES if stats[s]}
+
+def test_totals_match_the_jobs(queue):
+    _mixed_workload(queue)
+    stats = queue.stats("tenant")
+    assert _totals(stats) == Counter(j["status"] for j in queue.recent(100))
+    assert stats["claimed"] == 0 and stats["in_progress"] == 2  # both leased ones finished
+    assert sum(sum(v.values()) for v in stats["by_tenant"].values()) == sum(_totals(stats).values())
+
+def test_claimed_jobs_are_counted(queue):
+    queue.enqueue_many([JobSpec(kind="scan") for _ in range(3)])
+    queue.claim("agent-1", 2, claimed_status="claimed")
+    stats = queue.stats()
+    assert (stats["queued"], stats["claimed"], stats["in_progress"]) == (1, 2, 0)
+
+def test_counters_match_group_by_status(sqlite_queue, engine):
+    _mixed_workload(sqlite_queue)
+    sqlite_queue.requeue_stale(0)
+    assert _totals(sqlite_queue.stats()) == dict(rows(engine, "SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+    assert set(dict(rows(engine, "SELECT status, 1 FROM jobs"))) <= set(STATUSES)
+
+def test_archiving_keeps_totals(sqlite_queue):
+    _mixed_workload(sqlite_queue)
+    before = sqlite_queue.stats("kind")
+    assert sqlite_queue.archive(timedelta(0)) == 2
+    assert sqlite_queue.stats("kind") == before
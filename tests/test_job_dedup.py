@@ -0,0 +1,52 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from sentinel_engine.config import settings
+from sentinel_engine.job_dedup import payload_hash
+from sentinel_engine.queue_backend import JobSpec
+
+def test_payload_hash_separates_kind_and_payload():
+    assert payload_hash("scan", None) == payload_hash("scan", "{}")
+    assert payload_hash("ab", "c") != payload_hash("a", "bc")
+
+def test_idempotency_key_returns_the_original_job(queue):
+    first = queue.enqueue(JobSpec(kind="scan", idempotency_key="k"))
+    again = queue.enqueue(JobSpec(kind="other", idempotency_key="k"))
+    assert again == {"id": first["id"], "status": "queued", "duplicate": True}
+    other_tenant = queue.enqueue(JobSpec(kind="scan", tenant=2, idempotency_key="k"))
+    assert other_tenant["id"] != first["id"] and not other_tenant.get("duplicate")
+    assert queue.stats()["queued"] == 2
+
+def test_key_is_released_after_the_window(queue, monkeypatch):
+    first = queue.enqueue(JobSpec(kind="scan", idempotency_key="k"))
+    monkeypatch.setattr(settings, "idempotency_window_seconds", -1)
+    second = queue.enqueue(JobSpec(kind="scan", idempotency_key="k"))
+    assert second["id"] != first["id"] and not second.get("duplicate")
+
+def test_duplicates_within_one_batch_collapse(queue):
+    out = queue.enqueue_many([JobSpec(kind="scan", idempotency_key="k"),
+                              JobSpec(kind="scan", idempotency_key="k"),
+                              JobSpec(kind="scan", payload_json='{"a": 1}', coalesce=True),
+                              JobSpec(kind="scan", payload_json='{"a": 1}', coalesce=True)])
+    assert out[1] == {**out[0], "duplicate": True}
+    assert out[3]["id"] == out[2]["id"] and out[3]["duplicate"]
+    assert queue.stats()["queued"] == 2
+
+def test_coalesce_only_while_queued(queue):
+    first = queue.enqueue(JobSpec(kind="scan", payload_json='{"a": 1}', coalesce=True))
+    assert queue.enqueue(JobSpec(kind="scan", payload_json='{"a": 1}', coalesce=True))["id"] == first["id"]
+    assert queue.enqueue(JobSpec(kind="scan", payload_json='{"a": 2}', coalesce=True))["id"] != first["id"]
+    assert queue.enqueue(JobSpec(kind="scan", payload_json='{"a": 1}'))["id"] != first["id"]  # not opted in
+    queue.claim("agent-1")
+    fresh = queue.enqueue(JobSpec(kind="scan", payload_json='{"a": 1}', coalesce=True))
+    assert fresh["id"] != first["id"] and not fresh.get("duplicate")
+
+def test_racing_submits_share_one_job(sqlite_queue):
+    start = threading.Barrier(8)
+
+    def submit(_):
+        start.wait()
+        return sqlite_queue.enqueue(JobSpec(kind="scan", idempotency_key="race"))["id"]
+
+    with ThreadPoolExecutor(8) as pool:
+        assert len(set(pool.map(submit, range(8)))) == 1
@@ -0,0 +1,88 @@
+import asyncio
+import importlib
+import json
+import threading
+
+from sentinel_engine import job_events
+from sentinel_engine.config import settings
+from sentinel_engine.job_events import RESET, EventFilter, JobEventBus
+from sentinel_engine.queue_backend import JobSpec
+
+def _job(job_id, kind="scan", tenant=1, status="queued"):
+    return {"id": job_id, "kind": kind, "tenant": tenant, "status": status}
+
+def _since(bus, seq, flt=None):
+    return [e for _, e in bus._replay(f"{bus.epoch}-{seq}", flt or EventFilter())]
+
+def test_subscribers_get_matching_events_from_any_thread():
+    bus = JobEventBus(100)
+
+    async def go():
+        sub, backlog = bus.subscribe(EventFilter(kinds={"scan"}, tenants={"2"}))
+        assert backlog == []
+        t = threading.Thread(target=bus.publish, args=("enqueued", [_job("a"), _job("b", tenant=2),
+                                                                    _job("c", kind="mail", tenant=2)]))
+        t.start()
+        t.join()
+        got = await sub.next(1)
+        assert await sub.next(0.05) is None
+        bus.unsubscribe(sub)
+        return got
+
+    cursor, event = asyncio.run(go())
+    assert cursor == f"{bus.epoch}-2" and (event["type"], event["id"]) == ("enqueued", "b")
+
+def test_reconnect_replays_what_was_missed():
+    bus = JobEventBus(3)
+    bus.publish("enqueued", [_job(i) for i in "abcd"])
+    assert [e["id"] for e in _since(bus, 1)] == ["b", "c", "d"]
+    assert [e["id"] for e in _since(bus, 2, EventFilter(job_ids={"d"}))] == ["d"]
+    assert _since(bus, 4) == []
+    for stale in ("0-2", f"{bus.epoch}-0", f"{bus.epoch}-9", f"{bus.epoch}-x"):
+        assert [e["type"] for _, e in bus._replay(stale, EventFilter())] == [RESET]
+
+def test_slow_subscriber_is_cut_off_with_a_reset(monkeypatch):
+    monkeypatch.setattr(settings, "job_events_queue_size", 2)
+    bus = JobEventBus(100)
+
+    async def go():
+        sub, _ = bus.subscribe(EventFilter())
+        bus.publish("enqueued", [_job(i) for i in "abcde"])
+        await asyncio.sleep(0)
+        return sub, await sub.next(1), await sub.next(0.05)
+
+    sub, first, rest = asyncio.run(go())
+    assert sub.overflowed and first == (None, {"type": RESET, "reason": "slow consumer"}) and rest is None
+
+def test_backends_publish_each_transition(queue):
+    bus = job_events.bus
+    seq = bus._seq
+    job = queue.enqueue(JobSpec(kind="scan", tenant=3))
+    queue.claim("agent-1")
+    queue.complete([(job["id"], "failed", None)])
+    events = _since(bus, seq)
+    assert [(e["type"], e["status"]) for e in events] == [("enqueued", "queued"), ("claimed", "claimed"),
+                                                            ("completed", "failed")]
+    assert {(e["id"], e["kind"], e["tenant"]) for e in events} == {(job["id"], "scan", 3)}
+
+class _Request:
+    def __init__(self, headers):
+        self.headers = headers
+
+    async def is_disconnected(self):
+        return True
+
+def test_sse_stream_resumes_from_last_event_id(engine):  # the import creates its tables
+    jobs_routes = importlib.import_module("sentinel_engine.routes.jobs")
+    bus = job_events.bus
+
+    async def go():
+        start = f"{bus.epoch}-{bus._seq}"
+        bus.publish("enqueued", [_job("sse-1"), _job("sse-2", kind="mail")])
+        resp = await jobs_routes._events(_Request({"last-event-id": start}), "scan", None, None, None)
+        return [chunk async for chunk in resp.body_iterator]
+
+    (chunk,) = asyncio.run(go())
+    head, kind, data = chunk.rstrip("\n").split("\n")
+    assert head == f"id: {bus.epoch}-{bus._seq - 1}" and kind == "event: enqueued"
+    assert json.loads(data.removeprefix("data: "))["id"] == "sse-1"
@@ -0,0 +1,96 @@
+import json
+
+import pytest
+from sqlalchemy import event
+
+from sentinel_engine.job_graph import GraphError, topo_order
+from sentinel_engine.job_queue import ensure_job_schema
+from sentinel_engine.queue_backend import JobSpec
+from conftest import create_schema, rows
+
+def _fan_in(queue):
+    ids = queue.enqueue_graph({
+        "a": JobSpec(kind="fetch", payload_json='{"n": 1}'),
+        "b": JobSpec(kind="fetch", payload_json='{"n": 2}'),
+        "join": JobSpec(kind="merge", depends_on=["a", "b"]),
+    })
+    return {k: v["id"] for k, v in ids.items()}, ids
+
+def test_fan_in_waits_for_every_parent(queue):
+    ids, out = _fan_in(queue)
+    assert out["join"]["status"] == "waiting"
+    claimed = queue.claim("agent-1", 10)
+    assert sorted(str(j["id"]) for j in claimed) == sorted(str(ids[k]) for k in ("a", "b"))
+
+    queue.complete([(ids["a"], "completed", '{"a": true}')])
+    assert queue.get(ids["join"])["status"] == "waiting"
+    queue.complete([(ids["b"], "completed", '{"b": true}')])
+    assert queue.get(ids["join"])["status"] == "queued"
+
+    (join,) = queue.claim("agent-1", 10)
+    assert join["id"] == ids["join"]
+
+def test_fan_in_with_ids_from_the_url(sqlite_queue, engine):
+    # complete routes pass the path id as text, also on the INTEGER-id schema
+    ids, _ = _fan_in(sqlite_queue)
+    sqlite_queue.claim("agent-1", 10)
+    sqlite_queue.complete([(str(ids["a"]), "completed", json.dumps({"id": ids["a"]}))])
+    sqlite_queue.complete([(str(ids["b"]), "completed", json.dumps({"id": ids["b"]}))])
+
+    assert rows(engine, "SELECT status, pending_deps FROM jobs WHERE id=?", (ids["join"],)) == [("queued", 0)]
+    (join,) = sqlite_queue.claim("agent-1", 10)
+    assert join["parent_outputs"] == {str(ids[k]): json.dumps({"id": ids[k]}) for k in ("a", "b")}
+
+def test_claim_and_complete_reuse_the_cached_columns(sqlite_queue, engine):
+    ids, _ = _fan_in(sqlite_queue)
+    sqlite_queue.claim("agent-1", 10)
+    seen = []
+    event.listen(engine, "before_cursor_execute", lambda *a: seen.append(a[2]))
+    sqlite_queue.complete([(ids["a"], "completed", None), (ids["b"], "completed", None)])
+    (join,) = sqlite_queue.claim("agent-1", 10)
+    sqlite_queue.complete([(join["id"], "failed", None)])
+    assert seen and not [s for s in seen if s.lstrip().upper().startswith("PRAGMA")]
+
+def test_failed_parent_fails_descendants(queue):
+    out = queue.enqueue_graph({
+        "a": JobSpec(kind="fetch"),
+        "b": JobSpec(kind="merge", depends_on=["a"]),
+        "c": JobSpec(kind="report", depends_on=["b"]),
+    })
+    queue.claim("agent-1", 10)
+    queue.complete([(out["a"]["id"], "failed", None)])
+    assert queue.get(out["b"]["id"])["status"] == "failed"
+    assert queue.get(out["c"]["id"])["status"] == "failed"
+
+def test_repeated_complete_settles_children_once(queue):
+    out = queue.enqueue_graph({
+        "a": JobSpec(kind="fetch"),
+        "b": JobSpec(kind="fetch"),
+        "join": JobSpec(kind="merge", depends_on=["a", "b"]),
+    })
+    queue.claim("agent-1", 10)
+    queue.complete([(out["a"]["id"], "completed", None)])
+    queue.complete([(out["a"]["id"], "completed", None)])  # replayed by the worker's spool
+    assert queue.get(out["join"]["id"])["status"] == "waiting"
+
+def test_topo_order_rejects_cycles_and_duplicates():
+    with pytest.raises(GraphError):
+        topo_order([{"key": "a", "depends_on": ["b"]}, {"key": "b", "depends_on": ["a"]}])
+    with pytest.raises(GraphError):
+        topo_order([{"key": "a"}, {"key": "a"}])
+    order = topo_order([{"key": "c", "depends_on": ["a", "b"]}, {"key": "a"}, {"key": "b", "depends_on": ["a"]}])
+    assert [n["key"] for n in order] == ["a", "b", "c"]
+
+def test_unknown_dependency_is_rejected(queue):
+    with pytest.raises(GraphError):
+        queue.enqueue_graph({"a": JobSpec(kind="x", depends_on=["no-such-job"])})
+
+def test_untyped_job_deps_is_migrated(engine):
+    create_schema(engine, "orm")
+    with engine.begin() as cx:
+        cx.exec_driver_sql("CREATE TABLE job_deps (parent_id NOT NULL, child_id NOT NULL, "
+                           "PRIMARY KEY (parent_id, child_id)) WITHOUT ROWID")
+        cx.exec_driver_sql("INSERT INTO job_deps VALUES ('1', '3'), (2, 3)")
+        ensure_job_schema(cx)
+    assert rows(engine, "SELECT typeof(parent_id), typeof(child_id) FROM job_deps ORDER BY parent_id") == [
+        ("integer", "integer"), ("integer", "integer")]
@@ -0,0 +1,74 @@
+import asyncio
+import importlib.util
+import logging
+import os
+import threading
+
+import pytest
+
+from sentinel_engine.job_lanes import Lanes, cpu_bound, parse_lanes, shared
+from conftest import ROOT
+
+@cpu_bound
+def crunch(arg):
+    return {"pid": os.getpid(), "n": len(arg["blob"])}
+
+def blocking(arg):
+    return threading.current_thread().name
+
+async def awaiting(arg):
+    return arg * 2
+
+def test_parse_lanes():
+    assert parse_lanes("a:process, b : thread,junk") == {"a": "process", "b": "thread"}
+    with pytest.raises(ValueError):
+        parse_lanes("a:gpu")
+
+def test_lane_for_defaults_and_policy():
+    lanes = Lanes({"awaiting": "thread"})
+    try:
+        assert lanes.lane_for("crunch", crunch) == "process"
+        assert lanes.lane_for("blocking", blocking) == "thread"
+        assert lanes.lane_for("other", awaiting) == "inline"
+        assert lanes.lane_for("awaiting", awaiting) == "thread"
+    finally:
+        lanes.close()
+
+def test_inline_and_thread_lanes():
+    lanes = Lanes()
+
+    async def go():
+        return await lanes.run("a", awaiting, 21), await lanes.run("b", blocking, None)
+
+    try:
+        doubled, thread = asyncio.run(go())
+    finally:
+        lanes.close()
+    assert doubled == 42 and thread.startswith("job-lane")
+
+def test_process_lane_with_and_without_shared_memory():
+    lanes = Lanes(process_workers=1, shm_threshold=1024)
+
+    async def go():
+        return (await lanes.run("crunch", crunch, {"blob": "x" * 10}),
+                await lanes.run("crunch", crunch, {"blob": "x" * 4096}))
+
+    try:
+        small, large = asyncio.run(go())
+    finally:
+        lanes.close()
+    assert small["n"] == 10 and large["n"] == 4096
+    assert small["pid"] == large["pid"] != os.getpid()
+
+def test_worker_import_has_no_side_effects(monkeypatch):
+    # process-lane children import the worker module again: no .env read
+    # (there is none here), no log file handler
+    monkeypatch.delenv("SENTINEL_API_KEY", raising=False)
+    spec = importlib.util.spec_from_file_location("agent_worker_child", ROOT / "ops" / "agent_worker.py")
+    spec.loader.exec_module(importlib.util.module_from_spec(spec))
+    assert not logging.getLogger("worker").handlers
+
+def test_worker_shares_its_lanes_and_warms_for_cpu_bound_kinds(worker):
+    # @cpu_bound safety_scan reaches the process lane without SENTINEL_JOB_LANES
+    assert worker.lanes.policy == {} and worker.process_kinds() == ["safety_scan"]
+    assert shared() is worker.lanes
@@ -0,0 +1,41 @@
+import time
+
+from sentinel_engine.config import settings
+from sentinel_engine.queue_backend import JobSpec
+
+def _at(monkeypatch, t):
+    monkeypatch.setattr(time, "time", lambda: t)
+
+def test_lapsed_lease_returns_the_job_to_the_queue(queue, monkeypatch):
+    job = queue.enqueue(JobSpec(kind="scan"))
+    start = time.time()
+    queue.claim("agent-1")
+    assert queue.requeue_expired() == 0
+    assert queue.held_by("agent-1", [job["id"]]) == [job["id"]]
+    _at(monkeypatch, start + settings.job_lease_seconds + 5)
+    assert queue.requeue_expired() == 1
+    assert queue.get(job["id"])["status"] == "queued"
+    assert queue.held_by("agent-1", [job["id"]]) == []
+    assert [j["id"] for j in queue.claim("agent-2")] == [job["id"]]
+    assert queue.held_by("agent-2", [job["id"]]) == [job["id"]]
+
+def test_extending_the_lease_keeps_the_job(queue, monkeypatch):
+    jobs = queue.enqueue_many([JobSpec(kind="scan") for _ in range(3)])
+    start = time.time()
+    queue.claim("agent-1", 2)
+    queue.claim("agent-2")
+    _at(monkeypatch, start + settings.job_lease_seconds - 1)
+    assert queue.extend_lease("agent-1") == 2
+    _at(monkeypatch, start + settings.job_lease_seconds + 5)
+    assert queue.requeue_expired() == 1  # only agent-2's job
+    assert queue.held_by("agent-1", [j["id"] for j in jobs]) == [j["id"] for j in jobs[:2]]
+
+def test_finished_jobs_are_not_reaped(queue, monkeypatch):
+    job = queue.enqueue(JobSpec(kind="scan"))
+    start = time.time()
+    queue.claim("agent-1")
+    queue.complete([(job["id"], "completed", None)])
+    assert queue.held_by("agent-1", [job["id"]]) == []
+    _at(monkeypatch, start + settings.job_lease_seconds + 5)
+    assert queue.requeue_expired() == 0
+    assert queue.get(job["id"])["status"] == "completed"
@@ -0,0 +1,70 @@
+import importlib
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from sentinel_engine import queue_backend
+from sentinel_engine.queue_backend import JobQuery, JobSpec
+
+def _ids(jobs):
+    return [j["id"] for j in jobs]
+
+def _seed(queue):
+    jobs = queue.enqueue_many([JobSpec(kind=k) for k in ("scan", "mail", "scan", "scan", "mail")])
+    queue.claim("agent-1", 2)
+    return _ids(jobs)
+
+def test_pages_are_newest_first_and_disjoint(queue):
+    ids = _seed(queue)
+    first = queue.list_jobs(JobQuery(), 2)
+    second = queue.list_jobs(JobQuery(), 2, before=first[-1]["id"])
+    third = queue.list_jobs(JobQuery(), 2, before=second[-1]["id"])
+    assert _ids(first + second + third) == ids[::-1]
+
+def test_filters(queue):
+    ids = _seed(queue)
+    assert _ids(queue.list_jobs(JobQuery(kind={"mail"}), 10)) == [ids[4], ids[1]]
+    assert _ids(queue.list_jobs(JobQuery(status={"claimed"}), 10)) == ids[1::-1]
+    assert _ids(queue.list_jobs(JobQuery(status={"queued"}, kind={"scan"}), 10)) == [ids[3], ids[2]]
+    assert _ids(queue.list_jobs(JobQuery(agent="agent-1"), 10)) == ids[1::-1]
+    now = datetime.now(timezone.utc)
+    assert len(queue.list_jobs(JobQuery(created_after=now - timedelta(minutes=1)), 10)) == 5
+    assert queue.list_jobs(JobQuery(created_before=now - timedelta(minutes=1)), 10) == []
+
+def test_export_walks_every_page(queue):
+    ids = _seed(queue)
+    assert _ids(queue.export(JobQuery(), batch=2)) == ids[::-1]
+    assert _ids(queue.export(JobQuery(kind={"scan"}), before=ids[3], batch=1)) == [ids[2], ids[0]]
+
+@pytest.fixture
+def client(sqlite_queue, monkeypatch):
+    module = importlib.import_module("sentinel_engine.routes.jobs_admin_mvp")
+    monkeypatch.setattr(queue_backend, "_backend", sqlite_queue)
+    app = FastAPI()
+    app.include_router(module.router)
+    with TestClient(app) as c:
+        yield c
+
+def test_cursor_pagination_route(client, sqlite_queue):
+    ids = _seed(sqlite_queue)
+    seen, cursor = [], None
+    while True:
+        page = client.get("/v0/jobs", params={"limit": 2, **({"cursor": cursor} if cursor else {})}).json()
+        seen += [j["id"] for j in page["jobs"]]
+        cursor = page.get("next_cursor")
+        if not cursor:
+            break
+    assert seen == ids[::-1]
+    assert client.get("/v0/jobs", params={"cursor": "not-a-cursor"}).status_code == 400
+    mail = client.get("/v0/jobs", params={"kind": "mail", "status": "queued"}).json()["jobs"]
+    assert [j["id"] for j in mail] == [ids[4]]
+
+def test_ndjson_export_route(client, sqlite_queue):
+    ids = _seed(sqlite_queue)
+    r = client.get("/v0/jobs", params={"format": "ndjson", "status": "queued,claimed"})
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in r.text.splitlines()]
+    assert [j["id"] for j in lines] == ids[::-1] and "payload_json" in lines[0]
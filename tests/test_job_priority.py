@@ -0,0 +1,27 @@
+import itertools
+
+from sentinel_engine import job_queue
+from sentinel_engine.config import settings
+from sentinel_engine.queue_backend import JobSpec
+
+def _kinds(jobs):
+    return [j["kind"] for j in jobs]
+
+def test_higher_priority_is_claimed_first_then_oldest(queue):
+    for kind, prio in (("low", 0), ("high-1", 5), ("mid", 1), ("high-2", 5)):
+        queue.enqueue(JobSpec(kind=kind, priority=prio))
+    assert _kinds(queue.claim("agent-1")) == ["high-1"]
+    assert _kinds(queue.claim("agent-1", 10)) == ["high-2", "mid", "low"]
+
+def test_aging_hands_every_nth_claim_to_the_oldest_job(queue, monkeypatch):
+    monkeypatch.setattr(settings, "queue_aging_every", 3)
+    monkeypatch.setattr(job_queue, "_claims", itertools.count(1))
+    queue.enqueue(JobSpec(kind="old-low", priority=0))
+    queue.enqueue_many([JobSpec(kind=f"high-{i}", priority=9) for i in range(4)])
+    claimed = [_kinds(queue.claim("agent-1")) for _ in range(4)]
+    assert claimed == [["high-0"], ["high-1"], ["old-low"], ["high-2"]]
+
+def test_without_aging_priority_is_strict(queue):
+    queue.enqueue(JobSpec(kind="old-low", priority=0))
+    queue.enqueue_many([JobSpec(kind="high", priority=9) for _ in range(3)])
+    assert _kinds(queue.claim("agent-1", 3)) == ["high"] * 3
@@ -0,0 +1,61 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from sentinel_engine import job_queue
+from sentinel_engine.job_queue import _claim_sql, claim_batch, claim_next, ensure_job_schema
+from sentinel_engine.queue_backend import JobSpec
+from conftest import rows
+
+# the jobs table as routes/jobs.py first created it
+ORIGINAL_JOBS_DDL = """
+CREATE TABLE jobs (
+  id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload_json TEXT, status TEXT NOT NULL DEFAULT 'queued',
+  created_at TEXT NOT NULL, claimed_by TEXT, claimed_at TEXT, completed_at TEXT, output_json TEXT
+)
+"""
+
+def test_claim_leases_the_job_to_the_agent(sqlite_queue, engine, schema):
+    job = sqlite_queue.enqueue(JobSpec(kind="scan", payload_json='{"n": 1}'))
+    got = claim_next("agent-1" if schema == "text" else 7)
+    assert (got["id"], got["kind"], got["payload_json"], got["status"]) == (job["id"], "scan", '{"n": 1}', "claimed")
+    agent_col = "claimed_by" if schema == "text" else "agent_id"
+    ((status, agent, lease),) = rows(engine, f"SELECT status, {agent_col}, lease_expires_at FROM jobs")
+    assert status == "claimed" and str(agent) in ("agent-1", "7") and lease is not None
+    assert claim_next("agent-2") is None
+    assert claim_batch("agent-2", 10) == []
+
+def test_concurrent_claimers_never_share_a_job(sqlite_queue):
+    sqlite_queue.enqueue_many([JobSpec(kind="scan") for _ in range(200)])
+    start = threading.Barrier(8)
+
+    def drain(n):
+        start.wait()
+        got = []
+        while batch := claim_batch(f"agent-{n}", 3):
+            got += [j["id"] for j in batch]
+        return got
+
+    with ThreadPoolExecutor(8) as pool:
+        claimed = [i for ids in pool.map(drain, range(8)) for i in ids]
+    assert len(claimed) == len(set(claimed)) == 200
+
+def test_original_jobs_table_is_migrated(engine):
+    with engine.begin() as cx:
+        cx.exec_driver_sql(ORIGINAL_JOBS_DDL)
+        cx.exec_driver_sql("INSERT INTO jobs(id, kind, created_at) VALUES ('a', 'scan', '2026-01-01T00:00:00')")
+        cols = ensure_job_schema(cx)
+    assert set(job_queue.JOB_COLUMN_MIGRATIONS) <= cols and "output_blob" in cols
+    indexes = {r[0] for r in rows(engine, "SELECT name FROM sqlite_master WHERE type='index'")}
+    assert {"ix_jobs_queued_prio", "ix_jobs_queued_tenant", "ix_jobs_lease"} <= indexes
+    assert claim_next("agent-1")["id"] == "a"
+
+@pytest.mark.parametrize("batch", [False, True])
+@pytest.mark.parametrize("fifo,tenant", [(False, False), (False, True), (True, False)])
+def test_claims_walk_an_index_in_queue_order(sqlite_queue, engine, batch, fifo, tenant):
+    sqlite_queue.enqueue_many([JobSpec(kind="scan", priority=n % 3, tenant=n % 2) for n in range(50)])
+    with engine.begin() as cx:
+        sql, params = _claim_sql(ensure_job_schema(cx), batch=batch, fifo=fifo, tenant=tenant)
+        plan = " | ".join(r[-1] for r in cx.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", (1,) * len(params)))
+    assert "TEMP B-TREE" not in plan, plan
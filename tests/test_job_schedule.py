@@ -0,0 +1,55 @@
+import json
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from sentinel_engine.config import settings
+from sentinel_engine.job_schedule import ScheduleError, cron_next, every_seconds
+from sentinel_engine.queue_backend import JobSpec
+
+def _ts(*args) -> float:
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+def test_cron_next():
+    start = _ts(2026, 3, 14, 10, 7, 30)  # a Saturday
+    assert cron_next("@daily", start) == _ts(2026, 3, 15)
+    assert cron_next("*/15 * * * *", start) == _ts(2026, 3, 14, 10, 15)
+    assert cron_next("0 9-17 * * 1-5", start) == _ts(2026, 3, 16, 9)
+    assert cron_next("0 0 1 * 0", start) == _ts(2026, 3, 15)  # dom or dow once both are set
+    assert cron_next("30 4 29 2 *", start) == _ts(2028, 2, 29, 4, 30)
+    assert cron_next("@every 90s", start) == start + 90
+    assert every_seconds("@every 2h") == 7200 and every_seconds("@hourly") is None
+
+@pytest.mark.parametrize("spec", ["* * *", "61 * * * *", "@every 0", "@yearly", "0 0 31 2 *"])
+def test_bad_schedules_raise(spec):
+    with pytest.raises(ScheduleError):
+        cron_next(spec, time.time())
+
+def test_delayed_job_is_promoted_when_due(queue, monkeypatch):
+    now = time.time()
+    job = queue.enqueue(JobSpec(kind="scan", run_at=now + 60))
+    assert job["status"] == "scheduled" and queue.next_run_at() == pytest.approx(now + 60)
+    assert queue.claim("agent-1") == []
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert queue.promote_due() == 1
+    assert [j["id"] for j in queue.claim("agent-1")] == [job["id"]]
+    assert queue.next_run_at() is None
+
+def test_recurring_template_queues_one_copy_per_occurrence(queue, monkeypatch):
+    monkeypatch.setattr(settings, "blob_inline_max_bytes", 64)
+    payload = json.dumps({"report": "r" * 200})
+    template = queue.enqueue(JobSpec(kind="report", payload_json=payload, cron="@every 10m"))
+    first = queue.next_run_at()
+    monkeypatch.setattr(time, "time", lambda: first + 1)
+    assert queue.promote_due() == 1
+    assert queue.promote_due() == 0
+    (copy,) = queue.claim("agent-1")
+    assert copy["id"] != template["id"] and copy["kind"] == "report"
+    assert copy["payload_json"] == payload  # offloaded payloads are shared with the copy
+    assert queue.get(template["id"])["status"] == "scheduled"
+    assert queue.next_run_at() == pytest.approx(first + 1 + 600)
+
+def test_bad_cron_is_rejected_at_enqueue(queue):
+    with pytest.raises(ScheduleError):
+        queue.enqueue(JobSpec(kind="report", cron="not a schedule"))
@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+import pytest
+
+from sentinel_engine.job_telemetry import (BUCKETS, FleetTelemetry, Histogram, Telemetry, parse_ts,
+                                           serve_prometheus)
+
+def test_parse_ts():
+    assert parse_ts("1970-01-01T00:01:00Z") == 60
+    assert parse_ts("1970-01-01 00:01:00.5") == 60.5  # naive is UTC (ORM timestamps)
+    assert parse_ts(None) is None and parse_ts("yesterday") is None
+
+def test_histogram_buckets_and_quantiles():
+    h = Histogram()
+    for s in (0.001, 0.02, 0.02, 0.02, 7200, -1):
+        h.observe(s)
+    assert h.count == 6 and h.sum == pytest.approx(7200.061)
+    assert h.counts[0] == 2 and h.counts[BUCKETS.index(0.025)] == 3 and h.counts[-1] == 1
+    assert h.quantile(0.5) == pytest.approx(0.01 + 0.015 * 1 / 3)
+    assert h.quantile(0.99) == BUCKETS[-1]
+    assert Histogram().quantile(0.5) is None
+
+def test_fleet_merges_the_latest_snapshot_per_agent(monkeypatch):
+    a, b = Telemetry(), Telemetry()
+    a.observe("handler_duration", 0.3, "scan")
+    a.observe("claim_latency", 0.01)
+    b.observe("handler_duration", 0.4, "scan")
+    fleet = FleetTelemetry(ttl=60)
+    fleet.record("a", a.snapshot())
+    a.observe("handler_duration", 0.3, "scan")
+    fleet.record("a", a.snapshot())  # cumulative: replaces, not adds
+    fleet.record("b", b.snapshot())
+    summary = fleet.summary()
+    assert summary["agents"] == 2
+    assert summary["metrics"]["handler_duration"]["scan"]["count"] == 3
+    assert summary["metrics"]["claim_latency"]["*"]["mean"] == pytest.approx(0.01)
+    later = time.monotonic() + 61
+    monkeypatch.setattr(time, "monotonic", lambda: later)
+    assert fleet.summary() == {"agents": 0, "metrics": {}}
+
+@pytest.mark.parametrize("snap", [
+    None,
+    {"buckets": [1, 2], "series": []},
+    {"buckets": list(BUCKETS), "series": [{"metric": "nope", "counts": [0] * (len(BUCKETS) + 1), "sum": 0}]},
+    {"buckets": list(BUCKETS), "series": [{"metric": "queue_wait", "counts": [1], "sum": 0}]},
+    {"buckets": list(BUCKETS), "series": [{"metric": "queue_wait", "sum": 0}]},
+])
+def test_malformed_snapshots_are_rejected(snap):
+    with pytest.raises(ValueError):
+        FleetTelemetry(ttl=60).record("a", snap)
+
+def test_prometheus_rendering():
+    t = Telemetry()
+    t.observe("queue_wait", 0.2, 'we"ird')
+    t.observe("queue_wait", 2, 'we"ird')
+    t.observe("claim_latency", 0.01)
+    text = t.render()
+    assert "# TYPE sentinel_worker_queue_wait_seconds histogram" in text
+    assert 'sentinel_worker_queue_wait_seconds_bucket{kind="we\\"ird",le="0.25"} 1' in text
+    assert 'sentinel_worker_queue_wait_seconds_bucket{kind="we\\"ird",le="+Inf"} 2' in text
+    assert 'sentinel_worker_queue_wait_seconds_count{kind="we\\"ird"} 2' in text
+    assert "sentinel_worker_claim_latency_seconds_count 1" in text
+    assert "handler_duration" not in text
+
+def test_metrics_endpoint():
+    t = Telemetry()
+    t.observe("claim_latency", 0.01)
+
+    async def fetch(path):
+        server = await serve_prometheus(t, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: x\r\n\r\n".encode())
+            await writer.drain()
+            return (await reader.read()).decode()
+        finally:
+            server.close()
+
+    ok = asyncio.run(fetch("/metrics?x=1"))
+    assert ok.startswith("HTTP/1.1 200 OK") and ok.endswith(t.render())
+    assert asyncio.run(fetch("/")).startswith("HTTP/1.1 404")
@@ -0,0 +1,30 @@
+import importlib
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from sentinel_engine import queue_backend
+from sentinel_engine.config import settings
+from sentinel_engine.queue_backend import JobSpec
+
+@pytest.fixture
+def client(sqlite_queue, monkeypatch):
+    monkeypatch.setattr(queue_backend, "_backend", sqlite_queue)
+    monkeypatch.setattr(settings, "blob_inline_max_bytes", 256)
+    app = FastAPI()
+    for name in ("jobs_claim_mvp", "jobs_admin_mvp"):
+        app.include_router(importlib.import_module(f"sentinel_engine.routes.{name}").router)
+    with TestClient(app) as c:
+        yield c
+
+def test_complete_returns_the_output_get_returns(client, sqlite_queue):
+    big = json.dumps({"data": "x" * 4096})
+    job = sqlite_queue.enqueue(JobSpec(kind="scan", payload_json=big))
+    claimed = client.get("/v0/jobs/claim", params={"agent_id": "a1"}).json()
+    assert claimed["id"] == job["id"] and claimed["payload_json"] == big
+    done = client.post(f"/v0/jobs/{job['id']}/complete", json={"status": "completed", "output_json": big}).json()
+    assert done["job"]["output_json"] == big and done["job"]["payload_json"] == big
+    assert client.get(f"/v0/jobs/get/{job['id']}").json()["payload_json"] == big
+    assert sqlite_queue.get(job["id"])["output_json"] == big
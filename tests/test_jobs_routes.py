@@ -0,0 +1,131 @@
+import asyncio
+import importlib
+import importlib.util
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from sentinel_engine import queue_backend, task_queue
+from sentinel_engine.queue_backend import JobSpec
+from sentinel_engine.security import guard_api_key
+from sentinel_engine.sqlite_queue import SQLiteQueueBackend
+from conftest import ROOT
+
+@pytest.fixture
+def jobs_routes(engine, monkeypatch):
+    module = importlib.import_module("sentinel_engine.routes.jobs")
+    module.ensure_schema()  # this test's database
+    monkeypatch.setattr(queue_backend, "_backend", SQLiteQueueBackend())
+    # the long-poll condition binds to the first loop that waits on it
+    monkeypatch.setattr(task_queue, "_job_cond", asyncio.Condition())
+    monkeypatch.setattr(task_queue, "_job_loop", None)
+    return module
+
+@pytest.fixture
+def client(jobs_routes):
+    app = FastAPI()
+    app.include_router(jobs_routes.router_v0)
+    app.dependency_overrides[guard_api_key] = lambda: None
+    with TestClient(app) as c:
+        yield c
+
+def test_claim_returns_queued_jobs_without_waiting(client):
+    ids = [client.post("/v0/jobs/enqueue", json={"kind": "scan", "priority": p}).json()["id"] for p in (0, 5)]
+    started = time.monotonic()
+    got = client.get("/v0/jobs/claim", params={"agent_id": "a1", "max": 5, "wait": 30}).json()
+    assert [j["id"] for j in got["jobs"]] == ids[::-1]
+    assert time.monotonic() - started < 5
+
+class _Req:
+    """The Request a claim long-poll checks; `gone` flips to a disconnect after that many checks."""
+
+    def __init__(self, gone=None):
+        self.checks, self.gone = 0, gone
+
+    async def is_disconnected(self):
+        self.checks += 1
+        return self.gone is not None and self.checks > self.gone
+
+def test_long_poll_wakes_on_enqueue(jobs_routes):
+    async def go():
+        waiter = asyncio.create_task(jobs_routes._claim_wait(_Req(), "a1", None, 10))
+        await asyncio.sleep(0.1)
+        await asyncio.to_thread(queue_backend.get_queue().enqueue, JobSpec(kind="scan"))
+        return await asyncio.wait_for(waiter, 5)
+
+    started = time.monotonic()
+    assert asyncio.run(go())["kind"] == "scan"
+    assert time.monotonic() - started < 5
+
+def test_long_poll_stops_when_the_client_leaves(jobs_routes):
+    q = queue_backend.get_queue()
+    (job,) = q.enqueue_many([JobSpec(kind="scan")])
+    # gone before the claim: nothing is leased
+    assert asyncio.run(jobs_routes._claim_wait(_Req(gone=0), "a1", 2, 10)) == {}
+    assert q.get(job["id"])["status"] == "queued"
+    # gone by the time the claim returns: the job is handed back at once
+    req = _Req(gone=1)
+    assert asyncio.run(jobs_routes._claim_wait(req, "a1", 2, 10)) == {}
+    assert req.checks == 2 and q.get(job["id"])["status"] == "queued"
+
+def test_waits_past_the_cap_are_cut_not_rejected(client, jobs_routes, monkeypatch):
+    monkeypatch.setattr(jobs_routes, "MAX_CLAIM_WAIT", 0.2)
+    started = time.monotonic()
+    r = client.get("/v0/jobs/claim", params={"agent_id": "a1", "wait": 600})
+    assert r.status_code == 200 and r.json() == {}
+    assert time.monotonic() - started < 5
+
+def test_worker_caps_its_claim_wait(monkeypatch, jobs_routes):
+    monkeypatch.setenv("SENTINEL_CLAIM_WAIT", "600")
+    spec = importlib.util.spec_from_file_location("agent_worker_claim_wait", ROOT / "ops" / "agent_worker.py")
+    worker = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(worker)
+    assert worker.CLAIM_WAIT == worker.MAX_CLAIM_WAIT == jobs_routes.MAX_CLAIM_WAIT
+
+def _ndjson(*lines):
+    return "\n".join(lines).encode()
+
+def test_bulk_enqueue_reports_each_line(client, jobs_routes, monkeypatch):
+    monkeypatch.setattr(jobs_routes, "BULK_CHUNK", 2)  # several chunks in one request
+    body = _ndjson(
+        '{"kind": "scan", "payload": {"n": 1}}',
+        '{"kind": "scan", "payload_json": "{\\"n\\": 2}", "priority": 3}',
+        "",
+        '{"kind": ""}',
+        '{"kind": "scan", "priority": "high"}',
+        '{"kind": "scan", "idempotency_key": "k"}',
+        '{"kind": "scan", "idempotency_key": "k"}',
+        '{"kind": "scan", "payload_json": "{\\"$blob\\": \\"sha256:00\\"}"}',
+    )
+    out = client.post("/v0/jobs/enqueue:bulk", content=body).json()
+    assert (out["enqueued"], out["duplicates"], out["failed"], out["ok"]) == (3, 1, 3, False)
+    by_line = {r["line"]: r for r in out["results"]}
+    assert sorted(by_line) == [1, 2, 4, 5, 6, 7, 8]
+    assert all("error" in by_line[n] for n in (4, 5, 8))
+    assert by_line[7] == {"line": 7, "id": by_line[6]["id"], "duplicate": True}
+    claimed = client.get("/v0/jobs/claim", params={"agent_id": "a1", "max": 10}).json()["jobs"]
+    assert claimed[0]["id"] == by_line[2]["id"] and len(claimed) == 3
+
+def test_bulk_enqueue_without_trailing_newline(client):
+    out = client.post("/v0/jobs/enqueue:bulk", content=_ndjson('{"kind": "a"}', '{"kind": "b"}')).json()
+    assert out["ok"] and out["enqueued"] == 2
+
+def test_batch_claim_and_complete(client):
+    ids = [client.post("/v0/jobs/enqueue", json={"kind": "scan"}).json()["id"] for _ in range(5)]
+    first = client.get("/v0/jobs/claim", params={"agent_id": "a1", "max": 3}).json()["jobs"]
+    rest = client.get("/v0/jobs/claim", params={"agent_id": "a2", "max": 3}).json()["jobs"]
+    assert [j["id"] for j in first + rest] == ids
+    assert client.get("/v0/jobs/claim", params={"agent_id": "a1", "max": 3}).json() == {"jobs": []}
+    assert client.get("/v0/jobs/claim", params={"agent_id": "a1", "max": 101}).status_code == 422
+    items = [{"id": j["id"], "status": "completed", "output_json": '{"ok": true}'} for j in first]
+    out = client.post("/v0/jobs/complete:batch", json=items + [{"id": "nope", "status": "failed"}]).json()
+    assert out == {"ok": True, "completed": 3, "missing": ["nope"]}
+
+def test_batch_complete_rejects_bad_statuses_up_front(client):
+    job_id = client.post("/v0/jobs/enqueue", json={"kind": "scan"}).json()["id"]
+    client.get("/v0/jobs/claim", params={"agent_id": "a1"})
+    r = client.post("/v0/jobs/complete:batch", json=[{"id": job_id, "status": "done"}])
+    assert r.status_code == 400 and r.json()["detail"] == {"error": "bad_status", "ids": [job_id]}
+    assert client.post(f"/v0/jobs/{job_id}/complete", json={"status": "completed"}).json()["ok"]
@@ -0,0 +1,50 @@
+import time
+from datetime import timedelta
+
+from sentinel_engine.memory_queue import MemoryQueueBackend
+from sentinel_engine.queue_backend import JobSpec
+
+def test_priority_then_enqueue_order():
+    q = MemoryQueueBackend(None)
+    low, high, low2 = q.enqueue_many([JobSpec(kind="a"), JobSpec(kind="b", priority=5), JobSpec(kind="c")])
+    assert [j["id"] for j in q.claim("agent-1", 3)] == [high["id"], low["id"], low2["id"]]
+
+def test_outputs_are_kept_and_first_result_wins():
+    q = MemoryQueueBackend(None)
+    job = q.enqueue(JobSpec(kind="scan"))
+    q.claim("agent-1")
+    assert q.complete([(job["id"], "completed", '{"n": 1}'), ("nope", "completed", None)]) == ["nope"]
+    q.complete([(job["id"], "failed", '{"n": 2}')])  # replayed by a worker's spool
+    got = q.get(job["id"])
+    assert (got["status"], got["output_json"]) == ("completed", '{"n": 1}')
+
+def test_snapshot_round_trip(tmp_path, monkeypatch):
+    path = str(tmp_path / "queue.json")
+    q = MemoryQueueBackend(path)
+    queued, leased, done = q.enqueue_many([JobSpec(kind="a", priority=1), JobSpec(kind="b", priority=2),
+                                           JobSpec(kind="c", priority=3, idempotency_key="k")])
+    q.claim("agent-1", 2)  # done, leased
+    q.complete([(done["id"], "completed", '{"ok": true}')])
+    stats = q.stats("kind")
+    q.close()
+
+    r = MemoryQueueBackend(path)
+    assert r.stats("kind") == stats
+    assert r.get(done["id"])["output_json"] == '{"ok": true}'
+    assert r.enqueue(JobSpec(kind="c", idempotency_key="k"))["duplicate"]
+    assert r.held_by("agent-1", [leased["id"], queued["id"]]) == [leased["id"]]
+    assert [j["id"] for j in r.claim("agent-2", 5)] == [queued["id"]]
+    # the restored lease lapses like the fresh one
+    lapsed = r.get(queued["id"])["lease_expires_at"] + 1
+    monkeypatch.setattr(time, "time", lambda: lapsed)
+    assert r.requeue_expired() == 2
+    assert [j["id"] for j in r.claim("agent-3", 5)] == [leased["id"], queued["id"]]
+
+def test_archive_drops_finished_jobs_but_keeps_totals():
+    q = MemoryQueueBackend(None)
+    jobs = q.enqueue_many([JobSpec(kind="scan") for _ in range(3)])
+    q.claim("agent-1", 2)
+    q.complete([(j["id"], "completed", None) for j in jobs[:2]])
+    stats = q.stats()
+    assert q.archive(timedelta(0)) == 2
+    assert q.get(jobs[0]["id"]) is None and q.stats() == stats